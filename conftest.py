@@ -36,3 +36,13 @@ def mock_token(mock_config):
 @pytest.fixture(scope="session")
 def mock_url(mock_config):
     return mock_config["url"]
+
+@pytest.fixture
+def redcap_server():
+    from tests import testdata
+    from tests.fakeserver import FakeRedcapServer
+    metadata = testdata.get_fake_project_metadata()
+    records = testdata.get_fake_project_records(metadata, n_records=50)
+    server = FakeRedcapServer(metadata=metadata, records=records).start()
+    yield server
+    server.stop()
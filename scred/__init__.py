@@ -2,8 +2,31 @@
 scred/__init__.py
 
 Contains everything intended for exposure to users.
+
+Names are imported from their modules on first access, so `import scred` is quick and
+e.g. `scred.RedcapProject` never imports pandas unless it's used with DataFrames.
 """
 
-from .project import RedcapProject
-from .dtypes import Record, RecordSet, DataDictionary
-from .webapi import RedcapRequester
+_EXPORTS = {
+    "RedcapProject": "project",
+    "Record": "dtypes",
+    "RecordSet": "dtypes",
+    "LazyRecordSet": "dtypes",
+    "DataDictionary": "dtypes",
+    "RedcapRequester": "webapi",
+    "ProjectGroup": "multi",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    module = importlib.import_module(f".{_EXPORTS[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value # only look it up once
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
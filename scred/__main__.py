@@ -0,0 +1,11 @@
+"""
+scred/__main__.py
+
+Lets the command line tool run as `python -m scred`.
+"""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
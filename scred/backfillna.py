@@ -15,29 +15,65 @@ This dataframe must contain at least these 2 columns:
     'response': the response provided in REDCap for each field
     'branching_logic': pythonic branching logic (see documentation)
 
-Calling parser.parse() will set the attribute parser.data to a copy of the initial DataFrame; but with a new column,
-`LOGIC_MET`, that is only True if the branching logic was satisfied by the record data. This column can be used to
-separate the two types of missing values, as implemented in the Record class (see scred/dtypes.py).
+Calling parser.parse_all_logic() will set the attribute parser.data to a copy of the initial DataFrame; but with a new
+column, `LOGIC_MET`, that is only True if the branching logic was satisfied by the record data. This column can be used
+to separate the two types of missing values, as implemented in the Record class (see scred/dtypes.py).
+
+Logic is evaluated by scred.rclogic, which understands REDCap functions and string comparisons and works on many records
+at once; `evaluate_logic` does that for a whole set of records. The original grammar below (`fullparse`) only handles
+`key op integer` comparisons joined by and/or, and is kept (built on first use) for anyone calling it directly.
 """
 
 import warnings
 
-import pyparsing as pp
-
-# ---------------------------------------------------
+import pandas as pd
 
-global key, operation, value, cond, joint, cond_chain, cond_chain_with_parentheses, logic
+from . import profiling
+from . import rclogic
 
-# Define elements of parser grammar
-key = pp.Word(pp.alphanums + '_')('key') # Variable name: alphanumeric + underscores.
-operation = pp.oneOf('> >= == != <= <')('operation') # Comparative operations.
-value = pp.Word(pp.nums + '-')('value') # Response value: Negative sign + digits.
-cond = pp.Group(key + operation + value)('condition') # Phrase group for a single logical expression.
-joint = pp.oneOf('and or') # Phrases that join logical statements together.
-cond_chain_with_parentheses = pp.Forward() # Tells parser there may be paren chain coming, inserted by '<<=='
-cond_chain = pp.Optional('(') + cond + pp.Optional(')') + pp.Optional(joint + cond_chain_with_parentheses)
-cond_chain_with_parentheses <<= cond_chain | '(' + cond_chain + ')' # Inserted at previous pp.Forward()
-logic = cond_chain_with_parentheses + pp.StringEnd() # The full grammar
+# ---------------------------------------------------
+# The grammar is only built (and pyparsing only imported) the first time it's used,
+# since most callers go through rclogic instead. Its pieces are still available as
+# module attributes, e.g. `backfillna.logic`.
+
+GRAMMAR_NAMES = (
+    "key", "operation", "value", "cond", "joint", "cond_chain",
+    "cond_chain_with_parentheses", "logic",
+)
+_legacy_grammar = None
+_active_parser = None # the Parser whose record `key` looks values up in
+
+def _build_legacy_grammar():
+    global _legacy_grammar
+    if _legacy_grammar is not None:
+        return _legacy_grammar
+    import pyparsing as pp
+
+    # Define elements of parser grammar
+    key = pp.Word(pp.alphanums + '_')('key') # Variable name: alphanumeric + underscores.
+    operation = pp.oneOf('> >= == != <= <')('operation') # Comparative operations.
+    value = pp.Word(pp.nums + '-')('value') # Response value: Negative sign + digits.
+    cond = pp.Group(key + operation + value)('condition') # Phrase group for a single logical expression.
+    joint = pp.oneOf('and or') # Phrases that join logical statements together.
+    cond_chain_with_parentheses = pp.Forward() # Tells parser there may be paren chain coming, inserted by '<<=='
+    cond_chain = pp.Optional('(') + cond + pp.Optional(')') + pp.Optional(joint + cond_chain_with_parentheses)
+    cond_chain_with_parentheses <<= cond_chain | '(' + cond_chain + ')' # Inserted at previous pp.Forward()
+    logic = cond_chain_with_parentheses + pp.StringEnd() # The full grammar
+
+    key.setParseAction(lambda t: _active_parser.use_key(t))
+    value.setParseAction(list_to_ints)
+    cond.setParseAction(check_condition)
+    _legacy_grammar = {
+        "key": key, "operation": operation, "value": value, "cond": cond, "joint": joint,
+        "cond_chain": cond_chain, "cond_chain_with_parentheses": cond_chain_with_parentheses,
+        "logic": logic,
+    }
+    return _legacy_grammar
+
+def __getattr__(name):
+    if name in GRAMMAR_NAMES:
+        return _build_legacy_grammar()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ---------------------------------------------------
 # Set up parse actions.
@@ -50,8 +86,6 @@ def list_to_ints(list_of_nums):
     # It's ok that this casts to int--RC branching logic doesn't support floats
     return [ int(k) for k in list_of_nums ]
 
-value.setParseAction(list_to_ints)
-
 
 # Condition: access values & check logic
 def check_condition(parsed):
@@ -66,8 +100,6 @@ def check_condition(parsed):
     except (SyntaxError, NameError): 
         return False # Handles blank result from key
 
-cond.setParseAction(check_condition)
-
 
 def fullparse(expression):
     """
@@ -75,7 +107,8 @@ def fullparse(expression):
     attempts to split the string into tokens, put the tokens back together
     in a string with responses instead of field names, and evaluate that string.
     """
-    global logic
+    import pyparsing as pp
+    logic = _build_legacy_grammar()["logic"]
     try: 
         parsed_expr = logic.parseString(expression)
         parsed_expr = " ".join([str(x) for x in parsed_expr])
@@ -92,11 +125,11 @@ def fullparse(expression):
 
 class Parser:
     def __init__(self, data):
-        global key, operation, value, cond, joint, cond_chain, cond_chain_with_parentheses, logic
+        global _active_parser
         self.data = data
         self.data["LOGIC_MET"] = "" # Add empty column for logic result
         # Complete parser setup by pointing action at this instance
-        key.setParseAction(self.use_key)
+        _active_parser = self
 
 
     def use_key(self, list_with_key):
@@ -125,17 +158,41 @@ class Parser:
             return None
 
 
-    def parse_all_logic(self):
+    @profiling.profiled("Parser.parse_all_logic")
+    def parse_all_logic(self, logic=None):
         """
         Fill `LOGIC_MET` column for each field in the record, based on other responses in the record.
+        `logic` maps field names to the logic to evaluate instead of the `branching_logic` column, e.g. the
+        REDCap-syntax originals of pythonic logic.
         """
-        temp_df = self.data.copy() # Unsafe to alter original during loop
-        for idx, row in self.data.iterrows():
-            try:
-                truth_value = fullparse(row["branching_logic"])
-                temp_df.loc[ idx, "LOGIC_MET" ] = truth_value
-            # Thrown if "blank" but caught by parser anyway.
-            # TODO: Why does this happen..?
-            except AttributeError:
-                temp_df.loc[ idx, "LOGIC_MET" ] = True 
+        temp_df = self.data.copy() # Unsafe to alter original
+        # One-row wide frame: field names as columns, this record's responses as values
+        as_row = self.data[["response"]].T
+        if logic is None:
+            logic = self.data["branching_logic"]
+        logic_met = evaluate_logic(as_row, logic)
+        temp_df["LOGIC_MET"] = logic_met.iloc[0]
         self.data = temp_df
+
+# ===================================================
+
+def evaluate_logic(frame, logic, context=None):
+    """
+    Vectorized counterpart to Parser. Takes a wide DataFrame (one row per record, one column per exported field)
+    and a mapping of names to logic strings (REDCap or pythonic syntax), and returns a boolean DataFrame with the
+    same rows and one column per name: True wherever that logic is met. Logic that can't be parsed is treated as
+    met, as blank logic is.
+
+    Identical logic strings, and conditions shared between different strings, are only evaluated once. Pass a
+    scred.rclogic.Context for `frame` as `context` to read its `.stats` afterwards and see how much was shared.
+    """
+    ctx = rclogic.Context(frame) if context is None else context
+    results = dict()
+    for name, text in logic.items():
+        try:
+            expression = rclogic.compile_logic(text)
+        except rclogic.LogicError as ex:
+            warnings.warn(f"{ex}; treating logic for {name} as met")
+            expression = rclogic.compile_logic("")
+        results[name] = expression.test(ctx)
+    return pd.DataFrame(results, index=frame.index, columns=list(logic.keys()))
@@ -0,0 +1,116 @@
+"""
+scred/batching.py
+
+Decides how many records to request at once during batched exports. A fixed batch
+size is either too small (lots of round-trips) or too large (server timeouts and 500s)
+depending on how wide the project is and how busy the server is, so the size is tuned
+from what we observe as the export runs.
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------
+
+
+class AdaptiveBatcher:
+    """
+    Suggests a records-per-request size and adjusts it after every request.
+        n_fields: number of fields (columns) each record will carry
+        min_size, max_size: hard limits on the batch size
+        target_seconds: response time we aim for on each request
+        max_bytes: largest response payload we're willing to receive at once
+        initial_size: skip the field-count estimate and start from this size
+
+    Call `.observe()` after a successful request and `.failed()` after a timeout or
+    server error; `.size` always holds the size to use for the next request.
+    """
+    TARGET_CELLS = 250_000 # records * fields in the first request
+    GROWTH_LIMIT = 2.0 # never more than double/halve in one step...
+    SHRINK_LIMIT = 0.5 # ...from a single observation
+
+    def __init__(
+        self,
+        n_fields: int,
+        min_size: int = 10,
+        max_size: int = 2000,
+        target_seconds: float = 5.0,
+        max_bytes: int = 50_000_000,
+        initial_size: int = None,
+    ):
+        if min_size < 1 or max_size < min_size:
+            raise ValueError(f"Invalid batch size limits: {min_size}, {max_size}")
+        self.n_fields = max(int(n_fields), 1)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        if initial_size is None:
+            initial_size = self.estimate(self.n_fields)
+        self._size = self._clamp(initial_size)
+        self.history = [] # (n_records, seconds, bytes, ok) per request
+        log.info(
+            "Starting batch size %d for %d fields (limits %d-%d)",
+            self._size, self.n_fields, self.min_size, self.max_size,
+        )
+
+    @property
+    def size(self):
+        return self._size
+
+    @classmethod
+    def estimate(cls, n_fields):
+        """
+        First guess at a batch size: keep the number of cells per request roughly
+        constant, so wide projects start with fewer records per request.
+        """
+        return cls.TARGET_CELLS // max(int(n_fields), 1)
+
+    @classmethod
+    def fixed(cls, size, n_fields = 1):
+        """
+        Batcher that never changes size. Useful when a caller knows what they want.
+        """
+        return cls(n_fields=n_fields, min_size=size, max_size=size, initial_size=size)
+
+    def _clamp(self, size):
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def _resize(self, new_size, reason):
+        new_size = self._clamp(new_size)
+        if new_size != self._size:
+            log.info("Batch size %d -> %d (%s)", self._size, new_size, reason)
+        self._size = new_size
+
+    def observe(self, n_records: int, seconds: float, nbytes: int):
+        """
+        Record a successful request for `n_records` that took `seconds` and returned
+        `nbytes`, then scale the next batch toward the time and size targets.
+        """
+        self.history.append((n_records, seconds, nbytes, True))
+        log.debug("Fetched %d records in %.2fs (%d bytes)", n_records, seconds, nbytes)
+        if n_records < 1:
+            return
+        scale = self.GROWTH_LIMIT
+        if seconds > 0:
+            scale = min(scale, self.target_seconds / seconds)
+        if nbytes > 0:
+            scale = min(scale, self.max_bytes / nbytes)
+        scale = max(scale, self.SHRINK_LIMIT)
+        # Only grow if this batch was a full-sized one; a short final batch says
+        # little about how a bigger request would behave.
+        if scale > 1 and n_records < self._size:
+            return
+        self._resize(n_records * scale, f"{seconds:.2f}s, {nbytes} bytes")
+
+    def failed(self, n_records: int):
+        """
+        Record a failed request (timeout, 5xx) and halve the batch that caused it.
+        Returns False once we're already at the minimum size and can't back off further.
+        """
+        self.history.append((n_records, None, None, False))
+        if n_records <= self.min_size:
+            return False
+        self._resize(n_records // 2, "request failed")
+        return True
@@ -0,0 +1,315 @@
+"""
+scred/cache.py
+
+In-process cache of REDCap API responses, so the same metadata, version or record
+query asked for by different parts of a job only goes to the server once. Only
+read-only requests are cached, each kind for its own time-to-live. SingleFlight does
+the same for identical requests made at the same time, before any response exists.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import ratelimit
+
+log = logging.getLogger(__name__)
+
+# Seconds to keep each kind of response. Project structure rarely changes during a
+# job; data can, so it's only kept briefly. Anything not listed isn't cached.
+DEFAULT_TTLS = {
+    "metadata": 3600,
+    "version": 3600,
+    "exportFieldNames": 3600,
+    "project": 3600,
+    "instrument": 3600,
+    "formEventMapping": 3600,
+    "event": 3600,
+    "arm": 3600,
+    "dag": 600,
+    "userDagMapping": 600,
+    "record": 60,
+    "report": 60,
+}
+
+# Payload values that mean a request changes something on the server
+WRITE_ACTIONS = {"import", "delete", "rename", "switch", "createFolder"}
+
+def is_write(payload):
+    """
+    Whether a request changes something on the server, so must never be cached.
+    """
+    return payload.get("action") in WRITE_ACTIONS or "data" in payload
+
+# ---------------------------------------------------
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of successful responses.
+        max_bytes: total size of response bodies kept in memory; least recently used
+            responses are dropped first once it's exceeded
+        ttls: {content: seconds} overriding DEFAULT_TTLS. A TTL of 0 or None turns
+            caching off for that content.
+        directory: also keep responses on disk here, so they survive eviction from
+            memory and can be shared between processes (e.g. repeated CLI runs)
+    """
+    def __init__(self, max_bytes = 64_000_000, ttls = None, directory = None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict() # key: (expires, size, entry)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def stats(self):
+        """
+        Snapshot of cache activity:
+            hits, misses: lookups answered from the cache (memory or disk) or not
+            disk_hits: the part of `hits` that came from the disk tier
+            stores, evictions: responses added, and dropped from memory to make room
+            entries, bytes: what's held in memory right now
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+    def ttl(self, payload):
+        """
+        Seconds a response to `payload` may be reused for; None if it mustn't be cached.
+        """
+        if is_write(payload):
+            return None
+        return self.ttls.get(payload.get("content")) or None
+
+    @staticmethod
+    def key(url, payload):
+        """
+        Same for any two requests that would get the same answer: parameters in any
+        order, and the token replaced by a hash so it never ends up in memory dumps or
+        on disk.
+        """
+        normalized = { k: str(v) for k, v in payload.items() if k != "token" }
+        normalized["token"] = ratelimit.hash_token(str(payload.get("token", "")))
+        normalized["url"] = url
+        text = json.dumps(normalized, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """
+        Cached response for `key`, or None if there isn't a live one.
+        """
+        now = time.time()
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None and found[0] <= now:
+                self._drop(key)
+                found = None
+            if found is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._response(found[2])
+        stored = self._read_disk(key, now)
+        with self._lock:
+            if stored is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._remember(key, *stored)
+        return self._response(stored[2])
+
+    def put(self, key, payload, response):
+        """
+        Keep `response` to `payload`, if it's a success and that kind of request is
+        cacheable. Returns whether it was cached.
+        """
+        ttl = self.ttl(payload)
+        if ttl is None or not response.ok:
+            return False
+        entry = {
+            "kind": payload.get("content"),
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "content": response.content,
+            "encoding": response.encoding,
+            "url": response.url,
+        }
+        expires = time.time() + ttl
+        size = len(entry["content"])
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, expires, size, entry)
+        if self.directory is not None:
+            try:
+                tmp = self._path(key) + ".tmp"
+                stored = dict(entry, expires=expires)
+                stored["content"] = base64.b64encode(entry["content"]).decode()
+                with open(tmp, "w") as fh:
+                    json.dump(stored, fh)
+                os.replace(tmp, self._path(key))
+            except OSError as ex:
+                log.warning("Couldn't write response to disk cache: %r", ex)
+        return True
+
+    def invalidate(self, kinds):
+        """
+        Forget responses for any of the `content` values in `kinds`, e.g. cached record
+        exports after records were imported.
+        """
+        kinds = set(kinds)
+        with self._lock:
+            for key in [ k for k, v in self._entries.items() if v[2]["kind"] in kinds ]:
+                self._drop(key)
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                stored = self._read_disk(name[:-len(".json")], time.time())
+                if stored is not None and stored[2].get("kind") in kinds:
+                    os.remove(os.path.join(self.directory, name))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, expires, size, entry):
+        """
+        Add to memory (lock held), evicting least recently used entries as needed.
+        Responses bigger than the whole cache are only kept on disk.
+        """
+        if key in self._entries:
+            self._drop(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires, size, entry)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._stats["evictions"] += 1
+
+    def _drop(self, key):
+        expires, size, entry = self._entries.pop(key)
+        self._bytes -= size
+
+    def _read_disk(self, key, now):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as fh:
+                stored = json.load(fh)
+            expires = stored.pop("expires")
+            stored["content"] = base64.b64decode(stored["content"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if expires <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return (expires, len(stored["content"]), stored)
+
+    @staticmethod
+    def _response(entry):
+        """
+        A fresh requests.Response for each hit, so callers can't change the cached one.
+        """
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["content"]
+        response.encoding = entry["encoding"]
+        response.url = entry["url"]
+        response.reason = entry.get("reason")
+        return response
+
+# ===================================================
+
+
+class SingleFlight:
+    """
+    Lets concurrent identical requests share one call: the first caller for a key
+    runs it, and callers arriving while it's in flight wait for its result (or its
+    exception) instead of sending their own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict() # key: [done event, result, exception]
+        self._stats = {"calls": 0, "shared": 0}
+
+    @property
+    def stats(self):
+        """
+        calls: functions actually run; shared: callers served by someone else's call.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def do(self, key, func, share = None):
+        """
+        Run `func()` for `key`, unless it's already running. Waiting callers get
+        `share(result)`, e.g. to hand each one its own copy.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+                self._stats["calls"] += 1
+            else:
+                self._stats["shared"] += 1
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1] if share is None else share(call[1])
+        try:
+            call[1] = func()
+        except BaseException as ex:
+            call[2] = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]
+
+
+def copy_response(response):
+    """
+    Separate Response with the same status, headers and (already read) body.
+    """
+    return ResponseCache._response({
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "content": response.content,
+        "encoding": response.encoding,
+        "url": response.url,
+        "reason": response.reason,
+    })
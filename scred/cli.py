@@ -0,0 +1,263 @@
+"""
+scred/cli.py
+
+The `scred` command: bulk exports of records, metadata and text fields to JSON, CSV,
+Parquet or SQLite, so heavy jobs run the same way every time instead of through one-off scripts.
+
+    scred records -o records.csv --fields age,site --fill-missing --workers 4 --progress
+    scred metadata -o datadict.json
+    scred text -o text.csv --idfield participant_id
+    scred text -o new_text.csv --new-only reviewed.json
+
+Credentials come from --url/--token, the REDCAP_URL/REDCAP_TOKEN environment
+variables, or a JSON file with "url" and "token" keys (--config).
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .sinks import FORMATS, open_sink, output_format, read_frame, write_frame
+
+# ---------------------------------------------------
+# Progress
+
+
+class Progress:
+    """
+    Throughput report on stderr, updated after every batch.
+    """
+    def __init__(self, total, enabled = True, stream = None):
+        self.total = total
+        self.enabled = enabled
+        self.stream = stream if stream is not None else sys.stderr
+        self.done = 0
+        self.began = time.perf_counter()
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.began
+        return self.done / elapsed if elapsed else 0.0
+
+    def update(self, n):
+        self.done += n
+        if self.enabled:
+            self.stream.write(f"\r{self.done}/{self.total} records, {self.rate:,.0f} records/s")
+            self.stream.flush()
+
+    def finish(self):
+        if self.enabled:
+            elapsed = time.perf_counter() - self.began
+            self.stream.write(
+                f"\r{self.done} records in {elapsed:.1f}s ({self.rate:,.0f} records/s)\n"
+            )
+
+# ---------------------------------------------------
+# Exports
+
+
+def _split(value):
+    return [ v.strip() for v in value.split(",") if v.strip() ] if value else None
+
+
+def iter_record_batches(
+    project, records, fields = None, batch_size = None, workers = 1, **kwargs
+):
+    """
+    Yield lists of exported record dicts, in the order of `records`. With one worker
+    the batch size adapts as the export runs (see scred.batching); with more, records
+    are split into batches of `batch_size` and exported `workers` at a time, each
+    batch still retried at a smaller size if the server fails on it.
+    """
+    from . import batching
+    n_fields = len(fields) if fields else len(project.metadata)
+    if workers <= 1:
+        batcher = None if batch_size is None else batching.AdaptiveBatcher.fixed(batch_size, n_fields)
+        yield from project.iter_records_batched(records, fields, batcher, **kwargs)
+        return
+    if batch_size is None:
+        batch_size = batching.AdaptiveBatcher(n_fields=n_fields).size
+    chunks = [ records[i:i + batch_size] for i in range(0, len(records), batch_size) ]
+
+    def export(chunk):
+        batcher = batching.AdaptiveBatcher(
+            n_fields, min_size=1, max_size=len(chunk), initial_size=len(chunk),
+        )
+        return project.get_records_batched(chunk, fields, batcher, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(export, chunks)
+
+
+def _records_frame(rows, project, fill_missing):
+    import pandas as pd
+    frame = pd.DataFrame(rows)
+    if not fill_missing or frame.empty:
+        return frame
+    from . import dtypes
+    pk = project.primary_key
+    filled = dtypes.fill_missing_frame(frame.set_index(pk), project.metadata)
+    return filled.reset_index()
+
+
+def _state_path(output):
+    return output + ".scred-state.json"
+
+
+def export_records(project, args):
+    """
+    `scred records`. Returns the number of records written.
+    """
+    fmt = output_format(args.output, args.format)
+    fields = _split(args.fields)
+    if fields and args.fill_missing:
+        fields = project.metadata.fields_needed(fields)
+    kwargs = dict()
+    if args.forms:
+        kwargs["forms"] = ",".join(_split(args.forms))
+    # Local time, but REDCap compares dateRangeBegin with its server's clock; the state
+    # file is plain JSON so `last_export` can be corrected if the two differ
+    started = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    previous = None
+    if args.incremental and os.path.exists(_state_path(args.output)):
+        with open(_state_path(args.output)) as fh:
+            previous = json.load(fh)["last_export"]
+        kwargs["dateRangeBegin"] = previous
+
+    records = project.get_record_ids(**kwargs)
+    progress = Progress(len(records), enabled=args.progress)
+    batches = iter_record_batches(
+        project, records, fields, args.batch_size, args.workers, **kwargs
+    )
+    frames = ( _records_frame(rows, project, args.fill_missing) for rows in batches )
+    if args.stream:
+        with open_sink(args.output, fmt) as writer:
+            for frame in frames:
+                writer.write(frame)
+                progress.update(frame[project.primary_key].nunique() if len(frame) else 0)
+    else:
+        import pandas as pd
+        collected = []
+        for frame in frames:
+            collected.append(frame)
+            progress.update(frame[project.primary_key].nunique() if len(frame) else 0)
+        combined = pd.concat(collected, ignore_index=True) if collected else pd.DataFrame()
+        if previous is not None and os.path.exists(args.output):
+            # Replace updated records, keep the rest of what was exported before
+            existing = read_frame(args.output, fmt).astype(str)
+            pk = project.primary_key
+            if len(combined):
+                existing = existing[~existing[pk].isin(combined[pk].astype(str))]
+            combined = pd.concat([existing, combined], ignore_index=True)
+        write_frame(combined, args.output, fmt)
+    progress.finish()
+    if args.incremental:
+        with open(_state_path(args.output), "w") as fh:
+            json.dump({"last_export": started}, fh)
+    return progress.done
+
+
+def export_metadata(project, args):
+    import pandas as pd
+    fmt = output_format(args.output, args.format)
+    rows = project.requester.get_metadata()
+    write_frame(pd.DataFrame(rows), args.output, fmt)
+    return len(rows)
+
+
+def export_text(project, args):
+    from .textract import Textractor, TextIndex
+    fmt = output_format(args.output, args.format)
+    extractor = Textractor(project, args.idfield or project.primary_key)
+    extractor.bounded = set(_split(args.exclude) or [])
+    if args.new_only:
+        extractor.index = TextIndex(args.new_only)
+        write_frame(extractor.pull_new_to_dataframe(), args.output, fmt)
+        extractor.commit()
+        return None
+    if fmt == "csv":
+        extractor.pull_to_csv(args.output)
+        return None
+    write_frame(extractor.pull_to_dataframe(), args.output, fmt)
+    return None
+
+# ---------------------------------------------------
+# Command line
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="scred", description="Bulk exports from a REDCap project.",
+    )
+    parser.add_argument("--url", default=os.environ.get("REDCAP_URL"), help="API URL (or $REDCAP_URL)")
+    parser.add_argument("--token", default=os.environ.get("REDCAP_TOKEN"), help="API token (or $REDCAP_TOKEN)")
+    parser.add_argument("--config", help='JSON file with "url" and "token"')
+    parser.add_argument("--rate-limit", type=float, help="maximum requests per minute")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, func, help):
+        sub = commands.add_parser(name, help=help)
+        sub.set_defaults(func=func)
+        sub.add_argument("-o", "--output", required=True, help="file to write")
+        sub.add_argument("--format", choices=FORMATS, help="default: from the output file extension")
+        return sub
+
+    records = command("records", export_records, "export records")
+    records.add_argument("--fields", help="comma-separated fields to export (default: all)")
+    records.add_argument("--forms", help="comma-separated instruments to export")
+    records.add_argument("--batch-size", type=int, help="records per request (default: adaptive)")
+    records.add_argument("--workers", type=int, default=1, help="requests sent at once")
+    records.add_argument(
+        "--fill-missing", action="store_true",
+        help="code blanks as N/A or bad data from branching logic (exports logic fields too)",
+    )
+    records.add_argument(
+        "--incremental", action="store_true",
+        help="only export records changed since the last --incremental run into this output, "
+        "and merge them into it (the run's start is taken from this machine's clock, "
+        "which should match the REDCap server's time zone)",
+    )
+    records.add_argument("--stream", action="store_true", help="write each batch as it arrives")
+    records.add_argument("--progress", action="store_true", help="show throughput on stderr")
+
+    command("metadata", export_metadata, "export the data dictionary")
+    text = command("text", export_text, "export free-text responses for review")
+    text.add_argument("--idfield", help="field to label records with (default: record ID)")
+    text.add_argument("--exclude", help="comma-separated text fields that aren't free text")
+    text.add_argument(
+        "--new-only", metavar="INDEX",
+        help="only export text that's new or changed since the last run with this index file",
+    )
+    return parser
+
+
+def main(argv = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config) as fh:
+            config = json.load(fh)
+        args.url = args.url or config.get("url")
+        args.token = args.token or config.get("token")
+    if not args.url or not args.token:
+        parser.error("a REDCap URL and token are needed (--url/--token, $REDCAP_URL/$REDCAP_TOKEN or --config)")
+    if getattr(args, "incremental", False) and args.stream:
+        parser.error("--incremental merges into the existing output, so it can't be combined with --stream")
+    from .project import RedcapProject
+    requester_kwargs = dict()
+    if args.rate_limit:
+        requester_kwargs["rate_limit"] = args.rate_limit
+    project = RedcapProject(args.url, args.token, requester_kwargs=requester_kwargs)
+    try:
+        args.func(project, args)
+    except (ValueError, ImportError, OSError) as ex:
+        parser.exit(1, f"scred: error: {ex}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,12 +6,18 @@ Defines classes to represent various REDCap objects.
 
 import re
 import json
+import hashlib
 import warnings
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from typing import Collection
 
+import numpy as np
 import pandas as pd
 
 from . import backfillna
+from . import profiling
+from . import rclogic
 
 # ---------------------------------------------------
 
@@ -67,6 +73,7 @@ class Record(pd.DataFrame):
             raise AttributeError(f"Cannot run <this function> without column {col}")
         self[col] = default_value
 
+    @profiling.profiled("Record.add_branching_logic")
     def add_branching_logic(self, datadict):
         """
         Draws from metadata object to add branching logic to this record.
@@ -75,9 +82,7 @@ class Record(pd.DataFrame):
         Or LogicFiller has/makes a Parser?
         """
         self.require_column("branching_logic")
-        if datadict.blogic_fmt == "redcap":
-            datadict = datadict.copy()
-            datadict.make_logic_pythonic()
+        datadict = datadict.pythonic()
         for varname in self.index:
             base_field = varname
             if "___" in varname:
@@ -92,6 +97,7 @@ class Record(pd.DataFrame):
                 if not varname.endswith("_complete"): # not expected to exist in datadict
                     warnings.warn(f"Cannot find {varname} in record and/or datadict")
 
+    @profiling.profiled("Record._fill_na_values")
     def _fill_na_values(self, datadict):
         """
         Using a pythonic `branching_logic` column, fill in Non-Applicable REDCap values. 
@@ -102,13 +108,41 @@ class Record(pd.DataFrame):
             return
         self.require_column("branching_logic", flexible=False)
         parser = backfillna.Parser(self)
-        parser.parse_all_logic()
+        logic = None
+        if datadict.blogic_fmt == "redcap":
+            # Evaluate the logic as written, like fill_missing_frame does; the pythonic
+            # copy in `branching_logic` has lost its quotes and some operators
+            logic = logic_by_column(self.index, datadict, warn=False)
+        self._warn_other_events(self["branching_logic"] if logic is None else logic)
+        parser.parse_all_logic(logic)
         namask = (parser.data["response"]=="") & (parser.data["LOGIC_MET"]==False)
         parser.data.loc[namask, "response"] = Record.NACODE
         # Transfer filled responses to this object and set tracking attribute
         self.loc[:, "response"] = parser.data.loc[:, "response"]
         self.nafilled = True
 
+    @staticmethod
+    def _warn_other_events(logic):
+        """
+        A Record holds one row, so logic reading a field from another event (e.g.
+        `[baseline_arm_1][consent]`) sees it as blank and the field can be wrongly
+        filled as N/A. Warn when any of the record's logic does that.
+        """
+        fields = list()
+        for name, text in logic.items():
+            try:
+                if rclogic.compile_logic(text).events:
+                    fields.append(name)
+            except rclogic.LogicError:
+                continue # evaluated as met, like fill_missing_frame does
+        if fields:
+            warnings.warn(
+                f"Branching logic of {', '.join(fields)} refers to other events, which a "
+                "single Record can't see. Fill the whole export with RecordSet.fill_missing "
+                "or fill_missing_frame instead."
+            )
+
+    @profiling.profiled("Record._fill_bad_data")
     def _fill_bad_data(self):
         """
         Once N/A values are filled in, anything remaining is missing due to RA error or
@@ -119,6 +153,7 @@ class Record(pd.DataFrame):
         self.loc[ self["response"]=="", "response" ] = Record.BADCODE
         self.bdfilled = True
 
+    @profiling.profiled("Record.fill_missing")
     def fill_missing(self, datadict):
         """
         Composite method to handle all logic conversion and backfilling. Convenience
@@ -146,43 +181,393 @@ class Record(pd.DataFrame):
             return value
 
 
+def logic_by_column(columns, datadict, warn = True):
+    """
+    Branching logic for each exported column, looked up in `datadict` the same way
+    Record.add_branching_logic does it: checkbox choices (`field___code`) use their
+    base field's logic, and columns not in the data dictionary get none (with a
+    warning, unless `warn=False`).
+    """
+    branching_logic = datadict["branching_logic"]
+    logic = dict()
+    for column in columns:
+        base_field = column.split("___")[0] if "___" in column else column
+        if base_field in branching_logic.index:
+            logic[column] = branching_logic[base_field]
+        else:
+            logic[column] = ""
+            # Neither `{instrument}_complete` nor REDCap's own columns are in datadicts
+            if warn and not column.endswith("_complete") and not column.startswith("redcap_"):
+                warnings.warn(f"Cannot find {column} in record and/or datadict")
+    return logic
+
+@profiling.profiled("fill_missing_frame")
+def fill_missing_frame(frame, datadict):
+    """
+    Vectorized version of Record.fill_missing for many records at once. `frame` is wide:
+    one row per record and one column per exported field. Blank values are replaced by
+    Record.NACODE where their branching logic isn't met, and Record.BADCODE where it
+    is. Returns the filled copy.
+
+    Longitudinal frames have one row per record and event, with a `redcap_event_name`
+    column and the record ID as index; logic like `[baseline_arm_1][consent] = '1'`
+    is then checked against each record's row for that event.
+    """
+    logic = logic_by_column(frame.columns, datadict)
+    logic_met = backfillna.evaluate_logic(frame, logic)
+    blank = frame.isna() | (frame == "")
+    # REDCap's own columns (event, repeat instance, DAG) are blank when they don't apply
+    blank.loc[:, [ c for c in frame.columns if str(c).startswith("redcap_") ]] = False
+    filled = frame.mask(blank & ~logic_met, Record.NACODE)
+    return filled.mask(blank & logic_met, Record.BADCODE)
+
+def audit_calculations(frame, datadict, tolerance = 1e-6):
+    """
+    Recompute every `calc` field in `datadict` from the other values in a wide `frame`
+    (one row per record, one column per exported field) and compare with the values
+    REDCap stored. Returns a DataFrame with one row per mismatch: the record, the
+    field_name, and the `stored` and `computed` values (NaN where blank).
+
+    Missing-value codes from fill_missing are treated as blanks, and numbers within
+    `tolerance` of each other count as equal.
+    """
+    frame = frame.replace({Record.NACODE: "", Record.BADCODE: ""})
+    ctx = rclogic.Context(frame)
+    mismatches = []
+    for field, calculation in datadict.calculations.items():
+        if field not in frame.columns:
+            continue
+        try:
+            expression = rclogic.compile_logic(calculation)
+        except rclogic.LogicError as ex:
+            warnings.warn(f"{ex}; not checking calculated field {field}")
+            continue
+        computed = ctx.num(expression.evaluate(ctx))
+        stored = ctx.num(ctx.column(field))
+        same = np.isclose(stored, computed, rtol=0, atol=tolerance, equal_nan=True)
+        if same.all():
+            continue
+        wrong = ~same
+        mismatches.append(pd.DataFrame({
+            "record": frame.index[wrong],
+            "field_name": field,
+            "stored": stored[wrong].values,
+            "computed": computed[wrong].values,
+        }))
+    if not mismatches:
+        return pd.DataFrame(columns=["record", "field_name", "stored", "computed"])
+    return pd.concat(mismatches, ignore_index=True)
+
+def _import_text(frame):
+    """
+    Values as REDCap would receive them on import: text, with blanks for NaN/None and
+    for the missing-value codes added by fill_missing, which only exist locally.
+    """
+    frame = frame.replace({Record.NACODE: "", Record.BADCODE: ""})
+    return frame.where(frame.notna(), "").astype(str)
+
+def record_changes(current, exported):
+    """
+    Compare two wide frames (one row per RecordSet key, one column per exported field)
+    and return {key: {field: new value}} for every value in `current` that differs
+    from `exported`. Records missing from `exported` are new, so all their non-blank
+    values count as changes.
+    """
+    now = _import_text(current)
+    before = _import_text(exported.reindex(index=current.index, columns=current.columns))
+    rows, cols = np.nonzero((now != before).values)
+    changes = dict()
+    for row, col in zip(rows, cols):
+        key = current.index[row]
+        changes.setdefault(key, dict())[current.columns[col]] = now.iat[row, col]
+    return changes
+
+NUMERIC_TYPES = {"calc", "slider", "yesno", "truefalse"}
+CHOICE_TYPES = {"radio", "dropdown"}
+
+def _is_numeric_field(field, datadict):
+    """
+    Whether an exported column holds numbers: calculations, sliders, yes/no fields,
+    checkbox choices, `_complete` status, choice fields with numeric codes, and text
+    fields validated as integers or numbers.
+    """
+    base = datadict.base_field(field)
+    if base not in datadict.index:
+        return field.endswith("_complete")
+    if base != field: # checkbox choice, 0 or 1
+        return True
+    ftype = datadict.loc[base, "field_type"]
+    if ftype in NUMERIC_TYPES:
+        return True
+    if ftype in CHOICE_TYPES:
+        choices = datadict.loc[base, "select_choices_or_calculations"] or ""
+        codes = [ c.split(",")[0].strip() for c in choices.split("|") if c.strip() ]
+        return bool(codes) and all(re.fullmatch(r"-?\d+(\.\d+)?", c) for c in codes)
+    validation = datadict.loc[base, "text_validation_type_or_show_slider_number"] or ""
+    return ftype == "text" and (validation == "integer" or validation.startswith("number"))
+
+def convert_types(frame, datadict):
+    """
+    Typed copy of a wide frame of records: numeric fields (see `_is_numeric_field`)
+    become float columns, keeping Record.NACODE and Record.BADCODE as numbers, and
+    everything else becomes text. The type of each column only depends on the data
+    dictionary, so separately converted chunks of a project line up. Values that
+    should be numbers but aren't become NaN.
+    """
+    converted = dict()
+    for column in frame.columns:
+        values = frame[column]
+        if _is_numeric_field(column, datadict):
+            converted[column] = pd.to_numeric(values, errors="coerce").astype(float)
+        else:
+            converted[column] = values.where(values.notna(), "").astype(str)
+    return pd.DataFrame(converted, index=frame.index, columns=frame.columns)
+
+# ---------------------------------------------------
+# Data quality summaries
+
+# Frames returned by `summarize_missing`; see there.
+MissingSummary = namedtuple("MissingSummary", ["fields", "forms", "records", "completion"])
+
+ANSWERED, NOT_APPLICABLE, BAD_DATA, BLANK = range(4)
+STATUS_NAMES = ["answered", "na", "bad", "blank"]
+COMPLETION_CODES = {"0": "incomplete", "1": "unverified", "2": "complete"}
+
+def _value_status(value):
+    if value is None or value == "" or (isinstance(value, float) and np.isnan(value)):
+        return BLANK
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return ANSWERED
+    if number == Record.NACODE:
+        return NOT_APPLICABLE
+    if number == Record.BADCODE:
+        return BAD_DATA
+    return ANSWERED
+
+def _with_rates(counts, totals):
+    for name in STATUS_NAMES:
+        counts[f"{name}_rate"] = counts[f"n_{name}"] / totals
+    return counts
+
+def summarize_missing(frame, datadict):
+    """
+    Data quality of a wide frame of filled records (one row per record, one column per
+    exported field): how many values are answered, N/A (Record.NACODE), bad data
+    (Record.BADCODE) or still blank (not filled). Codes are recognized whether they're
+    numbers or text. Returns a MissingSummary of DataFrames, each with n_answered,
+    n_na, n_bad, n_blank and the matching *_rate columns:
+        fields: one row per exported column, with its form
+        forms: one row per form, over all its columns and records
+        records: one row per record, over all its columns
+        completion: per form, how many records have `{form}_complete` at 0/1/2
+            (incomplete/unverified/complete) or blank, and the complete rate
+    The primary key and `_complete` columns only count towards `completion`.
+
+    Every distinct value is classified once (values are factorized in one pass), so
+    this is fast even on very wide projects.
+    """
+    complete = [ c for c in frame.columns if c.endswith("_complete") and c not in datadict.index ]
+    keep = [ c not in complete and c != datadict.primary_key for c in frame.columns ]
+    columns = list(frame.columns[keep])
+    # Work on the frame's own memory layout; selecting columns or raveling against it
+    # would copy every value first
+    values = frame.to_numpy(dtype=object)
+    order = "F" if values.flags.f_contiguous and not values.flags.c_contiguous else "C"
+    codes, uniques = pd.factorize(values.ravel(order=order))
+    lookup = np.array([ _value_status(u) for u in uniques ] + [BLANK], dtype=np.int8)
+    status = lookup[codes].reshape(values.shape, order=order) # NaN (code -1) is BLANK
+    status = status[:, np.array(keep, dtype=bool)]
+
+    forms = datadict["form_name"].to_dict()
+    counts = { f"n_{name}": (status == code) for code, name in enumerate(STATUS_NAMES) }
+    fields = pd.DataFrame(
+        { name: found.sum(axis=0) for name, found in counts.items() }, index=columns,
+    )
+    fields.insert(0, "form", [ forms.get(datadict.base_field(c)) for c in columns ])
+    records = pd.DataFrame(
+        { name: found.sum(axis=1) for name, found in counts.items() }, index=frame.index,
+    )
+    by_form = fields.groupby("form", sort=False)
+    form_counts = by_form[list(counts)].sum()
+    form_cells = by_form.size() * len(frame)
+
+    completion = pd.DataFrame(
+        {
+            label: [ (frame[c].astype(str) == code).sum() for c in complete ]
+            for code, label in COMPLETION_CODES.items()
+        },
+        index=pd.Index([ c[:-len("_complete")] for c in complete ], name="form"),
+    )
+    completion["blank"] = len(frame) - completion.sum(axis=1)
+    completion["complete_rate"] = completion["complete"] / max(len(frame), 1)
+
+    return MissingSummary(
+        fields=_with_rates(fields, max(len(frame), 1)),
+        forms=_with_rates(form_counts, form_cells.clip(lower=1)),
+        records=_with_rates(records, max(len(columns), 1)),
+        completion=completion,
+    )
+
+# Columns that tell apart exported rows of the same record in longitudinal projects and
+# projects with repeating instruments or events
+ROW_COLUMNS = (rclogic.EVENT_COLUMN, "redcap_repeat_instrument", "redcap_repeat_instance")
+
+def row_key(row, primary_key):
+    """
+    RecordSet key for one exported row (a dict, or a Record's responses): just the
+    record ID, or where the row belongs to an event or a repeat instance, the tuple
+    (record ID, event, repeat instrument, repeat instance), with "" for what doesn't
+    apply.
+    """
+    where = tuple(
+        "" if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value)
+        for value in ( row.get(column) for column in ROW_COLUMNS )
+    )
+    if not any(where):
+        return row[primary_key]
+    return (row[primary_key], *where)
+
+def key_fields(key, primary_key):
+    """
+    The fields identifying a RecordSet key's row on import: the record ID plus its
+    event and repeat instance, if it has them.
+    """
+    if not isinstance(key, tuple):
+        return {primary_key: key}
+    fields = {primary_key: key[0]}
+    fields.update({ column: value for column, value in zip(ROW_COLUMNS, key[1:]) if value })
+    return fields
+
+def _key_index(keys):
+    return pd.Index(list(keys), tupleize_cols=False, dtype=object)
+
+
 class RecordSet(dict):
     """
     Maps a record's ID to its object to simplify lookups. Provides a convenient interface
     for operating on multiple records together.
+
+    Longitudinal projects and repeating instruments export several rows per record;
+    each is kept as its own Record, keyed by (record ID, event, repeat instrument,
+    repeat instance) (see `row_key`).
     """
     # ID_TEMPLATE = re.compile(r"[A-Z]{3}[1-9][0-9]{7}") # Where should this live?
     ID_TEMPLATE = re.compile(r".*") # default: Everything is permitted
     # ID_TEMPLATE should probably be in Record. RecordSet should get a method to change
     # Record's class property, maybe...? Not sure how to handle this yet.
+    @profiling.profiled("RecordSet.__init__")
     def __init__(self, records: Collection[Record], primary_key: str):
         """
         Take a bulk record data response from the REDCap API and, for each record,
         instantiate a Record. Use the `primary_key` provided to the RecordSet and pass it 
         to the Record constructor. If the given records are already processed, skip that 
         step and include them directly.
+
+        Raw records are also kept as `.exported`, the last state known to match REDCap,
+        which `changes` compares against. Sets exported by data access group (see
+        RedcapProject.get_records_by_dag) list each group's record IDs in `.groups`.
         """
+        self.primary_key = primary_key
+        self.exported = dict()
+        self.groups = dict()
         for record in records:
-            instance = record
-            if not isinstance(record, Record):
-                instance = Record(primary_key=primary_key, data=record)
-            self[instance.id] = instance
+            if isinstance(record, Record):
+                instance, key = record, row_key(record["response"], primary_key)
+            else:
+                instance, key = Record(primary_key=primary_key, data=record), row_key(record, primary_key)
+                self.exported[key] = record
+            if key in self:
+                warnings.warn(f"More than one row for {key}; keeping the last")
+            self[key] = instance
 
     def __setitem__(self, key, value):
-        if not Record.ID_TEMPLATE.match(key):
-            raise ValueError(f"ID did not match template: {key}")
+        record_id = key[0] if isinstance(key, tuple) else key
+        if not Record.ID_TEMPLATE.match(record_id):
+            raise ValueError(f"ID did not match template: {record_id}")
         super().__setitem__(key, value)
 
-    def fill_missing(self, metadata: "DataDictionary"):
+    def fill_missing(self, metadata: "DataDictionary", hashes = None):
         """
         Iterate over records contained in this set. Call fill_missing method on
         each individual record; these are instances of scred.dtypes.Record, so we
         know that method exists and expect it to function in isolation. The given
         data dictionary, `metadata`, is used to look up branching logic.
+
+        The work is done for all records together (see `fill_missing_frame`), then the
+        results are copied into each Record, giving the same result as filling them one
+        at a time.
+
+        Pass a scred.fingerprint.RecordHashes as `hashes` to reuse results saved from
+        an earlier run for records that haven't changed since.
         """
-        for record in self.values():
-            record.fill_missing(metadata)
-            
+        if not self:
+            return
+        fill = fill_missing_frame if hashes is None else hashes.fill_missing
+        filled = fill(self.as_wide_dataframe(), metadata)
+        pythonic = metadata.pythonic()
+        for position, record in enumerate(self.values()):
+            if record.nafilled and record.bdfilled:
+                continue
+            logic = logic_by_column(record.index, pythonic)
+            record["branching_logic"] = pd.Series(logic)
+            record["response"] = filled.iloc[position][record.index]
+            record.nafilled = True
+            record.bdfilled = True
+
+    def _keyed_frame(self):
+        frame = pd.DataFrame([ record["response"] for record in self.values() ])
+        frame.index = _key_index(self.keys())
+        return frame
+
+    def as_wide_dataframe(self):
+        """
+        All records' responses in one DataFrame: one row per exported row, indexed by
+        record ID, one column per exported field. Longitudinal and repeating records
+        have a row per event or instance, told apart by their `redcap_` columns.
+        """
+        frame = self._keyed_frame()
+        frame.index = pd.Index([ record.id for record in self.values() ], dtype=object)
+        return frame
+
+    def summary(self, metadata: "DataDictionary"):
+        """
+        Counts and rates of answered, N/A, bad-data and blank values per field, form and
+        record, plus form completion status. See `summarize_missing`.
+        """
+        return summarize_missing(self.as_wide_dataframe(), metadata)
+
+    def validate(self, metadata: "DataDictionary"):
+        """
+        Values that fail their field's text validation (type, minimum, maximum), one
+        row per violation. See scred.validation.
+        """
+        from . import validation
+        return validation.validate(self.as_wide_dataframe(), metadata)
+
+    def audit_calculations(self, metadata: "DataDictionary", tolerance = 1e-6):
+        """
+        Recompute calculated fields locally for all records and list the records whose
+        stored value differs. See `audit_calculations` for details.
+        """
+        return audit_calculations(self.as_wide_dataframe(), metadata, tolerance)
+
+    def changes(self):
+        """
+        Values edited since export (or since the last `snapshot`), as
+        {key: {field: new value}}. See `record_changes`.
+        """
+        exported = pd.DataFrame(list(self.exported.values()), index=_key_index(self.exported))
+        return record_changes(self._keyed_frame(), exported)
+
+    def snapshot(self, keys = None):
+        """
+        Mark records (all, by default) as matching REDCap, e.g. after importing them.
+        """
+        for key in (self.keys() if keys is None else keys):
+            self.exported[key] = dict(self[key]["response"])
+
     def as_dataframe(self):
         df = pd.DataFrame()
         # TODO: Implement! Look into .from_frame()
@@ -190,6 +575,156 @@ class RecordSet(dict):
         # df = pd.DataFrame(data=self, index=idx)
         return df
 
+
+class LazyRecordSet(Mapping):
+    """
+    Read-only RecordSet that keeps the raw export rows and only builds a Record when
+    one is looked up. Built Records are kept in a least-recently-used cache of at most
+    `cache_size` entries, so iterating over a big export never holds more than that many
+    Record DataFrames at once. Changes made to a cached Record are written back to its
+    raw row when it leaves the cache, so they aren't lost.
+    """
+    def __init__(self, records: Collection[dict], primary_key: str, cache_size: int = 128):
+        self.primary_key = primary_key
+        self.cache_size = cache_size
+        self._rows = dict()
+        self._exported = dict() # key -> row as last known to match REDCap
+        self._filled = dict() # key -> (nafilled, bdfilled) for rows written back
+        self._cache = OrderedDict()
+        for record in records:
+            exported, filled = record, None
+            if isinstance(record, Record):
+                filled = (record.nafilled, record.bdfilled)
+                record, exported = self._row_from_record(record), None
+            if not Record.ID_TEMPLATE.match(record[primary_key]):
+                raise ValueError(f"ID did not match template: {record[primary_key]}")
+            key = row_key(record, primary_key)
+            if key in self._rows:
+                warnings.warn(f"More than one row for {key}; keeping the last")
+            if filled is not None:
+                self._filled[key] = filled
+            self._rows[key] = record
+            if exported is not None:
+                self._exported[key] = exported
+
+    @staticmethod
+    def _row_from_record(record):
+        return dict(record["response"])
+
+    def _build(self, key):
+        record = Record(primary_key=self.primary_key, data=self._rows[key])
+        record.nafilled, record.bdfilled = self._filled.get(key, (False, False))
+        return record
+
+    def _release(self, key, record):
+        self._rows[key] = self._row_from_record(record)
+        self._filled[key] = (record.nafilled, record.bdfilled)
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        record = self._build(key) # KeyError if no such record, like a dict
+        self._cache[key] = record
+        while len(self._cache) > self.cache_size:
+            self._release(*self._cache.popitem(last=False))
+        return record
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    @property
+    def cached(self):
+        """
+        Keys of the records currently built and held in memory.
+        """
+        return list(self._cache)
+
+    def fill_missing(self, metadata: "DataDictionary", hashes = None):
+        """
+        Same as RecordSet.fill_missing, but works on the raw rows directly; no Records
+        are built. Records already in the cache are filled too.
+        """
+        if not self._rows:
+            return
+        for key, record in list(self._cache.items()):
+            self._release(key, record)
+        self._cache.clear()
+        fill = fill_missing_frame if hashes is None else hashes.fill_missing
+        filled = fill(self.as_wide_dataframe(), metadata)
+        columns = list(filled.columns)
+        self._rows = {
+            key: dict(zip(columns, values))
+            for key, values in zip(self._rows, filled.values.tolist())
+        }
+        self._filled = dict.fromkeys(self._rows, (True, True))
+
+    def _keyed_frame(self):
+        for key, record in self._cache.items():
+            self._release(key, record)
+        return pd.DataFrame(list(self._rows.values()), index=_key_index(self._rows))
+
+    def as_wide_dataframe(self):
+        """
+        All raw rows in one DataFrame, indexed by record ID, one column per exported
+        field; like RecordSet.as_wide_dataframe.
+        """
+        frame = self._keyed_frame()
+        frame.index = pd.Index([ row[self.primary_key] for row in self._rows.values() ], dtype=object)
+        return frame
+
+    def summary(self, metadata: "DataDictionary"):
+        """
+        Same as RecordSet.summary, working from the raw rows.
+        """
+        return summarize_missing(self.as_wide_dataframe(), metadata)
+
+    def validate(self, metadata: "DataDictionary"):
+        """
+        Same as RecordSet.validate, working from the raw rows.
+        """
+        from . import validation
+        return validation.validate(self.as_wide_dataframe(), metadata)
+
+    def audit_calculations(self, metadata: "DataDictionary", tolerance = 1e-6):
+        """
+        Same as RecordSet.audit_calculations, working from the raw rows.
+        """
+        return audit_calculations(self.as_wide_dataframe(), metadata, tolerance)
+
+    def changes(self):
+        """
+        Same as RecordSet.changes.
+        """
+        exported = pd.DataFrame(list(self._exported.values()), index=_key_index(self._exported))
+        return record_changes(self._keyed_frame(), exported)
+
+    def snapshot(self, keys = None):
+        """
+        Same as RecordSet.snapshot.
+        """
+        for key, record in self._cache.items():
+            self._release(key, record)
+        for key in (self._rows.keys() if keys is None else keys):
+            self._exported[key] = dict(self._rows[key])
+
+    def materialize(self):
+        """
+        Build every record and return them in an ordinary (eager) RecordSet.
+        """
+        recordset = RecordSet(
+            [ self._cache[key] if key in self._cache else self._build(key) for key in self._rows ],
+            primary_key=self.primary_key,
+        )
+        recordset.exported = dict(self._exported)
+        return recordset
+
 # ===================================================
 
 class DataDictionary(pd.DataFrame):
@@ -257,7 +792,8 @@ class DataDictionary(pd.DataFrame):
         bouncebacks = [None, ""]
         if blogic in bouncebacks:
             return ""
-        clean = blogic.replace("[", "").replace("]", "")
+        clean = blogic.replace("][", ".") # [event][field] becomes event.field
+        clean = clean.replace("[", "").replace("]", "")
         # TODO: Use re.sub
         clean = clean.replace("=", "==") # next lines fix >== and <==
         clean = clean.replace(">==", ">=")
@@ -280,6 +816,7 @@ class DataDictionary(pd.DataFrame):
             blogic,
         )
     
+    @profiling.profiled("DataDictionary.make_logic_pythonic")
     def make_logic_pythonic(self):
         """
         Convert REDCap's logic syntax to be evaluable by Python.
@@ -296,6 +833,98 @@ class DataDictionary(pd.DataFrame):
         self["branching_logic"] = pd.Series(fieldslogic)
         self.blogic_fmt = "python"
 
+    @property
+    def primary_key(self):
+        """
+        REDCap always uses the first field in the data dictionary as the record ID.
+        """
+        return self.index[0]
+
+    def base_field(self, name):
+        """
+        Data dictionary field behind an exported column: `field___code` (a checkbox
+        choice) becomes `field`; anything else is returned unchanged.
+        """
+        if "___" in name:
+            base = name.split("___")[0]
+            if base in self.index:
+                return base
+        return name
+
+    def logic_fields(self, field):
+        """
+        Fields referenced by a field's branching logic, as data dictionary field names.
+        """
+        try:
+            expression = rclogic.compile_logic(self.loc[field, "branching_logic"])
+        except rclogic.LogicError:
+            return set()
+        referenced = { self.base_field(f) for f in expression.fields }
+        return referenced & set(self.index)
+
+    def fields_needed(self, fields):
+        """
+        Smallest set of fields to export so that `fields` can be filled with
+        fill_missing: the primary key, the fields themselves, and every field their
+        branching logic depends on, directly or through other fields' logic. Returned
+        in data dictionary order, ready to pass as `fields` to get_records. Names not
+        in the data dictionary (e.g. `{instrument}_complete`) are kept at the end.
+        """
+        requested = [ self.base_field(f) for f in fields ]
+        needed = set()
+        pending = [ f for f in requested if f in self.index ]
+        while pending:
+            field = pending.pop()
+            if field in needed:
+                continue
+            needed.add(field)
+            pending.extend(self.logic_fields(field) - needed)
+        ordered = [self.primary_key]
+        ordered += [ f for f in self.index if f in needed and f != self.primary_key ]
+        ordered += [ f for f in dict.fromkeys(requested) if f not in self.index ]
+        return ordered
+
+    @property
+    def calculations(self):
+        """
+        Calculation for each `calc` field, keyed by field name.
+        """
+        calcs = self[self["field_type"] == "calc"]
+        return calcs["select_choices_or_calculations"]
+
+    def content_hash(self):
+        """
+        Short hash of everything in the data dictionary; changes whenever any field's
+        definition does. Lets results computed with it be recognized as stale.
+        """
+        text = self.to_json(orient="split")
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    @property
+    def file_fields(self):
+        """
+        Names of `file` (upload) fields, whose contents are exported separately.
+        """
+        return list(self.index[self["field_type"] == "file"])
+
+    def pythonic(self):
+        """
+        This data dictionary if its logic is already pythonic, otherwise a converted copy.
+        The copy is kept and handed out again until this data dictionary's branching
+        logic changes, so filling record after record only converts once.
+        """
+        if self.blogic_fmt == "python":
+            return self
+        logic = self["branching_logic"]
+        cached = self.__dict__.get("_pythonic_copy")
+        if cached is not None and cached[0].equals(logic):
+            return cached[1]
+        datadict = self.copy()
+        datadict.make_logic_pythonic()
+        # Not an attribute pandas knows about, so set it directly (and leave it out of copies)
+        object.__setattr__(self, "_pythonic_copy", (logic.copy(), datadict))
+        return datadict
+
     def copy(self):
         df_copy = super().copy()
         return __class__(df_copy, blogic_fmt=self.blogic_fmt)
@@ -303,5 +932,39 @@ class DataDictionary(pd.DataFrame):
 # ===================================================
 
 class DataAccessGroup:
-    # TODO: Implement
-    pass
+    """
+    A data access group (DAG): the records, usually one site's, that only the group's
+    users can see.
+        unique_name: REDCap's unique group name, used in exports and imports
+        name: the name shown in REDCap
+        group_id: REDCap's numeric ID for the group
+        members: usernames of the users assigned to the group
+    """
+    def __init__(self, unique_name, name = None, group_id = None, members = None):
+        self.unique_name = unique_name
+        self.name = name or unique_name
+        self.group_id = group_id
+        self.members = list(members or [])
+
+    @classmethod
+    def from_api(cls, row, members = None):
+        """
+        From one row of a `content=dag` export.
+        """
+        return cls(
+            row["unique_group_name"],
+            name=row.get("data_access_group_name"),
+            group_id=row.get("data_access_group_id"),
+            members=members,
+        )
+
+    def __repr__(self):
+        return f"DataAccessGroup({self.unique_name!r}, members={len(self.members)})"
+
+    def __eq__(self, other):
+        if not isinstance(other, DataAccessGroup):
+            return NotImplemented
+        return (self.unique_name, self.group_id) == (other.unique_name, other.group_id)
+
+    def __hash__(self):
+        return hash((self.unique_name, self.group_id))
@@ -0,0 +1,188 @@
+"""
+scred/fingerprint.py
+
+Change detection for repeated runs over the same project. Each record gets a hash of
+its exported values and of the data dictionary it was filled with; when both are the
+same as last time, the record's earlier fill_missing result is reused instead of
+being computed again.
+
+    hashes = RecordHashes("fill_cache.json")
+    records.fill_missing(myproject.metadata, hashes=hashes)
+    hashes.changed # only these records need writing out again
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import dtypes
+
+# ---------------------------------------------------
+
+
+class RecordHashes:
+    """
+    Record ID -> (content hash, fill_missing codes) from earlier runs, kept in a JSON
+    file at `path` if one is given (loaded now, saved after every fill). Only the
+    codes fill_missing put in place of blanks are stored, not whole records; the rest
+    of a filled record is just its exported values.
+
+    In longitudinal or repeating data a record is all of its rows: they're hashed
+    together, their codes are kept per (event, repeat instrument, repeat instance),
+    and when any of them changes they're all filled again, since logic in one event
+    can depend on another.
+
+    After each `fill_missing`:
+        .changed: IDs of records that were new or had changed, in frame order
+        .stats: {"unchanged": n, "changed": n, "new": n}, counting records (not rows)
+    """
+    FORMAT = 2
+
+    def __init__(self, path = None):
+        self.path = path
+        self._entries = dict()
+        self.changed = []
+        self.stats = {"unchanged": 0, "changed": 0, "new": 0}
+        if path is not None and os.path.exists(path):
+            with open(path) as fh:
+                stored = json.load(fh)
+            if stored.get("format") == self.FORMAT:
+                self._entries = stored["records"]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def hash_rows(frame: pd.DataFrame, datadict: "dtypes.DataDictionary"):
+        """
+        One hash per row of a wide frame of exported values. Column order doesn't
+        matter; column names, values and the data dictionary's contents do.
+        """
+        columns = sorted(frame.columns)
+        salt = datadict.content_hash() + json.dumps(columns)
+        rows = frame[columns].to_numpy(dtype=object).tolist() # blanks/NaN dump as-is
+        return [
+            hashlib.blake2b((salt + json.dumps(row)).encode(), digest_size=16).hexdigest()
+            for row in rows
+        ]
+
+    @staticmethod
+    def _row_labels(frame):
+        """
+        Which of its record's rows each row is: "event|repeat instrument|repeat
+        instance", or "" outside longitudinal and repeating data.
+        """
+        if not any(c in frame.columns for c in dtypes.ROW_COLUMNS):
+            return [""] * len(frame)
+        parts = frame.reindex(columns=list(dtypes.ROW_COLUMNS)).fillna("").astype(str)
+        return [ "|".join(row) for row in parts.values.tolist() ]
+
+    def hash_records(self, frame: pd.DataFrame, datadict: "dtypes.DataDictionary"):
+        """
+        {record ID: (hash of all its rows, their positions in `frame`)}, in frame order.
+        """
+        positions = dict()
+        for position, key in enumerate(frame.index):
+            positions.setdefault(key, []).append(position)
+        rows = self.hash_rows(frame, datadict)
+        return {
+            key: (
+                rows[found[0]] if len(found) == 1 else hashlib.blake2b(
+                    "".join(rows[p] for p in found).encode(), digest_size=16,
+                ).hexdigest(),
+                found,
+            )
+            for key, found in positions.items()
+        }
+
+    def fill_missing(self, frame: pd.DataFrame, datadict: "dtypes.DataDictionary"):
+        """
+        Drop-in replacement for scred.dtypes.fill_missing_frame: the same result, but
+        only records that are new or changed since the last run are actually filled.
+        """
+        records = self.hash_records(frame, datadict)
+        labels = self._row_labels(frame)
+        reuse = np.zeros(len(frame), dtype=bool)
+        self.changed = []
+        n_new = 0
+        for key, (record_hash, positions) in records.items():
+            previous = self._entries.get(key)
+            if previous is not None and previous["hash"] == record_hash:
+                reuse[positions] = True
+            else:
+                self.changed.append(key)
+                n_new += previous is None
+        self.stats = {
+            "unchanged": len(records) - len(self.changed),
+            "changed": len(self.changed) - n_new,
+            "new": n_new,
+        }
+
+        pieces, order = [], []
+        if reuse.any():
+            reused = frame[reuse]
+            values = reused.to_numpy(dtype=object, copy=True)
+            column_at = { column: i for i, column in enumerate(reused.columns) }
+            for row, position in enumerate(np.flatnonzero(reuse)):
+                codes = self._entries[frame.index[position]]["rows"][labels[position]]
+                for column, code in codes.items():
+                    if column in column_at:
+                        values[row, column_at[column]] = code
+            pieces.append(pd.DataFrame(values, index=reused.index, columns=reused.columns))
+            order.append(np.flatnonzero(reuse))
+        if not reuse.all():
+            todo = frame[~reuse]
+            done = dtypes.fill_missing_frame(todo, datadict)
+            pieces.append(done)
+            order.append(np.flatnonzero(~reuse))
+            self._remember(
+                todo, done, [ labels[p] for p in np.flatnonzero(~reuse) ],
+                { key: records[key][0] for key in self.changed },
+            )
+        filled = pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+        if len(pieces) > 1:
+            filled = filled.iloc[np.argsort(np.concatenate(order), kind="stable")]
+        filled = filled.reindex(columns=frame.columns)
+        if self.path is not None and self.changed:
+            self.save()
+        return filled
+
+    def _remember(self, before, after, labels, hashes):
+        columns = list(before.columns)
+        replaced = (after.ne(before) & ~(after.isna() & before.isna())).values
+        for key, record_hash in hashes.items():
+            self._entries[key] = {"hash": record_hash, "rows": dict()}
+        for key, label, mask, values in zip(before.index, labels, replaced, after.values):
+            codes = {
+                column: value.item() if hasattr(value, "item") else value
+                for column, was_replaced, value in zip(columns, mask, values) if was_replaced
+            }
+            self._entries[key]["rows"][label] = codes
+
+    def forget(self, keys = None):
+        """
+        Drop saved results for `keys` (all, by default) so they're recomputed.
+        """
+        if keys is None:
+            self._entries.clear()
+        for key in (keys or []):
+            self._entries.pop(key, None)
+
+    def save(self, path = None):
+        """
+        Write to `path` (default: the path given when created), replacing the file
+        only once the new one is complete.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save record hashes to")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"format": self.FORMAT, "records": self._entries}, fh)
+        os.replace(tmp, path)
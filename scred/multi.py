@@ -0,0 +1,132 @@
+"""
+scred/multi.py
+
+Works with many REDCap projects at once, e.g. when the same pipeline runs against
+dozens of projects. Each project keeps its own token, but requests to the same host
+share one connection pool (and rate limiter, if one is set), and calls fan out to all
+projects concurrently.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from . import project
+from . import ratelimit
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------
+
+
+class FanoutResult(dict):
+    """
+    Maps project name to the result of a call on that project. Projects whose call
+    raised are left out and their exceptions kept in `.errors` instead, so one bad
+    project never costs the results of the others.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = dict()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class ProjectGroup:
+    """
+    Holds a RedcapProject for each of many tokens.
+        projects: maps a name for each project to its token, or to a (url, token) pair
+            for projects that don't live at `url`
+        url: API URL shared by projects given as just a token
+        max_workers: how many projects to talk to at once
+        rate_limit: requests per minute allowed per host, shared by all its projects
+        requester_kwargs: any other options for each project's RedcapRequester
+    """
+    def __init__(
+        self, projects: dict, url = None, max_workers = 8, rate_limit = None,
+        requester_kwargs = None,
+    ):
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self._sessions = dict()
+        self._limiters = dict()
+        self.projects = dict()
+        for name, spec in projects.items():
+            project_url, token = (url, spec) if isinstance(spec, str) else spec
+            if project_url is None:
+                raise ValueError(f"No URL given for project {name}")
+            kwargs = self._host_kwargs(project_url)
+            kwargs.update(requester_kwargs or dict())
+            self.projects[name] = project.RedcapProject(
+                url=project_url, token=token, requester_kwargs=kwargs,
+            )
+
+    def _host_kwargs(self, url):
+        """
+        One session (connection pool) and one rate limiter per host, shared by every
+        project on that host.
+        """
+        host = urlparse(url).netloc
+        if host not in self._sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[host] = session
+            if self.rate_limit is not None:
+                self._limiters[host] = ratelimit.TokenBucket(self.rate_limit)
+        return {
+            "session": self._sessions[host],
+            "rate_limiter": self._limiters.get(host),
+        }
+
+    def __getitem__(self, name):
+        return self.projects[name]
+
+    def __iter__(self):
+        return iter(self.projects)
+
+    def __len__(self):
+        return len(self.projects)
+
+    def map(self, func, names = None):
+        """
+        Call `func(project)` for every project (or just those in `names`) concurrently.
+        Returns a FanoutResult keyed by project name.
+        """
+        if names is None:
+            names = list(self.projects)
+        result = FanoutResult()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = { name: pool.submit(func, self.projects[name]) for name in names }
+            for name, future in futures.items():
+                try:
+                    result[name] = future.result()
+                except Exception as ex:
+                    log.warning("Project %s failed: %r", name, ex)
+                    result.errors[name] = ex
+        return result
+
+    def get_metadata(self, names = None):
+        """
+        DataDictionary for each project.
+        """
+        return self.map(lambda p: p.metadata, names)
+
+    def get_records(self, names = None, batched = False, **kwargs):
+        """
+        Export records from each project. Takes the same arguments as
+        `RedcapProject.get_records`; with `batched=True`, each project's export is
+        split using `RedcapProject.get_records_batched` instead.
+        """
+        if batched:
+            return self.map(lambda p: p.get_records_batched(**kwargs), names)
+        return self.map(lambda p: p.get_records(**kwargs), names)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
@@ -0,0 +1,175 @@
+"""
+scred/pipeline.py
+
+Processes a whole project a chunk of records at a time: export -> build -> fill_missing
+-> type conversion -> sink. Only one chunk is ever in memory, and chunks are sized to
+stay within a memory budget, so projects far bigger than RAM can be processed.
+
+    pipeline = Pipeline(myproject, sink="records.parquet", memory_budget=500_000_000)
+    pipeline.run()
+    pipeline.report() # time and peak memory per stage
+"""
+
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+from . import batching
+from . import dtypes
+from . import profiling
+from . import sinks
+
+log = logging.getLogger(__name__)
+
+STAGES = ["export", "build", "fill_missing", "convert", "write"]
+
+# ---------------------------------------------------
+
+
+class Pipeline:
+    """
+    Runs records from `project` through the processing stages into `sink`.
+        sink: path to write to (format from its extension: .csv, .parquet, .sqlite,
+            .json, .jsonl; see scred.sinks) or any object with .write(frame) and
+            .close()
+        fields: fields to process (default: all). With fill_missing on, whatever
+            their branching logic needs is exported too.
+        records: record IDs to process (default: all)
+        fill_missing, convert_types: turn either stage off
+        hashes: a scred.fingerprint.RecordHashes, to reuse fill_missing results for
+            records that haven't changed since the last run
+        memory_budget: bytes the records being processed may take up at once. Sets
+            the chunk size; chunks shrink if one turns out bigger than the budget.
+        chunk_size: records per chunk, instead of working it out from the budget
+        trace_memory: measure peak memory of each stage with tracemalloc (slower)
+    Other kwargs are passed on to the record export.
+    """
+    BYTES_PER_VALUE = 400 # a value's share of raw rows, frames and copies, roughly
+
+    def __init__(
+        self,
+        project,
+        sink,
+        fields = None,
+        records = None,
+        fill_missing = True,
+        convert_types = True,
+        hashes = None,
+        memory_budget = 500_000_000,
+        chunk_size = None,
+        trace_memory = True,
+        **kwargs,
+    ):
+        self.project = project
+        self.sink = sink
+        self.fields = fields
+        self.records = records
+        self.fill_missing = fill_missing
+        self.convert_types = convert_types
+        self.hashes = hashes
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+        self.trace_memory = trace_memory
+        self.export_kwargs = kwargs
+        self.stats = { stage: {"seconds": 0.0, "peak_bytes": 0, "chunks": 0} for stage in STAGES }
+        self.chunks = [] # (records, bytes at peak) per chunk
+
+    def _chunk_size(self, n_fields):
+        if self.chunk_size is not None:
+            return self.chunk_size
+        return max(1, int(self.memory_budget // (n_fields * self.BYTES_PER_VALUE)))
+
+    @contextmanager
+    def _stage(self, name):
+        # Peaks are measured with profiling.PeakMemory so that the chunk's, the
+        # stage's and any profiled paths' measurements don't reset each other
+        memory = profiling.PeakMemory(self.trace_memory)
+        began = time.perf_counter()
+        try:
+            with memory:
+                yield
+        finally:
+            stats = self.stats[name]
+            stats["seconds"] += time.perf_counter() - began
+            stats["chunks"] += 1
+            stats["peak_bytes"] = max(stats["peak_bytes"], memory.bytes)
+
+    def run(self):
+        """
+        Process every chunk, then close the sink. Returns the number of records written;
+        a longitudinal or repeating record's rows count once.
+        """
+        project = self.project
+        fields = self.fields
+        if fields and self.fill_missing:
+            fields = project.metadata.fields_needed(fields)
+        n_fields = len(fields) if fields else len(project.metadata)
+        records = self.records
+        if records is None:
+            records = project.get_record_ids(**self.export_kwargs)
+        records = list(records)
+        size = self._chunk_size(n_fields)
+        log.info("Processing %d records, %d at a time", len(records), size)
+
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        sink = sinks.open_sink(self.sink) if isinstance(self.sink, str) else self.sink
+        written = 0
+        try:
+            position = 0
+            while position < len(records):
+                chunk = records[position:position + size]
+                with profiling.PeakMemory(self.trace_memory) as memory:
+                    written += self._process(chunk, fields, n_fields, sink)
+                position += len(chunk)
+                used = memory.bytes
+                self.chunks.append((len(chunk), used))
+                if self.chunk_size is None and used > self.memory_budget:
+                    size = max(1, int(size * self.memory_budget / used * 0.9))
+                    log.info("Chunk used %d bytes; shrinking chunks to %d records", used, size)
+        finally:
+            sink.close()
+            if started_tracing:
+                tracemalloc.stop()
+        return written
+
+    def _process(self, chunk, fields, n_fields, sink):
+        project = self.project
+        with self._stage("export"):
+            batcher = batching.AdaptiveBatcher(
+                n_fields, min_size=1, max_size=len(chunk), initial_size=len(chunk),
+            )
+            rows = project.get_records_batched(chunk, fields, batcher, **self.export_kwargs)
+        if not rows:
+            return 0
+        with self._stage("build"):
+            pk = project.primary_key
+            frame = pd.DataFrame(rows)
+            frame.index = frame[pk].values
+            del rows
+        if self.fill_missing:
+            with self._stage("fill_missing"):
+                fill = dtypes.fill_missing_frame if self.hashes is None else self.hashes.fill_missing
+                frame = fill(frame, project.metadata)
+        if self.convert_types:
+            with self._stage("convert"):
+                frame = dtypes.convert_types(frame, project.metadata)
+        with self._stage("write"):
+            sink.write(frame)
+        return frame.index.nunique() # indexed by record ID
+
+    def report(self):
+        """
+        Time and peak memory per stage, over all chunks, as a DataFrame. Peak memory
+        is the most any one chunk's pass through the stage allocated beyond what was
+        already in use.
+        """
+        report = pd.DataFrame.from_dict(self.stats, orient="index")
+        report["peak_mb"] = report.pop("peak_bytes") / 1e6
+        report["share"] = report["seconds"] / max(report["seconds"].sum(), 1e-9)
+        report.index.name = "stage"
+        return report[report["chunks"] > 0]
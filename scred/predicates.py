@@ -0,0 +1,337 @@
+"""
+scred/predicates.py
+
+Small API for describing which records you want, so REDCap can do the filtering
+instead of us downloading everything and filtering in pandas:
+
+    from scred.predicates import Field
+    adults = (Field("age") >= 18) & Field("site").isin([1, 2])
+    adults.to_filter_logic() # "([age] >= 18 and ([site] = 1 or [site] = 2))"
+    myproject.get_records(where=adults)
+
+This is the reverse of DataDictionary._logic_statement_to_python: Python goes in and
+REDCap logic comes out. Predicates REDCap can't express (e.g. regular expressions or
+arbitrary Python functions) are evaluated locally on the exported rows instead; in an
+`&`, the parts that can be sent to REDCap still are.
+"""
+
+import abc
+import decimal
+import re
+
+import pandas as pd
+
+from . import rclogic
+
+# ---------------------------------------------------
+
+
+class PushdownError(ValueError):
+    """
+    Raised when a predicate can't be written as REDCap filter logic.
+    """
+    pass
+
+
+def _quote(value):
+    """
+    REDCap logic literal for a Python value: numbers bare, anything else quoted.
+    Floats are written out in full, never with an exponent (1e-05 is 0.00001).
+    """
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return repr(value)
+    if isinstance(value, float):
+        return format(decimal.Decimal(repr(value)), "f")
+    text = str(value)
+    if "'" in text:
+        if '"' in text:
+            raise PushdownError(f"Cannot quote value containing both quote marks: {text}")
+        return f'"{text}"'
+    return f"'{text}'"
+
+
+class Predicate(abc.ABC):
+    """
+    Base class. Combine predicates with & (and), | (or) and ~ (not).
+    """
+    pushable = True
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return self.negate()
+
+    def negate(self):
+        return Not(self)
+
+    @property
+    @abc.abstractmethod
+    def fields(self):
+        """
+        Fields whose values are needed to evaluate this predicate.
+        """
+
+    def to_filter_logic(self):
+        """
+        REDCap logic string for this predicate. Raises PushdownError if it has no
+        REDCap equivalent.
+        """
+        raise PushdownError(f"{self.__class__.__name__} can't be sent to REDCap")
+
+    def split(self):
+        """
+        (part REDCap can filter on, part left to filter locally); either may be None.
+        """
+        if self.pushable:
+            return (self, None)
+        return (None, self)
+
+    def evaluate(self, frame: pd.DataFrame):
+        """
+        Boolean Series: which rows of a wide DataFrame of exported records match.
+        Predicates with a REDCap equivalent are evaluated with the same logic REDCap
+        uses (see scred.rclogic), so local and server-side filtering agree.
+        """
+        return rclogic.compile_logic(self.to_filter_logic()).test(frame)
+
+    def __repr__(self):
+        try:
+            return f"{self.__class__.__name__}({self.to_filter_logic()})"
+        except PushdownError:
+            return f"{self.__class__.__name__}(<local>)"
+
+
+class Field:
+    """
+    A field to build predicates on: comparisons (==, !=, <, <=, >, >=), `.isin()`,
+    `.between()`, `.isblank()` and `.matches()`.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def _compare(self, op, value):
+        return Comparison(self.name, op, value)
+
+    def __eq__(self, value):
+        return self._compare("=", value)
+
+    def __ne__(self, value):
+        return self._compare("<>", value)
+
+    def __lt__(self, value):
+        return self._compare("<", value)
+
+    def __le__(self, value):
+        return self._compare("<=", value)
+
+    def __gt__(self, value):
+        return self._compare(">", value)
+
+    def __ge__(self, value):
+        return self._compare(">=", value)
+
+    __hash__ = object.__hash__
+
+    def isin(self, values):
+        return In(self.name, values)
+
+    def between(self, start = None, end = None):
+        """
+        Inclusive range, e.g. of dates written as YYYY-MM-DD. Either end can be left open.
+        """
+        parts = []
+        if start is not None:
+            parts.append(self >= start)
+        if end is not None:
+            parts.append(self <= end)
+        if not parts:
+            raise ValueError("between() needs a start, an end, or both")
+        return parts[0] if len(parts) == 1 else And(*parts)
+
+    def isblank(self):
+        return self._compare("=", "")
+
+    def matches(self, pattern):
+        """
+        Regular expression match; REDCap has no equivalent, so always done locally.
+        """
+        return Matches(self.name, pattern)
+
+
+class Comparison(Predicate):
+    # Blanks are never < or > anything, so e.g. [age] < 18 isn't the opposite of
+    # [age] >= 18 (neither matches a blank age); only = and <> are flipped, and other
+    # comparisons are negated with not(...)
+    NEGATED = {"=": "<>", "<>": "="}
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    @property
+    def fields(self):
+        return {self.field}
+
+    def negate(self):
+        if self.op not in self.NEGATED:
+            return Not(self)
+        return Comparison(self.field, self.NEGATED[self.op], self.value)
+
+    def to_filter_logic(self):
+        return f"[{self.field}] {self.op} {_quote(self.value)}"
+
+
+class In(Predicate):
+    def __init__(self, field, values, negated = False):
+        self.field = field
+        self.values = list(values)
+        self.negated = negated
+        if not self.values:
+            raise ValueError(f"isin() for {field} needs at least one value")
+
+    @property
+    def fields(self):
+        return {self.field}
+
+    def negate(self):
+        return In(self.field, self.values, not self.negated)
+
+    def to_filter_logic(self):
+        op, joint = ("<>", " and ") if self.negated else ("=", " or ")
+        terms = [ f"[{self.field}] {op} {_quote(v)}" for v in self.values ]
+        if len(terms) == 1:
+            return terms[0]
+        return f"({joint.join(terms)})"
+
+
+class _Combination(Predicate):
+    JOINT = None
+
+    def __init__(self, *parts):
+        self.parts = []
+        for part in parts: # flatten (a & b) & c into one level
+            if isinstance(part, self.__class__):
+                self.parts.extend(part.parts)
+            else:
+                self.parts.append(part)
+
+    @property
+    def pushable(self):
+        return all(p.pushable for p in self.parts)
+
+    @property
+    def fields(self):
+        return set().union(*(p.fields for p in self.parts))
+
+    def to_filter_logic(self):
+        return "(" + f" {self.JOINT} ".join(p.to_filter_logic() for p in self.parts) + ")"
+
+
+class And(_Combination):
+    JOINT = "and"
+
+    def negate(self):
+        return Or(*(p.negate() for p in self.parts))
+
+    def split(self):
+        pushed = [ p for p in (p.split()[0] for p in self.parts) if p is not None ]
+        local = [ p for p in (p.split()[1] for p in self.parts) if p is not None ]
+        return (
+            None if not pushed else pushed[0] if len(pushed) == 1 else And(*pushed),
+            None if not local else local[0] if len(local) == 1 else And(*local),
+        )
+
+    def evaluate(self, frame):
+        if self.pushable:
+            return super().evaluate(frame)
+        result = pd.Series(True, index=frame.index)
+        for part in self.parts:
+            result &= part.evaluate(frame)
+        return result
+
+
+class Or(_Combination):
+    JOINT = "or"
+
+    def negate(self):
+        return And(*(p.negate() for p in self.parts))
+
+    def evaluate(self, frame):
+        if self.pushable:
+            return super().evaluate(frame)
+        result = pd.Series(False, index=frame.index)
+        for part in self.parts:
+            result |= part.evaluate(frame)
+        return result
+
+
+class Not(Predicate):
+    """
+    Negation of a predicate that has no simpler opposite. Sent to REDCap as
+    not(...) when the predicate itself can be.
+    """
+    def __init__(self, part):
+        self.part = part
+
+    @property
+    def pushable(self):
+        return self.part.pushable
+
+    @property
+    def fields(self):
+        return self.part.fields
+
+    def negate(self):
+        return self.part
+
+    def to_filter_logic(self):
+        if not self.pushable:
+            return super().to_filter_logic()
+        return f"not({self.part.to_filter_logic()})"
+
+    def evaluate(self, frame):
+        if self.pushable:
+            return super().evaluate(frame)
+        return ~self.part.evaluate(frame)
+
+
+class Matches(Predicate):
+    pushable = False
+
+    def __init__(self, field, pattern):
+        self.field = field
+        self.pattern = re.compile(pattern)
+
+    @property
+    def fields(self):
+        return {self.field}
+
+    def evaluate(self, frame):
+        values = frame[self.field].where(frame[self.field].notna(), "").astype(str)
+        return values.map(lambda v: self.pattern.search(v) is not None).astype(bool)
+
+
+class Where(Predicate):
+    """
+    Any Python function of the wide DataFrame returning a boolean Series. Always
+    evaluated locally; list the fields it reads so they get exported.
+    """
+    pushable = False
+
+    def __init__(self, func, fields = ()):
+        self.func = func
+        self._fields = set(fields)
+
+    @property
+    def fields(self):
+        return set(self._fields)
+
+    def evaluate(self, frame):
+        return self.func(frame).astype(bool)
@@ -0,0 +1,289 @@
+"""
+scred/profiling.py
+
+Opt-in profiling of scred's hot paths: record filling (adding logic, parsing, masking),
+RecordSet construction, logic conversion, text extraction and HTTP requests. For each
+one, the calls, wall time and tracemalloc peak are collected while profiling is on;
+when it's off, each instrumented call costs one flag check.
+
+    from scred import profiling
+    with profiling.profile():
+        records.fill_missing(myproject.metadata)
+    profiling.report()            # DataFrame: calls, seconds, mean_ms, peak_mb, share
+    profiling.export("run1.json") # compare runs with profiling.compare("run1.json", "run2.json")
+
+Memory peaks are process-wide, so with several threads (e.g. concurrent exports) a
+path's peak includes what other threads allocated meanwhile. Code measuring its own
+peaks alongside (like scred.pipeline) should use `PeakMemory`, which keeps nested
+measurements from resetting each other's peaks.
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+FORMAT = 1
+
+# ---------------------------------------------------
+
+
+_peaks = threading.local()
+
+def _peak_stack():
+    stack = getattr(_peaks, "stack", None)
+    if stack is None:
+        stack = _peaks.stack = []
+    return stack
+
+
+class PeakMemory:
+    """
+    Context manager measuring, as `.bytes`, how far memory traced by tracemalloc rose
+    above what was in use on entry. tracemalloc only keeps one peak, which each
+    measurement resets when it starts; measurements nested inside one another on the
+    same thread (profiled paths, scred.pipeline's chunks and stages) pass their peaks
+    up as they start and finish, so resetting never loses an outer one's peak.
+    Measures nothing (0 bytes) if `trace` is off or tracemalloc isn't running.
+    """
+    __slots__ = ("trace", "start_bytes", "peak_bytes", "bytes")
+
+    def __init__(self, trace = True):
+        self.trace = trace
+        self.start_bytes = None
+        self.peak_bytes = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self.peak_bytes = 0
+        self.bytes = 0
+        if not (self.trace and tracemalloc.is_tracing()):
+            self.start_bytes = None
+            return self
+        current, peak = tracemalloc.get_traced_memory()
+        stack = _peak_stack()
+        if stack: # keep the outer measurement's peak so far before resetting
+            stack[-1].peak_bytes = max(stack[-1].peak_bytes, peak)
+        tracemalloc.reset_peak()
+        self.start_bytes = current
+        stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        if self.start_bytes is None:
+            return False
+        stack = _peak_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if tracemalloc.is_tracing():
+            absolute = max(tracemalloc.get_traced_memory()[1], self.peak_bytes)
+            self.bytes = max(0, absolute - self.start_bytes)
+            if stack:
+                stack[-1].peak_bytes = max(stack[-1].peak_bytes, absolute)
+        return False
+
+
+class _Span:
+    """
+    One timed call of a profiled path.
+    """
+    __slots__ = ("profiler", "name", "began", "memory")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.memory = PeakMemory(self.profiler.trace_memory).__enter__()
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.began
+        self.memory.__exit__(*exc)
+        self.profiler._record(self.name, seconds, self.memory.bytes)
+        return False
+
+
+class _Off:
+    """
+    Stand-in for _Span while profiling is off.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_OFF = _Off()
+
+
+class Profiler:
+    """
+    Collects {path name: calls, seconds, peak_bytes} while enabled. Seconds include
+    time spent in profiled paths called from inside (e.g. a record fill includes
+    parsing its logic), so stages can be compared with the whole.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = True
+        self._started_tracing = False
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def enable(self, trace_memory = True):
+        """
+        Start collecting. With `trace_memory`, tracemalloc is started too (if it isn't
+        already running), which slows allocation-heavy code down noticeably.
+        """
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop collecting (what's been collected is kept until `reset`).
+        """
+        self.enabled = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def reset(self):
+        with self._lock:
+            self._stats = dict()
+
+    def span(self, name):
+        """
+        Context manager timing one call of the path `name`.
+        """
+        if not self.enabled:
+            return _OFF
+        return _Span(self, name)
+
+    def _record(self, name, seconds, peak):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {"calls": 0, "seconds": 0.0, "peak_bytes": 0}
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["peak_bytes"] = max(stats["peak_bytes"], peak)
+
+    @property
+    def stats(self):
+        """
+        Snapshot: {path name: {"calls": n, "seconds": total, "peak_bytes": largest}}.
+        """
+        with self._lock:
+            return { name: dict(stats) for name, stats in self._stats.items() }
+
+    def report(self, stats = None):
+        """
+        Stats (these, or a snapshot given as `stats`) as a DataFrame, one row per
+        path, slowest first: calls, seconds, mean_ms, peak_mb and share of the total
+        time of all paths.
+        """
+        import pandas as pd
+        stats = self.stats if stats is None else stats
+        columns = ["calls", "seconds", "mean_ms", "peak_mb", "share"]
+        if not stats:
+            return pd.DataFrame(columns=columns).rename_axis("path")
+        report = pd.DataFrame.from_dict(stats, orient="index")
+        report["mean_ms"] = report["seconds"] / report["calls"] * 1000
+        report["peak_mb"] = report.pop("peak_bytes") / 1e6
+        report["share"] = report["seconds"] / max(report["seconds"].sum(), 1e-9)
+        report.index.name = "path"
+        return report[columns].sort_values("seconds", ascending=False)
+
+    def export(self, path, label = None):
+        """
+        Save the stats as JSON, e.g. to `compare` with another run later.
+        """
+        saved = {
+            "format": FORMAT,
+            "label": label,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "stats": self.stats,
+        }
+        with open(path, "w") as fh:
+            json.dump(saved, fh, indent=1)
+
+# ===================================================
+# The profiler scred's own code reports to, and shortcuts for using it.
+
+PROFILER = Profiler()
+
+def span(name):
+    return PROFILER.span(name)
+
+def profiled(name):
+    """
+    Decorator timing every call of a function as the path `name`.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with _Span(PROFILER, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def enable(trace_memory = True):
+    PROFILER.enable(trace_memory)
+
+def disable():
+    PROFILER.disable()
+
+def reset():
+    PROFILER.reset()
+
+@contextmanager
+def profile(trace_memory = True, reset = True):
+    """
+    Profile everything inside the `with` block (starting from zero unless
+    `reset=False`), then leave profiling off again.
+    """
+    if reset:
+        PROFILER.reset()
+    PROFILER.enable(trace_memory)
+    try:
+        yield PROFILER
+    finally:
+        PROFILER.disable()
+
+def report():
+    return PROFILER.report()
+
+def export(path, label = None):
+    PROFILER.export(path, label)
+
+def load(path):
+    """
+    Stats saved by `export`.
+    """
+    with open(path) as fh:
+        saved = json.load(fh)
+    if saved.get("format") != FORMAT:
+        raise ValueError(f"{path} isn't a scred profile")
+    return saved["stats"]
+
+def compare(before, after):
+    """
+    Side-by-side report of two runs, each a path saved by `export` or a stats
+    snapshot: calls, seconds and peak_mb from each, plus `speedup` (seconds before
+    divided by seconds after; above 1 means the second run was faster).
+    """
+    before = load(before) if isinstance(before, str) else before
+    after = load(after) if isinstance(after, str) else after
+    first = PROFILER.report(before)[["calls", "seconds", "peak_mb"]]
+    second = PROFILER.report(after)[["calls", "seconds", "peak_mb"]]
+    combined = first.join(second, how="outer", lsuffix="_before", rsuffix="_after")
+    combined["speedup"] = combined["seconds_before"] / combined["seconds_after"]
+    return combined.sort_values("seconds_before", ascending=False)
@@ -6,16 +6,73 @@ classes. Can't go in `dtypes` module because it relies on the `webapi` module, w
 lives "above" `dtypes` in the hierarchy.
 """
 
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import batching
 from . import webapi
-from . import dtypes
+
+# pandas (and with it scred.dtypes) is only imported by the methods that need it, so
+# jobs that only export raw JSON don't pay for it.
+
+log = logging.getLogger(__name__)
+
+# Outcome of one import request: the record IDs sent, how many values they changed,
+# the number of records REDCap reported importing, and the exception if it failed.
+ImportBatchResult = namedtuple("ImportBatchResult", ["records", "values", "count", "error"])
+
+# Outcome of exporting one uploaded file: where it came from, where it went, its size,
+# and whether it was "downloaded", "skipped" (already on disk) or "failed" (see error).
+# Files in repeating instruments or events also have their repeat instrument/instance.
+FileExportResult = namedtuple(
+    "FileExportResult",
+    ["record", "field", "event", "path", "size", "status", "error", "repeat_instrument", "repeat_instance"],
+    defaults=[None, None],
+)
+
+# Files exported so far are listed here (one JSON object per line) so that runs can
+# be interrupted and resumed.
+FILE_MANIFEST = ".scred_files.jsonl"
+
+def _filename_from_headers(headers):
+    """
+    REDCap names the file in the Content-Type header: `application/pdf; name="x.pdf"`.
+    """
+    match = re.search(r'name="?([^";]+)"?', headers.get("Content-Type", ""))
+    if match is None:
+        return None
+    return os.path.basename(match.group(1).strip())
+
+def _server_failure(ex):
+    """
+    True for errors a smaller request might avoid: timeouts, dropped connections and
+    5xx responses.
+    """
+    response = getattr(ex, "response", None)
+    if isinstance(ex, requests.HTTPError) and response is not None:
+        return response.status_code >= 500
+    return True
 
 # ---------------------------------------------------
    
 class RedcapProject:
     """
     Main class for top-level interaction. Requires a token and url to create requester.
+    With `warm_up=True`, project details are fetched in the background straight away;
+    see `warm_up`.
     """
-    def __init__(self, url, token, metadata = None, requester_kwargs = None):
+    def __init__(self, url, token, metadata = None, requester_kwargs = None, warm_up = False):
         if requester_kwargs is None:
             requester_kwargs = dict()
         self.requester = webapi.RedcapRequester(
@@ -23,8 +80,16 @@ class RedcapProject:
             url=url,
             **requester_kwargs,
         )
-        self._metadata = None
+        self._metadata = metadata
         self._version = None
+        self._export_fieldnames = None
+        # Threads starting up together shouldn't each fetch these
+        self._metadata_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._fieldnames_lock = threading.Lock()
+        self._warm_up = None
+        if warm_up:
+            self.warm_up()
 
     @property
     def url(self):
@@ -37,21 +102,98 @@ class RedcapProject:
         Property that holds the metadata (Data Dictionary) for this project instance.
         """
         if self._metadata is None:
-            self._metadata = dtypes.DataDictionary(self.requester.get_metadata())
+            with self._metadata_lock:
+                if self._metadata is None:
+                    from . import dtypes
+                    self._metadata = dtypes.DataDictionary(self.requester.get_metadata())
         return self._metadata
     
     @metadata.setter
     def metadata(self, value):
-        if not isinstance(value, (dtypes.DataDictionary, None)):
+        from . import dtypes
+        if not isinstance(value, (dtypes.DataDictionary, type(None))):
             raise TypeError("metadata must be None or DataDictionary")
         self._metadata = value
 
+    @property
+    def pythonic_metadata(self):
+        """
+        Copy of `metadata` with branching logic in pythonic syntax, the same one
+        Record and RecordSet fill_missing get from `metadata.pythonic()`, so it's only
+        converted once.
+        """
+        return self.metadata.pythonic()
+
+    @property
+    def primary_key(self):
+        """
+        REDCap always uses the first field in the data dictionary as the record ID.
+        """
+        return self.metadata.primary_key
+
     @property
     def version(self):
         if self._version is None:
-            self._version = self.requester.get_version()
+            with self._version_lock:
+                if self._version is None:
+                    self._version = self.requester.get_version()
         return self._version
 
+    @property
+    def export_fieldnames(self):
+        """
+        `get_export_fieldnames` for every field, fetched once.
+        """
+        if self._export_fieldnames is None:
+            with self._fieldnames_lock:
+                if self._export_fieldnames is None:
+                    self._export_fieldnames = self.get_export_fieldnames()
+        return self._export_fieldnames
+
+    def warm_up(self):
+        """
+        Start fetching metadata, version and export field names in the background, all
+        at once, then convert and compile the branching logic and calculations, so
+        it's all ready by the time it's needed (e.g. while records are exporting).
+        Properties asked for before their prefetch is done wait for it rather than
+        sending their own request; anything whose prefetch failed is fetched again
+        when asked for. Returns the background jobs' futures. Only runs once.
+        """
+        if self._warm_up is not None:
+            return self._warm_up
+        pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="scred-warm-up")
+        self._warm_up = [
+            pool.submit(self._prepare_logic),
+            pool.submit(lambda: self.version),
+            pool.submit(lambda: self.export_fieldnames),
+        ]
+        pool.shutdown(wait=False)
+        for future in self._warm_up:
+            future.add_done_callback(self._log_warm_up_failure)
+        return self._warm_up
+
+    @staticmethod
+    def _log_warm_up_failure(future):
+        if future.exception() is not None:
+            log.warning("Warm-up fetch failed; will retry when needed: %r", future.exception())
+
+    def _prepare_logic(self):
+        """
+        Fetch metadata, make its pythonic copy and compile every branching logic (in
+        both syntaxes) and calculation into scred.rclogic's cache.
+        """
+        from . import rclogic
+        metadata = self.metadata
+        pythonic = self.pythonic_metadata
+        texts = list(metadata["branching_logic"]) + list(metadata.calculations)
+        texts += list(pythonic["branching_logic"])
+        for text in texts:
+            try:
+                rclogic.compile_logic(text)
+            except rclogic.LogicError:
+                pass # reported when it's evaluated
+        return metadata
+
     def post(self, **kwargs):
         return self.requester.post(**kwargs)
 
@@ -76,9 +218,11 @@ class RedcapProject:
         payload_kwargs = {"content": "exportFieldNames"}
         if fields:
             payload_kwargs.update(field=",".join(fields))
-        return self.post(payload_kwargs).json()
+        return self.post(**payload_kwargs).json()
     
-    def get_records(self, records = None, fields = None, **kwargs):
+    def get_records(
+        self, records = None, fields = None, logic_fields = False, where = None, **kwargs
+    ):
         """
         Export a set of records from the given project. Optional arguments also include:
             -forms (replace spaces with _)
@@ -86,11 +230,361 @@ class RedcapProject:
             -dateRangeEnd
         For dateRange options, format as YYYY-MM-DD HH:MM:SS. Records retrieved are created
         OR modified within that range, and time boundaries are exclusive.
+
+        With `logic_fields=True`, the export is widened from `fields` to exactly what
+        fill_missing needs for them (see DataDictionary.fields_needed) instead of the
+        whole project.
+
+        `where` takes a scred.predicates.Predicate. Whatever part of it REDCap can
+        express is sent as filterLogic (combined with any filterLogic given); the rest
+        is applied to the exported rows locally, exporting any extra fields it needs.
         """
+        fields = self._project_fields(fields, logic_fields)
+        pushed, local = (None, None) if where is None else where.split()
+        if pushed is not None:
+            logic = pushed.to_filter_logic()
+            if kwargs.get("filterLogic"):
+                logic = f"({kwargs['filterLogic']}) and {logic}"
+            kwargs["filterLogic"] = logic
+        if local is not None and fields and not isinstance(fields, str):
+            fields = list(fields) + sorted(local.fields - set(fields))
+        payload = self._record_payload(records, fields)
+        rows = self.post(**payload, **kwargs).json()
+        if local is not None and rows:
+            import pandas as pd
+            keep = local.evaluate(pd.DataFrame(rows))
+            rows = [ row for row, kept in zip(rows, keep) if kept ]
+        return rows
+
+    def _project_fields(self, fields, logic_fields):
+        if logic_fields and fields and not isinstance(fields, str):
+            return self.metadata.fields_needed(fields)
+        return fields
+
+    @staticmethod
+    def _record_payload(records = None, fields = None):
         payload = {"content": "record"}
         if records and not isinstance(records, str):
-            payload.update(records=",".join(records))
+            payload.update(records=",".join(str(r) for r in records))
         if fields and not isinstance(fields, str):
             payload.update(fields=",".join(fields))
-        return self.post(**payload, **kwargs).json()
+        return payload
+
+    def get_record_ids(self, **kwargs):
+        """
+        Export only the primary key to get every record ID in the project. Longitudinal
+        projects return one row per event, so IDs are deduplicated (keeping order).
+        """
+        pk = self.primary_key
+        rows = self.get_records(fields=[pk], **kwargs)
+        return list(dict.fromkeys(row[pk] for row in rows))
+
+    def iter_records_batched(
+        self, records = None, fields = None, batcher = None, logic_fields = False, **kwargs
+    ):
+        """
+        Export records in batches, yielding the list of record dicts from each request.
+        Takes the same arguments as `get_records`, plus:
+            batcher: a scred.batching.AdaptiveBatcher deciding records per request. By
+                default one is made with limits suited to the number of fields exported.
+        Batches that time out or fail on the server (5xx) are retried at half the size
+        until the batcher's minimum size is reached, at which point the error is raised.
+        Other errors (e.g. a 403 for a bad token, a 400 for an unknown field) have
+        nothing to do with the batch size, so they're raised straight away.
+        """
+        fields = self._project_fields(fields, logic_fields)
+        if records is None:
+            records = self.get_record_ids()
+        records = list(records)
+        if batcher is None:
+            n_fields = len(fields) if fields else len(self.metadata)
+            batcher = batching.AdaptiveBatcher(n_fields=n_fields)
+        start = 0
+        while start < len(records):
+            batch = records[start:start + batcher.size]
+            payload = self._record_payload(batch, fields)
+            began = time.perf_counter()
+            try:
+                response = self.post(**payload, **kwargs)
+            except (requests.HTTPError, requests.Timeout, requests.ConnectionError) as ex:
+                if not _server_failure(ex) or not batcher.failed(len(batch)):
+                    raise
+                continue
+            batcher.observe(len(batch), time.perf_counter() - began, len(response.content))
+            start += len(batch)
+            yield response.json()
+
+    def get_records_batched(
+        self, records = None, fields = None, batcher = None, logic_fields = False, **kwargs
+    ):
+        """
+        Same as `iter_records_batched`, but collects every batch into one list of dicts,
+        just like `get_records` returns.
+        """
+        batches = self.iter_records_batched(records, fields, batcher, logic_fields, **kwargs)
+        return [ row for batch in batches for row in batch ]
+
+    def get_dags(self):
+        """
+        The project's data access groups, {unique group name: DataAccessGroup}, with
+        each group's members (from the user-DAG mapping).
+        """
+        from . import dtypes
+        members = dict()
+        for row in self.post(content="userDagMapping").json():
+            members.setdefault(row.get("redcap_data_access_group"), []).append(row["username"])
+        return {
+            row["unique_group_name"]: dtypes.DataAccessGroup.from_api(
+                row, members.get(row["unique_group_name"]),
+            )
+            for row in self.post(content="dag").json()
+        }
+
+    def get_dag_record_ids(self, **kwargs):
+        """
+        {unique group name: record IDs} for every data access group with records.
+        Records not in any group are listed under "".
+        """
+        pk = self.primary_key
+        rows = self.get_records(fields=[pk], exportDataAccessGroups="true", **kwargs)
+        groups = dict()
+        for row in rows:
+            groups.setdefault(row.get("redcap_data_access_group", ""), dict())[row[pk]] = None
+        return { group: list(ids) for group, ids in groups.items() }
+
+    def get_records_by_dag(
+        self, fields = None, dags = None, max_workers = 4, logic_fields = False, **kwargs
+    ):
+        """
+        Export records one data access group at a time, up to `max_workers` groups at
+        once, each in batches sized by its own AdaptiveBatcher (see
+        `iter_records_batched`), so a slow site's export doesn't hold back the plan
+        for the others. `dags` limits the export to those unique group names ("" for
+        records in no group). Other kwargs go in every record export.
+
+        Returns one RecordSet of every group's records. Each row has its group in
+        `redcap_data_access_group`, and `.groups` maps each group to its record IDs.
+        """
+        from . import dtypes
+        groups = self.get_dag_record_ids(**kwargs)
+        if dags is not None:
+            groups = { group: ids for group, ids in groups.items() if group in dags }
+        fields = self._project_fields(fields, logic_fields)
+        n_fields = len(fields) if fields else len(self.metadata)
+
+        def export(ids):
+            batcher = batching.AdaptiveBatcher(n_fields=n_fields)
+            return self.get_records_batched(
+                ids, fields, batcher, exportDataAccessGroups="true", **kwargs,
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            shards = list(pool.map(export, groups.values()))
+        recordset = dtypes.RecordSet(
+            [ row for rows in shards for row in rows ], primary_key=self.primary_key,
+        )
+        recordset.groups = groups
+        return recordset
+
+    def iter_report(self, report_id, chunk_rows = 5000, **kwargs):
+        """
+        Export a saved report, yielding lists of at most `chunk_rows` row dicts as they
+        arrive. The report is requested as CSV and parsed while it downloads, so only
+        one chunk is held at a time. Other kwargs (e.g. rawOrLabel) go in the payload.
+        """
+        response = self.post(
+            stream=True, content="report", report_id=report_id, format="csv", **kwargs,
+        )
+        with response:
+            response.raw.decode_content = True # in case it's gzipped
+            response.raw.auto_close = False # let the CSV reader see the end of the file
+            text = io.TextIOWrapper(response.raw, encoding="utf-8-sig", newline="")
+            chunk = []
+            for row in csv.DictReader(text):
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def get_report(self, report_id, lazy = True, cache_size = 128, **kwargs):
+        """
+        Export a saved report into a LazyRecordSet (or a RecordSet with `lazy=False`),
+        keyed on the report's first column, the record ID. Rows go straight from the
+        response into the set; see `iter_report`.
+
+        Longitudinal and repeating reports have a row per event or repeat instance;
+        every one is kept, keyed by its record ID, event and instance (as long as the
+        report includes those columns, as REDCap adds them by default). Rows that
+        still share a key trigger a warning, and only the last is kept.
+        """
+        rows = ( row for chunk in self.iter_report(report_id, **kwargs) for row in chunk )
+        first = next(rows, None)
+        if first is None:
+            pk, rows = self.primary_key, []
+        else:
+            pk, rows = next(iter(first)), itertools.chain([first], rows)
+        from . import dtypes
+        if lazy:
+            return dtypes.LazyRecordSet(rows, primary_key=pk, cache_size=cache_size)
+        return dtypes.RecordSet(rows, primary_key=pk)
+
+    def import_records(self, recordset, batch_size = 100, max_workers = 4):
+        """
+        Upload edits made to a RecordSet (or LazyRecordSet) since it was exported. Only
+        changed fields of changed records are sent (see `RecordSet.changes`), split into
+        batches of `batch_size` records with at most `max_workers` uploads at once.
+        Changes that blank out a value are sent with REDCap's "overwrite" behavior so
+        the blank takes effect.
+
+        Returns an ImportBatchResult per batch; a failed batch doesn't stop the others.
+        Records in successful batches are snapshotted as matching REDCap, so running
+        this again only sends what's still outstanding.
+        """
+        from . import dtypes
+        changes = recordset.changes()
+        pk = recordset.primary_key
+        keys = list(changes)
+        rows = [ {**dtypes.key_fields(key, pk), **changes[key]} for key in keys ]
+        batches = [ rows[i:i + batch_size] for i in range(0, len(rows), batch_size) ]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(self._import_batch, batches))
+        for start, result in zip(range(0, len(rows), batch_size), results):
+            if result.error is None:
+                recordset.snapshot(keys[start:start + batch_size])
+            else:
+                log.warning("Import of %d records failed: %r", len(result.records), result.error)
+        return results
+
+    def _import_batch(self, rows):
+        pk = next(iter(rows[0]))
+        ids = [ row[pk] for row in rows ]
+        n_values = sum(len(row) - 1 for row in rows)
+        blanks = any(value == "" for row in rows for value in row.values())
+        try:
+            response = self.post(
+                content="record",
+                action="import",
+                format="json",
+                type="flat",
+                overwriteBehavior="overwrite" if blanks else "normal",
+                returnContent="count",
+                data=json.dumps(rows),
+            )
+            count = response.json().get("count")
+        except (requests.RequestException, ValueError) as ex:
+            return ImportBatchResult(ids, n_values, 0, ex)
+        return ImportBatchResult(ids, n_values, count, None)
+
+    def export_files(
+        self, directory, records = None, fields = None, max_workers = 4,
+        chunk_size = 1 << 16, **kwargs,
+    ):
+        """
+        Download every uploaded file in the project's `file` fields (or just `fields`)
+        into `directory`, as `{directory}/{record}/{field}_{filename}`; longitudinal
+        projects get an extra `{event}` directory under the record, and files in
+        repeating instruments or events one more, `{instrument}_{instance}`. At most
+        `max_workers` downloads run at once and each file is written to disk in
+        `chunk_size` pieces rather than held in memory. Other kwargs are passed on to
+        the record export that finds which records have files.
+
+        Finished files are listed in a manifest in `directory`. Files listed there and
+        still on disk with the same size are skipped, so an interrupted run picks up
+        where it left off; a download cut short only ever leaves a `.part` file behind.
+
+        Returns a FileExportResult per file. A failed download doesn't stop the others.
+        """
+        if fields is None:
+            fields = self.metadata.file_fields
+        if not fields:
+            return []
+        pk = self.primary_key
+        rows = self.get_records(records=records, fields=[pk, *fields], **kwargs)
+        wanted = [
+            (
+                row[pk], field, row.get("redcap_event_name") or None,
+                row.get("redcap_repeat_instrument") or None,
+                str(row.get("redcap_repeat_instance") or "") or None,
+            )
+            for row in rows for field in fields if row.get(field)
+        ]
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, FILE_MANIFEST)
+        manifest = self._read_file_manifest(manifest_path)
+        lock = threading.Lock()
+
+        def export(item):
+            result = self._export_file(directory, *item, manifest.get(item), chunk_size)
+            if result.status == "downloaded":
+                entry = {
+                    "record": result.record, "field": result.field, "event": result.event,
+                    "repeat_instrument": result.repeat_instrument,
+                    "repeat_instance": result.repeat_instance,
+                    "path": os.path.relpath(result.path, directory), "size": result.size,
+                }
+                with lock, open(manifest_path, "a") as fh:
+                    fh.write(json.dumps(entry) + "\n")
+            elif result.status == "failed":
+                log.warning(
+                    "Export of %s for record %s failed: %r",
+                    result.field, result.record, result.error,
+                )
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(export, wanted))
+
+    @staticmethod
+    def _read_file_manifest(path):
+        """
+        {(record, field, event, repeat instrument, repeat instance): entry} for files
+        already exported. A line cut off by an interruption is ignored, and later lines
+        win over earlier ones.
+        """
+        manifest = dict()
+        if not os.path.exists(path):
+            return manifest
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key = (entry["record"], entry["field"], entry["event"])
+                key += (entry.get("repeat_instrument"), entry.get("repeat_instance"))
+                manifest[key] = entry
+        return manifest
+
+    def _export_file(self, directory, record, field, event, instrument, instance, done, chunk_size):
+        def result(path, size, status, error):
+            return FileExportResult(record, field, event, path, size, status, error, instrument, instance)
 
+        repeat = "_".join( part for part in (instrument, instance) if part )
+        folder = os.path.join(directory, str(record), *( part for part in (event, repeat) if part ))
+        if done is not None:
+            path = os.path.join(directory, done["path"])
+            if os.path.exists(path) and os.path.getsize(path) == done["size"]:
+                return result(path, done["size"], "skipped", None)
+        payload = {"content": "file", "action": "export", "record": record, "field": field}
+        if event:
+            payload.update(event=event)
+        if instance:
+            payload.update(repeat_instance=instance)
+        path = None
+        try:
+            response = self.post(stream=True, **payload)
+            with response:
+                name = _filename_from_headers(response.headers) or "file"
+                path = os.path.join(folder, f"{field}_{name}")
+                os.makedirs(folder, exist_ok=True)
+                size = 0
+                with open(path + ".part", "wb") as fh:
+                    for chunk in response.iter_content(chunk_size):
+                        fh.write(chunk)
+                        size += len(chunk)
+            os.replace(path + ".part", path)
+        except (requests.RequestException, OSError) as ex:
+            return result(path, None, "failed", ex)
+        return result(path, size, "downloaded", None)
@@ -0,0 +1,135 @@
+"""
+scred/ratelimit.py
+
+Client-side rate limiting for REDCap API calls. REDCap instances can cap the number of
+requests each user makes per minute and temporarily lock out tokens that go over, so
+requests wait for a token from a shared bucket rather than failing.
+"""
+
+import hashlib
+import threading
+import time
+
+# ---------------------------------------------------
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Each request takes one token; tokens refill at `rate`
+    per minute up to `burst`. Callers block in `.acquire()` until a token is free.
+
+    When the server says we're going too fast (`.throttled()`), the refill rate is
+    halved and nothing is handed out until the server's Retry-After has passed. Each
+    successful request afterwards (`.succeeded()`) creeps the rate back up toward the
+    configured one.
+    """
+    RECOVERY_STEP = 0.1 # fraction of the configured rate regained per success
+    MIN_FRACTION = 0.05 # never slow down below this fraction of the configured rate
+
+    def __init__(self, rate: float, burst: int = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.max_rate = rate / 60 # tokens per second
+        self.rate = self.max_rate
+        self.burst = burst if burst is not None else max(1, int(rate // 10))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "throttled": 0,
+        }
+
+    @property
+    def stats(self):
+        """
+        Snapshot of how much waiting this bucket has caused:
+            requests: tokens handed out
+            waits: how many of those had to wait
+            wait_seconds, max_wait_seconds: total and longest time spent waiting
+            throttled: throttling responses reported by the server
+            rate_per_minute: current (possibly slowed-down) refill rate
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["rate_per_minute"] = self.rate * 60
+        return stats
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """
+        Take one token, sleeping until one is available. Returns seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._stats["requests"] += 1
+                    if waited:
+                        self._stats["waits"] += 1
+                        self._stats["wait_seconds"] += waited
+                        self._stats["max_wait_seconds"] = max(
+                            self._stats["max_wait_seconds"], waited
+                        )
+                    return waited
+                delay = max(
+                    self._paused_until - now,
+                    (1 - self._tokens) / self.rate,
+                )
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self, retry_after: float = None):
+        """
+        The server rejected a request for going too fast. Halve the rate and hold
+        off entirely for `retry_after` seconds (or one token's worth of time).
+        """
+        with self._lock:
+            self._stats["throttled"] += 1
+            self.rate = max(self.rate / 2, self.max_rate * self.MIN_FRACTION)
+            self._tokens = 0.0
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def succeeded(self):
+        """
+        A request went through; recover some of the rate lost to throttling.
+        """
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.RECOVERY_STEP)
+
+# ---------------------------------------------------
+# Buckets shared between requesters, so parallel jobs in one process draw from the
+# same allowance when they use the same token (or talk to the same host).
+
+_shared_buckets = dict()
+_shared_lock = threading.Lock()
+
+def hash_token(token: str):
+    """
+    Stable, non-reversible stand-in for a token, safe to use as a key or log.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+def shared_bucket(key, rate: float, burst: int = None):
+    """
+    Get the TokenBucket registered under `key`, creating it if needed. The rate and
+    burst of the first caller win; later callers share the existing bucket.
+    """
+    with _shared_lock:
+        if key not in _shared_buckets:
+            _shared_buckets[key] = TokenBucket(rate, burst)
+        return _shared_buckets[key]
@@ -0,0 +1,727 @@
+"""
+scred/rclogic.py
+
+Parses REDCap logic (branching logic, calculations, filters) and evaluates it over whole
+columns at once. Where backfillna's Parser looks at one record at a time, an expression
+compiled here is evaluated against a "wide" DataFrame--one row per record, one column
+per exported field--so the logic for a field is checked for every record in one pass.
+
+Both REDCap syntax and the pythonic syntax made by DataDictionary.make_logic_pythonic
+are understood:
+    [age] >= 18 and [consent(1)] = '1'
+    age >= 18 and consent___1 == 1
+Bare words that aren't a column in the data are taken as text, since the pythonic
+conversion strips the quotes from string values.
+
+In longitudinal data (one row per record and event, with a `redcap_event_name`
+column), a field can be qualified with the event to read it from:
+    [baseline_arm_1][consent] = '1'     (pythonic: baseline_arm_1.consent == 1)
+Every row of a record then sees the value from that record's row for the event. The
+lookup is done for all records at once, by joining on the record ID (the frame's
+index, or the column named by Context's `record_key`).
+
+Supported functions are listed in FUNCTIONS; each one receives its arguments as pandas
+Series aligned to the data's index.
+"""
+
+import datetime
+import math
+import operator
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Values treated as missing by isblankormissingcode(), besides blanks. Add your
+# project's missing data codes here if it uses them.
+MISSING_CODES = set()
+
+# Column naming the event of each row in longitudinal exports
+EVENT_COLUMN = "redcap_event_name"
+
+# ---------------------------------------------------
+
+
+class LogicError(ValueError):
+    """
+    Raised when a logic string can't be parsed.
+    """
+    pass
+
+
+class Context:
+    """
+    The data an expression is evaluated against, plus caches so shared work is done
+    once: each field is converted to text/numbers once, and each distinct subexpression
+    (by its canonical `.key`) is evaluated once, however many expressions contain it.
+    Many fields in a section or matrix share the same branching logic, or combine the
+    same conditions differently, so this saves a lot of repeated column operations.
+
+    `.stats` counts the work: "requested" is how many syntax tree nodes would have been
+    evaluated without sharing, "evaluated" how many actually were.
+
+    `record_key` names the column holding record IDs, used to look up event-qualified
+    fields in longitudinal data; by default the frame's index is the record ID.
+    """
+    def __init__(self, frame: pd.DataFrame, record_key = None):
+        self.frame = frame
+        self.index = frame.index
+        self.record_key = record_key
+        self._columns = dict()
+        self._constants = dict()
+        self._numeric = dict()
+        self._missing = set()
+        self._results = dict()
+        self.stats = {"requested": 0, "evaluated": 0}
+
+    @property
+    def saved(self):
+        """
+        Node evaluations avoided by sharing subexpressions.
+        """
+        return self.stats["requested"] - self.stats["evaluated"]
+
+    def evaluate(self, node):
+        """
+        Value of `node` over all rows, computed only the first time it's asked for.
+        """
+        if node.key not in self._results:
+            self._results[node.key] = node.evaluate(self)
+            self.stats["evaluated"] += 1
+        return self._results[node.key]
+
+    def has_column(self, name):
+        return name in self.frame.columns
+
+    def column(self, name):
+        """
+        A field's values as text; blanks (and None/NaN) become "".
+        """
+        if name not in self._columns:
+            if name in self.frame.columns:
+                self._columns[name] = self.text(self.frame[name])
+            else:
+                if name not in self._missing:
+                    warnings.warn(f"Cannot find {name} in data; treating it as blank")
+                    self._missing.add(name)
+                self._columns[name] = self.constant("")
+        return self._columns[name]
+
+    @property
+    def longitudinal(self):
+        return EVENT_COLUMN in self.frame.columns
+
+    def event_column(self, event, name):
+        """
+        For every row, the value of field `name` in the same record's row for `event`
+        ("" where the record has no such row). Done as one join of the event's rows on
+        record ID, not a lookup per row. Outside longitudinal data there's only one
+        row per record, so this is just the field.
+        """
+        if not self.longitudinal:
+            return self.column(name)
+        key = (event, name)
+        if key not in self._columns:
+            if name not in self.frame.columns:
+                self._columns[key] = self.column(name)
+                return self._columns[key]
+            ids = self.index if self.record_key is None else self.frame[self.record_key]
+            ids = pd.Index(ids)
+            in_event = (self.frame[EVENT_COLUMN] == event).to_numpy()
+            values = pd.Series(self.column(name).to_numpy()[in_event], index=ids[in_event])
+            values = values[~values.index.duplicated()] # first row, e.g. of repeats
+            joined = values.reindex(ids).to_numpy()
+            self._columns[key] = pd.Series(
+                np.where(pd.isna(joined), "", joined), index=self.index, dtype=object,
+            )
+        return self._columns[key]
+
+    def constant(self, value):
+        key = (type(value), value)
+        if key not in self._constants:
+            dtype = object if isinstance(value, str) else None
+            self._constants[key] = pd.Series(value, index=self.index, dtype=dtype)
+        return self._constants[key]
+
+    def num(self, values):
+        """
+        Values as floats; anything that isn't a number (including blanks) becomes NaN.
+        """
+        if values.dtype == bool:
+            return values.astype(float)
+        if values.dtype.kind in "iuf":
+            return values.astype(float)
+        key = id(values)
+        if key not in self._numeric:
+            self._numeric[key] = (values, pd.to_numeric(values, errors="coerce").astype(float))
+        return self._numeric[key][1]
+
+    @staticmethod
+    def text(values):
+        """
+        Values as text. Computed numbers are written the way REDCap shows them (no
+        trailing .0), and NaN becomes blank.
+        """
+        if values.dtype == bool:
+            return values.map({True: "1", False: "0"})
+        if values.dtype.kind in "iuf":
+            return values.map(_format_number)
+        return values.where(values.notna(), "").astype(str)
+
+    def truth(self, values):
+        """
+        Values as booleans: numbers are true when non-zero, text when non-blank.
+        """
+        if values.dtype == bool:
+            return values
+        numbers = self.num(values)
+        if values.dtype.kind in "iuf":
+            return numbers.notna() & (numbers != 0)
+        text = self.text(values)
+        return (numbers.notna() & (numbers != 0)) | (numbers.isna() & (text != ""))
+
+def _format_number(x):
+    if x is None or (isinstance(x, float) and math.isnan(x)):
+        return ""
+    if float(x).is_integer():
+        return str(int(x))
+    return str(x)
+
+def _scalar(values, default = None):
+    """
+    First value of a Series built from a constant (e.g. the units given to datediff).
+    """
+    if values is None or len(values) == 0:
+        return default
+    return values.iloc[0]
+
+# ===================================================
+# Syntax tree. Every node has a `.key`, a canonical text form, and `.evaluate(ctx)`
+# returning a Series aligned to ctx.index. Nodes evaluate their children through
+# ctx.evaluate() so that shared subexpressions come from the context's cache.
+
+
+class Node:
+    children = ()
+
+    @property
+    def size(self):
+        """
+        Number of nodes in this subtree, i.e. evaluations needed without any sharing.
+        """
+        return 1 + sum(child.size for child in self.children)
+
+    @property
+    def fields(self):
+        """
+        Names of every field (export column) this node refers to.
+        """
+        found = set()
+        for child in self.children:
+            found |= child.fields
+        return found
+
+    @property
+    def events(self):
+        """
+        Names of every event this node's fields are qualified with.
+        """
+        found = set()
+        for child in self.children:
+            found |= child.events
+        return found
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.key})"
+
+
+class Literal(Node):
+    def __init__(self, value, text = None):
+        self.value = value
+        self.key = repr(value) if text is None else text
+
+    def evaluate(self, ctx):
+        return ctx.constant(self.value)
+
+
+class Field(Node):
+    def __init__(self, name, code = None, bare = False, event = None):
+        self.name = name
+        self.code = code
+        self.bare = bare
+        self.event = event
+        if bare:
+            self.key = self.column if event is None else f"{event}.{self.column}"
+        else:
+            self.key = f"[{self.column}]" if event is None else f"[{event}][{self.column}]"
+
+    @property
+    def column(self):
+        """
+        Export name of the field: checkbox choices become `field___code`, with a
+        negative code's minus sign turned into an underscore like REDCap does.
+        """
+        if self.code is None:
+            return self.name
+        code = re.sub(r"\W", "_", str(self.code).strip().lower())
+        return f"{self.name}___{code}"
+
+    @property
+    def fields(self):
+        return {self.column}
+
+    @property
+    def events(self):
+        return set() if self.event is None else {self.event}
+
+    def evaluate(self, ctx):
+        if self.event is not None:
+            return ctx.event_column(self.event, self.column)
+        # Pythonic logic has its quotes stripped, so an unknown bare word is a value
+        if self.bare and not ctx.has_column(self.column):
+            return ctx.constant(self.name)
+        return ctx.column(self.column)
+
+
+class Call(Node):
+    def __init__(self, name, args):
+        self.name = name.lower()
+        self.children = tuple(args)
+        if self.name not in FUNCTIONS:
+            raise LogicError(f"Unknown function: {name}")
+        self.key = f"{self.name}({', '.join(a.key for a in self.children)})"
+
+    def evaluate(self, ctx):
+        args = [ ctx.evaluate(a) for a in self.children ]
+        return FUNCTIONS[self.name](ctx, *args)
+
+
+class Unary(Node):
+    def __init__(self, op, operand):
+        self.op = op.lower()
+        self.children = (operand,)
+        self.key = f"({self.op} {operand.key})"
+
+    def evaluate(self, ctx):
+        value = ctx.evaluate(self.children[0])
+        if self.op == "not":
+            return ~ctx.truth(value)
+        if self.op == "-":
+            return -ctx.num(value)
+        return ctx.num(value)
+
+
+class Binary(Node):
+    ARITHMETIC = {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+        "^": operator.pow,
+    }
+    ORDERING = {
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+    }
+    ALIASES = {"==": "=", "!=": "<>"}
+
+    def __init__(self, op, left, right):
+        op = op.lower()
+        self.op = self.ALIASES.get(op, op)
+        self.children = (left, right)
+        self.key = f"({left.key} {self.op} {right.key})"
+
+    def evaluate(self, ctx):
+        left, right = (ctx.evaluate(c) for c in self.children)
+        if self.op == "and":
+            return ctx.truth(left) & ctx.truth(right)
+        if self.op == "or":
+            return ctx.truth(left) | ctx.truth(right)
+        if self.op == "=":
+            return _equals(ctx, left, right)
+        if self.op == "<>":
+            return ~_equals(ctx, left, right)
+        if self.op in self.ORDERING:
+            return _order(ctx, self.ORDERING[self.op], left, right)
+        with np.errstate(all="ignore"):
+            result = self.ARITHMETIC[self.op](ctx.num(left), ctx.num(right))
+        return result.replace([np.inf, -np.inf], np.nan)
+
+def _equals(ctx, left, right):
+    """
+    REDCap compares as numbers when both sides are numbers, otherwise as text. So
+    [x] = '1' matches "1" and "1.0", and [x] = '' matches blanks.
+    """
+    lnum, rnum = ctx.num(left), ctx.num(right)
+    numeric = lnum.notna() & rnum.notna()
+    return (numeric & (lnum == rnum)) | (~numeric & (ctx.text(left) == ctx.text(right)))
+
+def _order(ctx, compare, left, right):
+    """
+    <, <=, >, >= compare numbers as numbers and other text (e.g. dates) as text. Blank
+    values never satisfy an ordering.
+    """
+    lnum, rnum = ctx.num(left), ctx.num(right)
+    numeric = lnum.notna() & rnum.notna()
+    ltext, rtext = ctx.text(left), ctx.text(right)
+    textual = ~numeric & (ltext != "") & (rtext != "")
+    return (numeric & compare(lnum, rnum)) | (textual & compare(ltext, rtext))
+
+# ===================================================
+# Function library
+
+
+FUNCTIONS = dict()
+
+def function(*names):
+    """
+    Register a function under one or more (lowercase) REDCap names.
+    """
+    def register(func):
+        for name in names:
+            FUNCTIONS[name] = func
+        return func
+    return register
+
+def _numbers(ctx, args):
+    return pd.concat([ ctx.num(a) for a in args ], axis=1)
+
+@function("if")
+def _if(ctx, condition, when_true, when_false):
+    return when_true.where(ctx.truth(condition), when_false)
+
+@function("sum")
+def _sum(ctx, *args):
+    return _numbers(ctx, args).sum(axis=1, min_count=1)
+
+@function("mean")
+def _mean(ctx, *args):
+    return _numbers(ctx, args).mean(axis=1)
+
+@function("median")
+def _median(ctx, *args):
+    return _numbers(ctx, args).median(axis=1)
+
+@function("min")
+def _min(ctx, *args):
+    return _numbers(ctx, args).min(axis=1)
+
+@function("max")
+def _max(ctx, *args):
+    return _numbers(ctx, args).max(axis=1)
+
+@function("stdev")
+def _stdev(ctx, *args):
+    return _numbers(ctx, args).std(axis=1)
+
+def _rounder(method):
+    def rounded(ctx, value, places = None):
+        digits = int(_scalar(ctx.num(places), 0)) if places is not None else 0
+        scale = 10.0 ** digits
+        with np.errstate(all="ignore"):
+            return pd.Series(method(ctx.num(value) * scale) / scale, index=ctx.index)
+    return rounded
+
+def _round_half_away(values):
+    """
+    REDCap (like PHP) rounds halves away from zero: 2.5 -> 3, -2.5 -> -3. np.round
+    would round them to even.
+    """
+    return np.sign(values) * np.floor(np.abs(values) + 0.5)
+
+FUNCTIONS["round"] = _rounder(_round_half_away)
+FUNCTIONS["roundup"] = _rounder(np.ceil)
+FUNCTIONS["rounddown"] = _rounder(np.floor)
+
+@function("abs")
+def _abs(ctx, value):
+    return ctx.num(value).abs()
+
+@function("sqrt")
+def _sqrt(ctx, value):
+    with np.errstate(all="ignore"):
+        return np.sqrt(ctx.num(value))
+
+@function("exponential")
+def _exponential(ctx, value):
+    with np.errstate(all="ignore"):
+        return np.exp(ctx.num(value))
+
+@function("log")
+def _log(ctx, value, base = None):
+    with np.errstate(all="ignore"):
+        result = np.log(ctx.num(value))
+        if base is not None:
+            result = result / np.log(ctx.num(base))
+    return result.replace([np.inf, -np.inf], np.nan)
+
+@function("mod")
+def _mod(ctx, dividend, divisor):
+    with np.errstate(all="ignore"):
+        return ctx.num(dividend) % ctx.num(divisor)
+
+@function("isnumber")
+def _isnumber(ctx, value):
+    return ctx.num(value).notna()
+
+@function("isinteger")
+def _isinteger(ctx, value):
+    return ctx.text(value).str.match(r"^-?\d+$")
+
+@function("isblankormissingcode")
+def _isblankormissingcode(ctx, value):
+    text = ctx.text(value)
+    return (text.str.strip() == "") | text.isin(MISSING_CODES)
+
+@function("contains")
+def _contains(ctx, haystack, needle):
+    needle = _scalar(ctx.text(needle), "").lower()
+    return ctx.text(haystack).str.lower().str.contains(needle, regex=False)
+
+@function("not_contain")
+def _not_contain(ctx, haystack, needle):
+    return ~_contains(ctx, haystack, needle)
+
+@function("starts_with")
+def _starts_with(ctx, haystack, needle):
+    needle = _scalar(ctx.text(needle), "").lower()
+    return ctx.text(haystack).str.lower().str.startswith(needle)
+
+@function("ends_with")
+def _ends_with(ctx, haystack, needle):
+    needle = _scalar(ctx.text(needle), "").lower()
+    return ctx.text(haystack).str.lower().str.endswith(needle)
+
+@function("find")
+def _find(ctx, needle, haystack):
+    needle = _scalar(ctx.text(needle), "").lower()
+    return (ctx.text(haystack).str.lower().str.find(needle) + 1).astype(float)
+
+@function("left")
+def _left(ctx, text, n):
+    return ctx.text(text).str[:int(_scalar(ctx.num(n), 0))]
+
+@function("right")
+def _right(ctx, text, n):
+    n = int(_scalar(ctx.num(n), 0))
+    return ctx.text(text).str[-n:] if n else ctx.constant("")
+
+@function("mid")
+def _mid(ctx, text, start, n):
+    start = int(_scalar(ctx.num(start), 1)) - 1
+    return ctx.text(text).str[start:start + int(_scalar(ctx.num(n), 0))]
+
+@function("length")
+def _length(ctx, text):
+    return ctx.text(text).str.len().astype(float)
+
+@function("concat")
+def _concat(ctx, *args):
+    result = ctx.constant("")
+    for arg in args:
+        result = result + ctx.text(arg)
+    return result
+
+@function("upper")
+def _upper(ctx, text):
+    return ctx.text(text).str.upper()
+
+@function("lower")
+def _lower(ctx, text):
+    return ctx.text(text).str.lower()
+
+@function("trim")
+def _trim(ctx, text):
+    return ctx.text(text).str.strip()
+
+# Dates. Exported data always use Y-M-D, whatever the field's display format.
+
+DATE_UNITS = {
+    "y": 365.2425 * 86400,
+    "M": 30.436875 * 86400,
+    "d": 86400,
+    "h": 3600,
+    "m": 60,
+    "s": 1,
+}
+
+def _dates(ctx, values, fmt = "ymd"):
+    text = ctx.text(values).str.strip()
+    now = pd.Timestamp(datetime.datetime.now())
+    text = text.replace({"today": now.normalize().isoformat(), "now": now.isoformat()})
+    return pd.to_datetime(text, errors="coerce", dayfirst=(fmt == "dmy"))
+
+@function("datediff")
+def _datediff(ctx, first, second, units, *options):
+    """
+    datediff(date1, date2, units[, dateformat][, returnSignedValue]). Unsigned
+    (absolute) unless returnSignedValue is true.
+    """
+    fmt, signed = "ymd", False
+    for option in options:
+        value = str(_scalar(ctx.text(option), "")).lower()
+        if value in ("ymd", "mdy", "dmy"):
+            fmt = value
+        else:
+            signed = value in ("true", "1")
+    unit = _scalar(ctx.text(units), "d")
+    if unit not in DATE_UNITS:
+        unit = unit.lower()
+    seconds = (_dates(ctx, second, fmt) - _dates(ctx, first, fmt)).dt.total_seconds()
+    result = seconds / DATE_UNITS.get(unit, 86400)
+    return result if signed else result.abs()
+
+@function("year")
+def _year(ctx, value):
+    return _dates(ctx, value).dt.year.astype(float)
+
+@function("month")
+def _month(ctx, value):
+    return _dates(ctx, value).dt.month.astype(float)
+
+@function("day")
+def _day(ctx, value):
+    return _dates(ctx, value).dt.day.astype(float)
+
+# ===================================================
+# Grammar, built the first time something is compiled.
+
+_grammar = None
+
+def _fold_binary(tokens):
+    node = tokens[0]
+    for i in range(1, len(tokens), 2):
+        node = Binary(tokens[i], node, tokens[i + 1])
+    return node
+
+def _fold_unary(tokens):
+    node = tokens[-1]
+    for op in reversed(tokens[:-1]):
+        node = Unary(op, node)
+    return node
+
+def _build_grammar():
+    """
+    Precedence levels are chained by hand, tightest first, rather than with
+    pp.infixNotation, which backtracks exponentially on nested function calls.
+    pyparsing is imported here so `import scred.rclogic` stays cheap.
+    """
+    import pyparsing as pp
+    expression = pp.Forward()
+    keyword = pp.Regex(r"(?i)(and|or|not|true|false)\b")
+    name = pp.Regex(r"[A-Za-z_][A-Za-z0-9_]*")
+
+    number = pp.Regex(r"\d+\.\d*|\.\d+|\d+")
+    number.setParseAction(lambda t: Literal(float(t[0]), t[0]))
+    string = pp.QuotedString("'", escChar="\\") | pp.QuotedString('"', escChar="\\")
+    string.setParseAction(lambda t: Literal(t[0], repr(t[0])))
+    boolean = pp.Regex(r"(?i)(true|false)\b")
+    boolean.setParseAction(lambda t: Literal(float(t[0].lower() == "true"), t[0].lower()))
+
+    checkbox_code = pp.Suppress("(") + pp.Regex(r"[^()\[\]]+")("code") + pp.Suppress(")")
+    event = pp.Suppress("[") + name("event") + pp.Suppress("]") + pp.FollowedBy("[")
+    field = (
+        pp.Optional(event) + pp.Suppress("[") + name("name") + pp.Optional(checkbox_code)
+        + pp.Suppress("]")
+    )
+    field.setParseAction(lambda t: Field(t["name"], t.get("code"), event=t.get("event")))
+
+    call = name("name") + pp.Suppress("(") + pp.Group(
+        pp.Optional(pp.delimitedList(expression))
+    )("args") + pp.Suppress(")")
+    call.setParseAction(lambda t: Call(t["name"], list(t["args"])))
+
+    bare = ~keyword + pp.Regex(r"(?P<event>[A-Za-z_][A-Za-z0-9_]*\.)?(?P<name>[A-Za-z_][A-Za-z0-9_]*)")
+    bare.setParseAction(
+        lambda t: Field(t["name"], bare=True, event=(t.get("event") or "")[:-1] or None)
+    )
+
+    nested = pp.Suppress("(") + expression + pp.Suppress(")")
+    atom = number | string | field | boolean | call | bare | nested
+
+    def binary_level(operand, op):
+        level = operand + pp.ZeroOrMore(op + operand)
+        return level.setParseAction(_fold_binary)
+
+    power = binary_level(atom, pp.Literal("^"))
+    signed = (pp.ZeroOrMore(pp.oneOf("- +")) + power).setParseAction(_fold_unary)
+    product = binary_level(signed, pp.oneOf("* /"))
+    total = binary_level(product, pp.oneOf("+ -"))
+    comparison = binary_level(total, pp.Regex(r"==|=|<>|!=|<=|>=|<|>"))
+    negation = (pp.ZeroOrMore(pp.Regex(r"(?i)not\b")) + comparison).setParseAction(_fold_unary)
+    conjunction = binary_level(negation, pp.Regex(r"(?i)and\b"))
+    disjunction = binary_level(conjunction, pp.Regex(r"(?i)or\b"))
+    expression <<= disjunction
+    return expression + pp.StringEnd()
+
+def parse(text: str):
+    """
+    Parse a logic string into its syntax tree. Raises LogicError if it can't be parsed.
+    """
+    import pyparsing as pp
+    global _grammar
+    if _grammar is None:
+        _grammar = _build_grammar()
+    try:
+        return _grammar.parseString(text)[0]
+    except pp.ParseBaseException as ex:
+        raise LogicError(f"Cannot parse logic {text!r}: {ex}") from None
+
+# ===================================================
+
+
+class Expression:
+    """
+    A compiled logic string. Blank logic is always satisfied.
+        .evaluate(data): the expression's value for every row
+        .test(data): the expression's truth (e.g. "is this branching logic met?")
+    `data` can be a wide DataFrame or a Context built from one.
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.tree = parse(text) if text.strip() else None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.text!r})"
+
+    @property
+    def fields(self):
+        return set() if self.tree is None else self.tree.fields
+
+    @property
+    def events(self):
+        return set() if self.tree is None else self.tree.events
+
+    @property
+    def size(self):
+        return 0 if self.tree is None else self.tree.size
+
+    @staticmethod
+    def _context(data):
+        return data if isinstance(data, Context) else Context(data)
+
+    def evaluate(self, data):
+        ctx = self._context(data)
+        if self.tree is None:
+            return ctx.constant(True)
+        ctx.stats["requested"] += self.size
+        return ctx.evaluate(self.tree)
+
+    def test(self, data):
+        ctx = self._context(data)
+        return ctx.truth(self.evaluate(ctx))
+
+_compiled = dict()
+
+def compile_logic(text):
+    """
+    Compile a logic string, reusing the result for strings seen before.
+    """
+    if not isinstance(text, str):
+        text = "" # None or NaN: no logic
+    if text not in _compiled:
+        _compiled[text] = Expression(text)
+    return _compiled[text]
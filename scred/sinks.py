@@ -0,0 +1,171 @@
+"""
+scred/sinks.py
+
+Writing DataFrames of records out to files: whole frames at once (`write_frame`) or
+chunk by chunk as they're produced (`FrameWriter`, `SqliteSink`), so exports don't
+have to be held in memory. Used by the command line tool and scred.pipeline.
+
+pandas is only imported when something is read or written.
+"""
+
+import os
+
+FORMATS = ("json", "jsonl", "csv", "parquet", "sqlite")
+SQLITE_EXTENSIONS = ("sqlite", "sqlite3", "db")
+
+# ---------------------------------------------------
+
+
+def output_format(path, fmt = None):
+    """
+    Format to write `path` in: `fmt` if given, otherwise from the file extension.
+    """
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt in SQLITE_EXTENSIONS:
+            fmt = "sqlite"
+    if fmt not in FORMATS:
+        raise ValueError(f"Can't tell output format of {path}; use --format ({', '.join(FORMATS)})")
+    return fmt
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow # noqa: F401
+    except ImportError:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow") from None
+
+
+def _text_objects(frame):
+    """
+    Object columns as plain text, so mixed values (e.g. answers and numeric missing
+    codes) have one type. Typed columns are left alone.
+    """
+    objects = [ c for c in frame.columns if frame[c].dtype == object ]
+    if not objects:
+        return frame
+    frame = frame.copy()
+    for column in objects:
+        frame[column] = frame[column].where(frame[column].notna(), "").astype(str)
+    return frame
+
+
+def read_frame(path, fmt, table = "records"):
+    import pandas as pd
+    if fmt == "parquet":
+        _require_pyarrow()
+        return pd.read_parquet(path)
+    if fmt == "csv":
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    if fmt == "sqlite":
+        import sqlite3
+        with sqlite3.connect(path) as connection:
+            return pd.read_sql(f'SELECT * FROM "{table}"', connection)
+    return pd.read_json(
+        path, orient="records", dtype=False, convert_dates=False, lines=(fmt == "jsonl"),
+    )
+
+
+def write_frame(frame, path, fmt):
+    with open_sink(path, fmt) as sink:
+        sink.write(frame)
+
+
+def open_sink(path, fmt = None, table = "records"):
+    """
+    Chunk-by-chunk writer for `path`, in `fmt` or the format its extension implies.
+    """
+    fmt = output_format(path, fmt)
+    if fmt == "sqlite":
+        return SqliteSink(path, table)
+    return FrameWriter(path, fmt)
+
+
+class FrameWriter:
+    """
+    Writes DataFrames to one file as they arrive, so exports don't have to be held in
+    memory. Every frame must have the same columns as the first; in Parquet files,
+    typed (e.g. numeric) columns keep the type they had in the first frame.
+    """
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.columns = None
+        self._parquet = None
+        self._wrote_rows = False # JSON: whether the next rows need a separating comma
+        if fmt == "parquet":
+            _require_pyarrow()
+        self._fh = None if fmt == "parquet" else open(path, "w", newline="")
+
+    def write(self, frame):
+        if self.columns is None:
+            self.columns = list(frame.columns)
+            if self.fmt == "json":
+                self._fh.write("[")
+        frame = frame.reindex(columns=self.columns)
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = None if self._parquet is None else self._parquet.schema
+            table = pa.Table.from_pandas(_text_objects(frame), schema=schema, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        elif self.fmt == "csv":
+            frame.to_csv(self._fh, index=False, header=(self._fh.tell() == 0))
+        elif self.fmt == "jsonl":
+            if len(frame):
+                self._fh.write(frame.to_json(orient="records", lines=True).rstrip("\n") + "\n")
+        elif len(frame):
+            if self._wrote_rows:
+                self._fh.write(",")
+            self._fh.write(frame.to_json(orient="records")[1:-1])
+            self._wrote_rows = True
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._fh is not None:
+            if self.fmt == "json":
+                self._fh.write("[" if self.columns is None else "")
+                self._fh.write("]")
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteSink:
+    """
+    Writes DataFrames into one table of a SQLite database, replacing the table on the
+    first write and appending after that.
+    """
+    def __init__(self, path, table = "records"):
+        import sqlite3
+        self.path = path
+        self.table = table
+        self.columns = None
+        self._connection = sqlite3.connect(path)
+
+    def write(self, frame):
+        first = self.columns is None
+        if first:
+            self.columns = list(frame.columns)
+        frame = _text_objects(frame.reindex(columns=self.columns))
+        frame.to_sql(
+            self.table, self._connection, index=False,
+            if_exists="replace" if first else "append",
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -2,11 +2,34 @@
 textract.py
 
 Tools for extracting text entries directly from REDCap.
+
+With a TextIndex, only entries that are new or changed since the last run are pulled
+for review:
+
+    t = Textractor(myproject, "record_id", index=TextIndex("reviewed.json"))
+    t.pull_new_to_csv("to_review.csv")
+
+Entries only count as pulled once they've been written out: `pull_new_to_csv` commits
+them to the index after writing the file; after `pull_new` or `pull_new_to_dataframe`,
+write the entries out and then call `commit`.
 """
 
+import datetime
+import hashlib
+import json
+import os
+
 import pandas as pd
 from requests.exceptions import HTTPError
 
+from . import batching
+from . import dtypes
+from . import profiling
+
+# Tell apart text entries of the same record and field in longitudinal projects and
+# repeating instruments/events
+WHERE_COLUMNS = ("redcap_event_name", "redcap_repeat_instance")
+
 # ---------------------------------------------------
 
 
@@ -15,11 +38,14 @@ class Textractor:
     Takes a scred.RedcapProject instance and pulls the values of all text fields.
         project: the instance to use for sending requests
         idfield: the field in that REDCap project to use for labeling records
+        index: a TextIndex of entries already pulled, for `pull_new`
     """
-    def __init__(self, project, idfield: str):
+    def __init__(self, project, idfield: str, index = None):
         self.project = project
         self.idfield = idfield
         self.bounded = set()
+        self.index = index
+        self._pending = None # what the last pull_new would add to the index
         # TODO: set Project attrs to None, call API when they're first accessed
     
     @property
@@ -36,6 +62,10 @@ class Textractor:
             value = set(value) # let any exceptions rise
         self._bounded = value
 
+    @property
+    def metadata(self):
+        return self.project.metadata
+
     @property
     def textfields(self):
         text_mask = (self.metadata["field_type"] == "text")
@@ -45,35 +75,235 @@ class Textractor:
     def desired(self):
         return sorted(self.textfields - self.bounded)
 
+    @profiling.profiled("Textractor.pull_desired")
     def pull_desired(self, **kwargs):
         """
         Extracts all provided values from REDCap for each desired field. Returns a
-        JSON object.
+        list of (field, record, value) entries; in longitudinal projects or those with
+        repeating instruments, each entry also has the event and repeat instance it
+        came from: (field, record, value, event, instance).
         """
         data = self._request_desired(**kwargs)
-        df = pd.DataFrame(data)
-        df = df.set_index(self.idfield).T
+        return self._entries(data)
+
+    def _entries(self, data):
+        if not data:
+            return []
+        df = pd.DataFrame(data).fillna("")
+        where = self._where_columns(df.columns)
+        ids = df[self.idfield].tolist()
+        if where: # a project may export the event without repeat columns, or vice versa
+            places = df.reindex(columns=where).fillna("").astype(str)
+            places = [ tuple(row) for row in places.values.tolist() ]
+        else:
+            places = [()] * len(df)
+        order = sorted(range(len(df)), key=lambda i: (ids[i], places[i]))
+        skip = {self.idfield, *dtypes.ROW_COLUMNS}
         entries = []
-        for field, row in df.iterrows():
-            has_text = row.loc[lambda x: x != ""] # .loc might break it, test
-            for idfield, value in sorted(has_text.iteritems()):
-                new = (field, idfield, value)
-                entries.append(new) # Factor out 2nd loop into generator? yield has_text
+        for field in df.columns:
+            if field in skip:
+                continue
+            values = df[field].tolist()
+            entries.extend(
+                (field, ids[i], values[i], *places[i]) for i in order if values[i] != ""
+            )
         return entries
 
-    def _request_desired(self, **kwargs):
+    @staticmethod
+    def _where_columns(columns):
+        """
+        The event and repeat instance columns, if `columns` (of an export) has either;
+        then both, so entries always carry both (blank where a column is missing).
+        """
+        if not any(c in columns for c in WHERE_COLUMNS):
+            return []
+        return list(WHERE_COLUMNS)
+
+    def pull_new(self, since = None, batcher = None, **kwargs):
+        """
+        Like `pull_desired`, but only returns entries that aren't in `self.index` yet
+        (new, or changed since they were last pulled). They're added to the index by
+        `commit`, once they've been written out, so a failed write doesn't lose them.
+            since: only export records modified since then ("YYYY-MM-DD HH:MM:SS").
+                Defaults to when the index was last pulled into; pass False to check
+                every record.
+            batcher: export in batches (see RedcapProject.iter_records_batched) using
+                this scred.batching.AdaptiveBatcher, or True for a default one
+        The modified-since time is taken from this machine's clock when the pull
+        starts, so keep it in step with the server's.
+        """
+        if self.index is None:
+            raise ValueError("pull_new needs a TextIndex: Textractor(..., index=TextIndex(path))")
+        started = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if since is None:
+            since = self.index.last_pull
+        if since:
+            kwargs["dateRangeBegin"] = since
+        data = self._request_desired(batcher=batcher, **kwargs)
+        entries = self._entries(data)
+        self._pending = (entries, self._checked(data), started)
+        return [ entry for entry in entries if entry not in self.index ]
+
+    def commit(self):
+        """
+        Add the entries from the last `pull_new` to the index and save it (if it has a
+        path). Call this once they've been written out.
+        """
+        if self._pending is None:
+            return
+        entries, checked, started = self._pending
+        self.index.update(entries, checked=checked)
+        self.index.last_pull = started
+        if self.index.path is not None:
+            self.index.save()
+        self._pending = None
+
+    def _checked(self, data):
+        """
+        (field, record) for every desired field of every record in `data`, blank or not,
+        plus the event and repeat instance where entries have them.
+        """
+        where = self._where_columns(data[0]) if data else []
+        return [
+            (field, row[self.idfield], *( str(row.get(c) or "") for c in where ))
+            for row in data for field in self.desired if field in row
+        ]
+
+    def _request_desired(self, batcher = None, **kwargs):
         """
         Factored out of `pull_desired` for testability. Returns JSON of REDCap records.
+        Only the ID field and the desired text fields are exported, in batches if a
+        `batcher` is given.
         """
         payload = {"fields": [self.idfield] + self.desired}
         payload.update(kwargs)
-        return self.project.get_records(**payload)
+        if batcher is None:
+            return self.project.get_records(**payload)
+        if batcher is True:
+            batcher = batching.AdaptiveBatcher(n_fields=len(payload["fields"]))
+        records = self.project.get_record_ids(**kwargs)
+        return self.project.get_records_batched(records, batcher=batcher, **payload)
 
-    def pull_to_csv(self, filename, *args, **kwargs):
-        tups = self.pull_desired(*args, **kwargs)
+    def pull_to_dataframe(self, *args, **kwargs):
+        """
+        `pull_desired` as a review sheet: one row per entry, with an empty column for
+        reviewers to fill in.
+        """
+        return self._review_sheet(self.pull_desired(*args, **kwargs))
+
+    @staticmethod
+    def _review_sheet(tups):
+        columns = ["Field", "Participant ID", "Value Reported"]
+        if tups and len(tups[0]) > 3:
+            columns += ["Event", "Repeat Instance"]
         df = pd.DataFrame(
             tups,
-            columns=["Field", "Participant ID", "Value Reported"]
+            columns=columns
         )
         df["Action Needed"] = ""
+        return df
+
+    def pull_to_csv(self, filename, *args, **kwargs):
+        df = self.pull_to_dataframe(*args, **kwargs)
         df.to_csv(filename, index=False)
+
+    def pull_new_to_dataframe(self, *args, **kwargs):
+        """
+        `pull_new` as a review sheet, like `pull_to_dataframe`.
+        """
+        return self._review_sheet(self.pull_new(*args, **kwargs))
+
+    def pull_new_to_csv(self, filename, *args, **kwargs):
+        df = self.pull_new_to_dataframe(*args, **kwargs)
+        df.to_csv(filename, index=False)
+        self.commit()
+
+# ===================================================
+
+
+class TextIndex:
+    """
+    Text entries already pulled for review: (field, record, event, repeat instance) ->
+    hash of the value, kept in a JSON file at `path` if one is given. Values themselves
+    aren't stored. Entries are (field, record, value) tuples, with the event and repeat
+    instance after the value where the project has them.
+        last_pull: when `Textractor.pull_new` last started, or None
+    """
+    FORMAT = 1
+
+    def __init__(self, path = None):
+        self.path = path
+        self.last_pull = None
+        self._hashes = dict() # field: {record key: hash}, see _key
+        if path is not None and os.path.exists(path):
+            with open(path) as fh:
+                stored = json.load(fh)
+            if stored.get("format") == self.FORMAT:
+                self._hashes = stored["entries"]
+                self.last_pull = stored.get("last_pull")
+
+    def __len__(self):
+        return sum(len(records) for records in self._hashes.values())
+
+    def __contains__(self, entry):
+        """
+        Whether a (field, record, value[, event, instance]) entry has been pulled before.
+        """
+        field, record, value, *where = entry
+        return self._hashes.get(field, {}).get(self._key(record, where)) == self.hash_value(value)
+
+    @staticmethod
+    def _key(record, where = ()):
+        """
+        The record ID, or for an entry from an event or repeat instance, the ID, event
+        and instance as a JSON list.
+        """
+        where = [ str(w) for w in where ]
+        if not any(where):
+            return str(record)
+        return json.dumps([str(record), *where])
+
+    @staticmethod
+    def hash_value(value):
+        return hashlib.blake2b(str(value).encode(), digest_size=16).hexdigest()
+
+    def update(self, entries, checked = ()):
+        """
+        Add (field, record, value[, event, instance]) entries, returning those that
+        weren't already in the index. Any (field, record[, event, instance]) in
+        `checked` without an entry is now blank, so is dropped; if the same text comes
+        back later it counts as new.
+        """
+        new = [ entry for entry in entries if entry not in self ]
+        present = { (field, self._key(record, where)) for field, record, _, *where in entries }
+        for field, record, *where in checked:
+            key = self._key(record, where)
+            if (field, key) not in present:
+                self._hashes.get(field, {}).pop(key, None)
+        for field, record, value, *where in new:
+            self._hashes.setdefault(field, {})[self._key(record, where)] = self.hash_value(value)
+        return new
+
+    def forget(self, fields = None):
+        """
+        Drop entries for `fields` (all, by default) so they're pulled again, and the
+        last pull time so every record is checked next time.
+        """
+        if fields is None:
+            self._hashes.clear()
+        for field in (fields or []):
+            self._hashes.pop(field, None)
+        self.last_pull = None
+
+    def save(self, path = None):
+        """
+        Write to `path` (default: the path given when created), replacing the file
+        only once the new one is complete.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the text index to")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"format": self.FORMAT, "last_pull": self.last_pull, "entries": self._hashes}, fh)
+        os.replace(tmp, path)
@@ -0,0 +1,207 @@
+"""
+scred/validation.py
+
+Checks exported values against the validation set up for each text field in the data
+dictionary (`text_validation_type_or_show_slider_number`, `text_validation_min`,
+`text_validation_max`): integers, numbers, dates and times, emails, phone numbers and
+so on, with their ranges. Rules are compiled once per field and applied to a whole
+column at a time; each distinct value is only checked once.
+
+    violations = Validator(myproject.metadata).validate(records.as_wide_dataframe())
+"""
+
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import dtypes
+
+# Formats the API exports values in, whatever the display format in REDCap (so
+# date_mdy values still arrive as YYYY-MM-DD)
+DATE_FORMATS = {
+    "date": "%Y-%m-%d",
+    "datetime": "%Y-%m-%d %H:%M",
+    "datetime_seconds": "%Y-%m-%d %H:%M:%S",
+}
+
+PATTERNS = {
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "datetime": r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}",
+    "datetime_seconds": r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}",
+    "integer": r"[-+]?\d+",
+    "number": r"[-+]?(\d+\.?\d*|\.\d+)",
+    "number_comma_decimal": r"[-+]?(\d+,?\d*|,\d+)",
+    "time": r"([01]\d|2[0-3]):[0-5]\d",
+    "time_mm_ss": r"[0-5]\d:[0-5]\d",
+    "email": r"[^@\s]+@[^@\s]+\.[^@\s]+",
+    "phone": r"(\+?1[\s.-]?)?\(?[2-9]\d{2}\)?[\s.-]?\d{3}[\s.-]?\d{4}",
+    "zipcode": r"\d{5}(-\d{4})?",
+    "alpha_only": r"[A-Za-z]+",
+    "postalcode_canada": r"[A-Za-z]\d[A-Za-z] ?\d[A-Za-z]\d",
+    "ssn": r"\d{3}-\d{2}-\d{4}",
+}
+
+# number_1dp ... number_4dp (and their _comma_decimal variants) need exactly that many
+# decimal places
+FIXED_DECIMALS = re.compile(r"number_(?P<places>\d+)dp(?P<comma>_comma_decimal)?")
+
+VIOLATION_COLUMNS = ["record", "field", "value", "validation", "problem"]
+
+# ---------------------------------------------------
+
+
+def _kind(validation):
+    """
+    Family of a REDCap validation type: number_2dp -> number, date_mdy -> date,
+    datetime_seconds_dmy -> datetime_seconds, and so on. Values are parsed by family;
+    the exact format (e.g. number_2dp's two decimal places) is up to `_pattern`.
+    """
+    if validation.startswith("datetime_seconds"):
+        return "datetime_seconds"
+    if validation.startswith("datetime"):
+        return "datetime"
+    if validation.startswith("date"):
+        return "date"
+    if validation.startswith("number") and validation.endswith("comma_decimal"):
+        return "number_comma_decimal"
+    if validation.startswith("number"):
+        return "number"
+    return validation
+
+
+def _pattern(validation):
+    """
+    Regular expression a value of this validation type must match in full, or None
+    if scred can't check it.
+    """
+    fixed = FIXED_DECIMALS.fullmatch(validation)
+    if fixed:
+        point = "," if fixed["comma"] else r"\."
+        return rf"[-+]?\d+{point}\d{{{fixed['places']}}}"
+    return PATTERNS.get(_kind(validation))
+
+
+class FieldRule:
+    """
+    Compiled validation for one field. `check(values)` takes the distinct values of a
+    column (strings) and returns the problem with each ("format", "below minimum",
+    "above maximum") or None where it's valid.
+    """
+    def __init__(self, field, validation, minimum = "", maximum = ""):
+        self.field = field
+        self.validation = validation
+        self.kind = _kind(validation)
+        pattern = _pattern(validation)
+        self.pattern = None if pattern is None else re.compile(pattern)
+        self.minimum = self._bound(minimum)
+        self.maximum = self._bound(maximum)
+
+    @property
+    def checkable(self):
+        return self.pattern is not None
+
+    def _bound(self, text):
+        if text is None or str(text).strip() == "":
+            return None
+        text = str(text).strip()
+        if self.kind in DATE_FORMATS:
+            if text.lower() in ("today", "now"):
+                return pd.Timestamp(datetime.datetime.now())
+            return pd.to_datetime(text, errors="coerce")
+        try:
+            return float(text.replace(",", ".") if self.kind == "number_comma_decimal" else text)
+        except ValueError:
+            return None
+
+    def _parse(self, values):
+        """
+        Comparable versions of `values` (NaN/NaT where they don't parse).
+        """
+        if self.kind in DATE_FORMATS:
+            # The pattern has already checked the layout; this catches e.g. 2021-02-30
+            return pd.to_datetime(values, format=DATE_FORMATS[self.kind], errors="coerce")
+        if self.kind == "number_comma_decimal":
+            values = values.str.replace(",", ".", regex=False)
+        return pd.to_numeric(values, errors="coerce")
+
+    def check(self, values: pd.Series):
+        problems = pd.Series(None, index=values.index, dtype=object)
+        valid = np.array([ self.pattern.fullmatch(v) is not None for v in values ], dtype=bool)
+        parsed = None
+        if self.kind in DATE_FORMATS or self.minimum is not None or self.maximum is not None:
+            parsed = self._parse(values)
+            if self.kind in DATE_FORMATS:
+                valid &= parsed.notna().to_numpy()
+        problems[~valid] = "format"
+        if parsed is not None:
+            if self.minimum is not None:
+                problems[valid & (parsed < self.minimum).to_numpy()] = "below minimum"
+            if self.maximum is not None:
+                problems[valid & (parsed > self.maximum).to_numpy()] = "above maximum"
+        return problems
+
+
+class Validator:
+    """
+    Validation rules for every text field in `datadict` that has a validation type
+    scred knows how to check. Fields with other types (or none) are skipped.
+    """
+    def __init__(self, datadict: "dtypes.DataDictionary"):
+        self.rules = dict()
+        self.unsupported = set()
+        texts = datadict[datadict["field_type"] == "text"]
+        for field, row in texts.iterrows():
+            validation = row.get("text_validation_type_or_show_slider_number") or ""
+            if not validation:
+                continue
+            rule = FieldRule(
+                field, validation,
+                row.get("text_validation_min", ""), row.get("text_validation_max", ""),
+            )
+            if rule.checkable:
+                self.rules[field] = rule
+            else:
+                self.unsupported.add(validation)
+
+    def validate(self, frame: pd.DataFrame):
+        """
+        Violations in a wide frame of records (one row per record, one column per
+        field), as a DataFrame with one row per bad value: record, field, value,
+        validation, problem. Blanks and fill_missing's N/A and bad-data codes are
+        never violations.
+        """
+        skip = {"", str(dtypes.Record.NACODE), str(dtypes.Record.BADCODE)}
+        found = []
+        for field, rule in self.rules.items():
+            if field not in frame.columns:
+                continue
+            column = frame[field]
+            codes, uniques = pd.factorize(column)
+            text = pd.Series([ str(u).strip() for u in uniques ], dtype=object)
+            checked = np.array([ t not in skip for t in text ], dtype=bool)
+            problems = np.full(len(uniques), None, dtype=object)
+            if checked.any():
+                problems[checked] = rule.check(text[checked].reset_index(drop=True)).to_numpy()
+            bad = np.append(pd.notna(problems), False) # code -1 (NaN) is never bad
+            if not bad.any():
+                continue
+            rows = np.flatnonzero(bad[codes])
+            found.append(pd.DataFrame({
+                "record": frame.index[rows],
+                "field": field,
+                "value": column.to_numpy()[rows],
+                "validation": rule.validation,
+                "problem": problems[codes[rows]],
+            }))
+        if not found:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        return pd.concat(found, ignore_index=True)
+
+
+def validate(frame: pd.DataFrame, datadict: "dtypes.DataDictionary"):
+    """
+    Shortcut for Validator(datadict).validate(frame).
+    """
+    return Validator(datadict).validate(frame)
@@ -4,13 +4,60 @@ scred/webapi.py
 Creates the request-sending class used to interact with a REDCap instance.
 """
 
+from urllib.parse import urlparse
+
 import requests
 
+from . import cache as response_cache
+from . import profiling
+from . import ratelimit
+
 
 class RedcapRequester:
-    def __init__(self, url, token, default_format = "json"):
+    """
+    Sends requests to one REDCap project.
+        url, token: where to send requests and the project token to send with them
+        default_format: format REDCap should respond in, unless a request says otherwise
+        rate_limit: maximum requests per minute. None (default) means no client-side
+            limit. Requesters in this process with the same token, or the same host if
+            `rate_limit_scope="host"`, share one allowance.
+        rate_limiter: a scred.ratelimit.TokenBucket to use instead of a shared one.
+        session: a requests.Session to send through, e.g. to share a connection pool
+            between requesters. By default each request opens its own connection.
+        max_throttle_retries: how many times to wait and retry a request that the
+            server rejected for exceeding its rate limit (HTTP 429, or a 403 saying so)
+        cache: a scred.cache.ResponseCache to answer repeated read-only requests from,
+            or True for one with default settings. Off by default. Can be shared
+            between requesters.
+        coalesce: identical read-only requests made at the same time (e.g. from several
+            threads) share one HTTP call and its response
+    """
+    def __init__(
+        self,
+        url,
+        token,
+        default_format = "json",
+        rate_limit = None,
+        rate_limit_scope = "token",
+        rate_limiter = None,
+        max_throttle_retries = 5,
+        session = None,
+        cache = None,
+        coalesce = True,
+    ):
         self._url = url
+        self.session = session
         self.payloader = self._build_payloader(token, default_format)
+        if rate_limiter is None and rate_limit is not None:
+            rate_limiter = ratelimit.shared_bucket(
+                self._limiter_key(url, token, rate_limit_scope), rate_limit,
+            )
+        self.rate_limiter = rate_limiter
+        self.max_throttle_retries = max_throttle_retries
+        if cache is True:
+            cache = response_cache.ResponseCache()
+        self.cache = cache or None
+        self.in_flight = response_cache.SingleFlight() if coalesce else None
 
     @staticmethod
     def _build_payloader(token, default_format):
@@ -24,19 +71,103 @@ class RedcapRequester:
             return payload
         return payloader
 
+    @staticmethod
+    def _limiter_key(url, token, scope):
+        if scope == "token":
+            return ("token", urlparse(url).netloc, ratelimit.hash_token(token))
+        if scope == "host":
+            return ("host", urlparse(url).netloc)
+        raise ValueError(f"rate_limit_scope must be 'token' or 'host', not {scope}")
+
     @property
     def url(self):
         return self._url
 
-    def post(self, **kwargs):
+    def cache_key(self, payload):
+        return response_cache.ResponseCache.key(self.url, payload)
+
+    @staticmethod
+    def _is_throttled(response):
+        """
+        REDCap answers with a 429, or on some versions a 403 explaining that the
+        token's API rate limit was exceeded.
+        """
+        if response.status_code == 429:
+            return True
+        if response.status_code == 403:
+            text = response.text.lower()
+            return "rate limit" in text or "too many" in text
+        return False
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return None
+
+    def _send(self, payload, stream = False):
+        """
+        Post once, waiting on the rate limiter first (if any). Throttling responses
+        slow the limiter down and the request is retried instead of failing.
+        """
+        attempts = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            sender = requests if self.session is None else self.session
+            response = sender.post(self.url, payload, stream=stream)
+            if self.rate_limiter is None:
+                return response
+            if not self._is_throttled(response):
+                self.rate_limiter.succeeded()
+                return response
+            if attempts >= self.max_throttle_retries:
+                return response
+            self.rate_limiter.throttled(self._retry_after(response))
+            response.close() # a streamed response holds its connection until closed
+            attempts += 1
+
+    def post(self, stream = False, **kwargs):
+        """
+        Send a request with `kwargs` added to the payload. With `stream=True` the body
+        isn't downloaded until it's read (e.g. with `response.iter_content()`), so big
+        files don't have to fit in memory; close the response when done with it.
+        """
         payload = self.payloader(**kwargs)
-        response = requests.post(self.url, payload)
+        with profiling.span(f"RedcapRequester.post[{payload.get('content')}]"):
+            return self._post(payload, stream)
+
+    def _post(self, payload, stream):
+        """
+        `post` once the payload is built: cache, coalescing, then the request itself.
+        """
+        key = None
+        if self.cache is not None and not stream and self.cache.ttl(payload) is not None:
+            key = self.cache_key(payload)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if self.in_flight is not None and not stream and not response_cache.is_write(payload):
+            response = self.in_flight.do(
+                key or self.cache_key(payload),
+                lambda: self._send(payload),
+                share=response_cache.copy_response,
+            )
+        else:
+            response = self._send(payload, stream=stream)
+        if key is not None:
+            self.cache.put(key, payload, response)
+        elif self.cache is not None and response.ok and response_cache.is_write(payload):
+            # Something may have changed; don't answer data requests from before it
+            self.cache.invalidate(["record", "report"])
         if not response.ok:
+            response.close()
             msg = (
                 "Couldn't complete request. Code "
                 f"{response.status_code}: {response.reason}."
             )
-            raise requests.HTTPError(msg)
+            raise requests.HTTPError(msg, response=response)
         else:
             return response
 
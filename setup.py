@@ -16,6 +16,8 @@ setup(
     url="https://github.com/markjbaker/scred/",
     packages=find_packages(),
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow"]},
+    entry_points={"console_scripts": ["scred = scred.cli:main"]},
     classifiers=[
         "Programming Language :: Python :: 3.7",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
@@ -0,0 +1,221 @@
+"""
+tests/fakeserver.py
+
+Local stand-in for a REDCap API endpoint, served from a background thread so tests can
+send real HTTP requests without a REDCap instance. Only the parts of the API that
+scred uses are answered.
+"""
+
+import csv
+import io
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Always exported, whichever fields are asked for, as on a real server
+ROW_COLUMNS = ("redcap_event_name", "redcap_repeat_instrument", "redcap_repeat_instance")
+
+# ---------------------------------------------------
+
+
+class FakeRedcapServer:
+    """
+    Serves `metadata` and `records` (lists of dicts, as the real API returns them).
+        .calls: Counter of requests received per `content` value
+        .payloads: every payload received, in order
+        .latency: seconds to sleep before answering each request
+        .fail_above: answer record exports asking for more records than this with a 500
+        .throttle: answer this many upcoming requests with a 429, as a rate limit would
+        .reject_token: answer every request with a 403, as for an invalid token
+        .files: uploaded files, {(record, field): (filename, bytes)}, or
+            {(record, field, repeat instance): ...} for files in repeat instances
+        .reports: saved reports, {report ID: list of row dicts}
+        .dags: data access groups, as a `content=dag` export returns them
+        .user_dags: {username: unique group name}
+        .record_dags: {record ID: unique group name}, for records in a group
+    """
+    def __init__(self, metadata=None, records=None, version="8.5.28", files=None, reports=None):
+        self.metadata = metadata or []
+        self.records = records or []
+        self.files = files or {}
+        self.reports = reports or {}
+        self.dags = []
+        self.user_dags = {}
+        self.record_dags = {}
+        self.version = version
+        self.calls = Counter()
+        self.payloads = []
+        self.latency = 0
+        self.fail_above = None
+        self.throttle = 0
+        self.reject_token = False
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode()
+                payload = { k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items() }
+                status, content_type, data = server.respond(payload)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def respond(self, payload):
+        """
+        Returns (status, content type, body bytes) for a request payload.
+        """
+        content = payload.get("content")
+        with self._lock:
+            self.calls[content] += 1
+            self.payloads.append(payload)
+            if self.throttle:
+                self.throttle -= 1
+                return (429, "text/plain", b"API rate limit exceeded")
+            if self.reject_token:
+                return (403, "text/plain", b"You do not have permissions to use the API")
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, f"_respond_{content}", None)
+        if handler is None:
+            return (400, "text/plain", b"Unsupported content")
+        return handler(payload)
+
+    @staticmethod
+    def _json(obj, status=200):
+        return (status, "application/json", json.dumps(obj).encode())
+
+    def _respond_metadata(self, payload):
+        return self._json(self.metadata)
+
+    def _respond_exportFieldNames(self, payload):
+        names = []
+        for field in self.metadata:
+            if field["field_type"] in ("calc", "file", "descriptive"):
+                continue
+            if payload.get("field") and field["field_name"] != payload["field"]:
+                continue
+            codes = [""]
+            if field["field_type"] == "checkbox":
+                choices = field["select_choices_or_calculations"].split("|")
+                codes = [ c.split(",")[0].strip() for c in choices ]
+            names.extend(
+                {
+                    "original_field_name": field["field_name"],
+                    "choice_value": code,
+                    "export_field_name": f"{field['field_name']}___{code}" if code else field["field_name"],
+                }
+                for code in codes
+            )
+        return self._json(names)
+
+    def _respond_version(self, payload):
+        return (200, "text/plain", self.version.encode())
+
+    def _respond_record(self, payload):
+        if payload.get("action") == "import":
+            return self._import_records(payload)
+        rows = self.records
+        if payload.get("records"):
+            wanted = set(payload["records"].split(","))
+            rows = [ r for r in rows if str(next(iter(r.values()))) in wanted ]
+            if self.fail_above is not None and len(wanted) > self.fail_above:
+                return (500, "text/plain", b"Server timed out")
+        if payload.get("filterLogic"):
+            import pandas as pd
+            from scred import rclogic
+            keep = rclogic.compile_logic(payload["filterLogic"]).test(pd.DataFrame(rows))
+            rows = [ r for r, kept in zip(rows, keep) if kept ]
+        if payload.get("fields"):
+            fields = payload["fields"].split(",")
+            rows = [
+                {
+                    k: v for k, v in r.items()
+                    if k in fields or k.split("___")[0] in fields or k in ROW_COLUMNS
+                }
+                for r in rows
+            ]
+        if payload.get("exportDataAccessGroups") == "true":
+            rows = [
+                dict(r, redcap_data_access_group=self.record_dags.get(str(next(iter(r.values()))), ""))
+                for r in rows
+            ]
+        return self._json(rows)
+
+    def _respond_dag(self, payload):
+        return self._json(self.dags)
+
+    def _respond_userDagMapping(self, payload):
+        return self._json([
+            {"username": user, "redcap_data_access_group": dag}
+            for user, dag in self.user_dags.items()
+        ])
+
+    def _respond_file(self, payload):
+        key = (payload.get("record"), payload.get("field"))
+        if payload.get("repeat_instance"):
+            key += (payload["repeat_instance"],)
+        found = self.files.get(key)
+        if found is None:
+            return (400, "text/plain", b"There is no file to download for this record")
+        name, data = found
+        return (200, f'application/octet-stream; name="{name}"', data)
+
+    def _respond_report(self, payload):
+        rows = self.reports.get(payload.get("report_id"))
+        if rows is None:
+            return (400, "text/plain", b"The value of the parameter \"report_id\" is not valid")
+        if payload.get("format") != "csv":
+            return self._json(rows)
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+        return (200, "text/csv; charset=utf-8", out.getvalue().encode("utf-8-sig"))
+
+    def _import_records(self, payload):
+        """
+        Merge imported values into the stored records. Blanks only overwrite stored
+        values with overwriteBehavior=overwrite, as on a real server.
+        """
+        overwrite = payload.get("overwriteBehavior") == "overwrite"
+        imported = json.loads(payload["data"])
+        with self._lock:
+            by_id = { str(next(iter(r.values()))): r for r in self.records }
+            for row in imported:
+                key = str(next(iter(row.values())))
+                stored = by_id.get(key)
+                if stored is None:
+                    stored = by_id[key] = dict(row)
+                    self.records.append(stored)
+                stored.update({ k: v for k, v in row.items() if v != "" or overwrite })
+        return self._json({"count": len(imported)})
@@ -62,8 +62,34 @@ def test_make_logic_pythonic_converts_redcap_syntax():
     for field, expected in var_and_logic.items():
         assert dd.loc[field, "branching_logic"] == expected
 
+def test_make_logic_pythonic_keeps_event_qualified_fields():
+    converted = DataDictionary._logic_statement_to_python("[baseline_arm_1][consent(1)] = '1'")
+    assert converted == "baseline_arm_1.consent___1 == 1"
+
 def test_DataDictionary_copy():
     dd = _setup_neurogap_practice_DataDictionary()
     dd2 = dd.copy()
     assert dd2 is not dd
     assert all(dd == dd2)
+
+def test_fields_needed_follows_branching_logic():
+    dd = DataDictionary(testdata.get_fake_project_metadata(n_forms=5, fields_per_form=10))
+    # form2_q2's logic uses form2_gate and form2_q1, which only depends on form2_gate
+    assert dd.fields_needed(["form2_q2"]) == ["record_id", "form2_gate", "form2_q1", "form2_q2"]
+    # Checkbox choices resolve to their field; unknown names are kept at the end
+    assert dd.fields_needed(["form3_q3___2", "form3_complete"]) == [
+        "record_id", "form3_gate", "form3_q3", "form3_complete",
+    ]
+    assert len(dd.fields_needed(["form1_q2"])) < len(dd) / 10
+
+def test_pythonic_copy_is_reused_until_logic_changes():
+    dd = DataDictionary(testdata.get_fake_project_metadata())
+    pythonic = dd.pythonic()
+    assert pythonic.blogic_fmt == "python" and dd.blogic_fmt == "redcap"
+    assert dd.pythonic() is pythonic
+    assert pythonic.pythonic() is pythonic
+    dd.loc["form1_q2", "branching_logic"] = "[form1_gate] = '0'"
+    changed = dd.pythonic()
+    assert changed is not pythonic
+    assert changed.loc["form1_q2", "branching_logic"] == "form1_gate == 0"
+    assert dd.copy().pythonic() is not changed
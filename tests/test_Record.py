@@ -12,7 +12,7 @@ sys.path.insert(
     )
 )
 
-from scred.dtypes import Record, RecordSet, DataDictionary
+from scred.dtypes import Record, RecordSet, LazyRecordSet, DataDictionary, key_fields
 from . import testdata
 
 def _setup_stored_datadict_and_record():
@@ -122,3 +122,227 @@ def test_RecordSet_as_dataframe_returns_DataFrame_with_MultiIndex():
     # assert outer level is ID
     # assert inner level is field_name
     # assert specific record-field responses are as expected
+
+
+# ===================================================
+# Testing class dtypes.LazyRecordSet
+
+def _setup_fake_project(n_records=30):
+    metadata = testdata.get_fake_project_metadata()
+    records = testdata.get_fake_project_records(metadata, n_records=n_records)
+    return (DataDictionary(metadata), records)
+
+
+def test_LazyRecordSet_builds_records_only_on_access():
+    _, records = _setup_fake_project()
+    lazy = LazyRecordSet(records, primary_key="record_id", cache_size=4)
+    assert len(lazy) == 30
+    assert "7" in lazy and "999" not in lazy
+    assert list(lazy) == [ r["record_id"] for r in records ]
+    assert lazy.cached == []
+    assert isinstance(lazy["7"], Record)
+    assert lazy.cached == ["7"]
+
+
+def test_LazyRecordSet_cache_is_bounded_and_keeps_edits():
+    _, records = _setup_fake_project()
+    lazy = LazyRecordSet(records, primary_key="record_id", cache_size=4)
+    lazy["1"].loc["form1_gate", "response"] = "edited"
+    for record in lazy.values():
+        assert len(lazy.cached) <= 4
+    assert "1" not in lazy.cached
+    assert lazy["1"].loc["form1_gate", "response"] == "edited"
+
+
+def test_LazyRecordSet_fill_missing_matches_RecordSet():
+    datadict, records = _setup_fake_project()
+    eager = RecordSet(records, primary_key="record_id")
+    eager.fill_missing(datadict)
+    lazy = LazyRecordSet(records, primary_key="record_id", cache_size=2)
+    lazy["3"] # one record already cached when filling
+    lazy.fill_missing(datadict)
+    assert len(lazy.cached) <= 2
+    for key, record in eager.items():
+        assert lazy[key].nafilled and lazy[key].bdfilled
+        assert list(lazy[key]["response"]) == list(record["response"])
+
+
+def test_Record_and_RecordSet_fill_missing_agree():
+    datadict, records = _setup_fake_project(n_records=10)
+    recordset = RecordSet(records, primary_key="record_id")
+    recordset.fill_missing(datadict)
+    for row in records:
+        record = Record(primary_key="record_id", data=row)
+        record.fill_missing(datadict)
+        filled = recordset[record.id]
+        assert list(filled["response"]) == list(record["response"])
+        assert list(filled["branching_logic"]) == list(record["branching_logic"])
+
+
+def test_Record_and_RecordSet_agree_on_logic_pythonic_conversion_mangles():
+    logic = ["[a] = ''", "[a] <> ''", "[a] != '1' and [a] <> ''", "[a] = 'not sure'"]
+    metadata = [testdata.make_field("record_id", "f", "text"), testdata.make_field("a", "f", "text")]
+    metadata += [
+        testdata.make_field(f"q{i}", "f", "text", branching_logic=text)
+        for i, text in enumerate(logic)
+    ]
+    row = {"record_id": "1", "a": "", "q0": "", "q1": "", "q2": "", "q3": ""}
+    datadict = DataDictionary(metadata)
+    recordset = RecordSet([row], primary_key="record_id")
+    recordset.fill_missing(datadict)
+    record = Record(primary_key="record_id", data=row)
+    record.fill_missing(datadict)
+    expected = [Record.BADCODE, Record.NACODE, Record.NACODE, Record.NACODE]
+    questions = [ f"q{i}" for i in range(len(logic)) ]
+    assert list(recordset["1"].loc[questions, "response"]) == expected
+    assert list(record.loc[questions, "response"]) == expected
+
+
+def _setup_longitudinal():
+    datadict = DataDictionary([
+        testdata.make_field("record_id", "enrollment", "text"),
+        testdata.make_field("consent", "enrollment", "yesno"),
+        testdata.make_field(
+            "score", "visit", "text", branching_logic="[baseline_arm_1][consent] = '1'",
+        ),
+    ])
+    rows = [
+        {"record_id": "1", "redcap_event_name": "baseline_arm_1", "consent": "1", "score": ""},
+        {"record_id": "1", "redcap_event_name": "followup_arm_1", "consent": "", "score": ""},
+        {"record_id": "2", "redcap_event_name": "baseline_arm_1", "consent": "0", "score": ""},
+        {"record_id": "2", "redcap_event_name": "followup_arm_1", "consent": "", "score": ""},
+    ]
+    return datadict, rows
+
+
+@pytest.mark.parametrize("recordset_class", [RecordSet, LazyRecordSet])
+def test_RecordSet_keeps_every_event_row(recordset_class):
+    datadict, rows = _setup_longitudinal()
+    recordset = recordset_class(rows, primary_key="record_id")
+    assert list(recordset) == [
+        ("1", "baseline_arm_1", "", ""), ("1", "followup_arm_1", "", ""),
+        ("2", "baseline_arm_1", "", ""), ("2", "followup_arm_1", "", ""),
+    ]
+    assert list(recordset.as_wide_dataframe().index) == ["1", "1", "2", "2"]
+    recordset.fill_missing(datadict)
+    followup = recordset[("1", "followup_arm_1", "", "")]
+    assert followup.loc["score", "response"] == Record.BADCODE
+    assert recordset[("2", "followup_arm_1", "", "")].loc["score", "response"] == Record.NACODE
+
+
+def test_RecordSet_changes_are_keyed_by_event_row():
+    _, rows = _setup_longitudinal()
+    recordset = RecordSet(rows, primary_key="record_id")
+    recordset[("1", "followup_arm_1", "", "")].loc["score", "response"] = "7"
+    assert recordset.changes() == {("1", "followup_arm_1", "", ""): {"score": "7"}}
+    assert key_fields(("1", "followup_arm_1", "", ""), "record_id") == {
+        "record_id": "1", "redcap_event_name": "followup_arm_1",
+    }
+
+
+def test_RecordSet_warns_on_duplicate_rows():
+    rows = [ {"record_id": "1", "a": "x"}, {"record_id": "1", "a": "y"} ]
+    with pytest.warns(UserWarning, match="More than one row"):
+        recordset = RecordSet(rows, primary_key="record_id")
+    assert recordset["1"].loc["a", "response"] == "y"
+
+
+def test_Record_fill_missing_warns_on_logic_from_other_events():
+    datadict, rows = _setup_longitudinal()
+    record = Record(primary_key="record_id", data=rows[1])
+    with pytest.warns(UserWarning, match="score refers to other events"):
+        record.fill_missing(datadict)
+
+
+def test_fill_missing_understands_redcap_functions():
+    metadata = [
+        testdata.make_field("record_id", "f", "text"),
+        testdata.make_field("dob", "f", "text"),
+        testdata.make_field("visit_date", "f", "text"),
+        testdata.make_field(
+            "adult_consent", "f", "yesno",
+            branching_logic="datediff([dob], [visit_date], 'y') >= 18",
+        ),
+        testdata.make_field(
+            "pain_where", "f", "text",
+            branching_logic="contains([pain_other], 'pain')",
+        ),
+        testdata.make_field("pain_other", "f", "text"),
+    ]
+    records = [
+        {"record_id": "1", "dob": "1990-01-01", "visit_date": "2020-01-01",
+         "adult_consent": "", "pain_where": "", "pain_other": "Back pain"},
+        {"record_id": "2", "dob": "2010-01-01", "visit_date": "2020-01-01",
+         "adult_consent": "", "pain_where": "", "pain_other": "none"},
+    ]
+    recordset = RecordSet(records, primary_key="record_id")
+    recordset.fill_missing(DataDictionary(metadata))
+    assert recordset["1"].loc["adult_consent", "response"] == Record.BADCODE
+    assert recordset["1"].loc["pain_where", "response"] == Record.BADCODE
+    assert recordset["2"].loc["adult_consent", "response"] == Record.NACODE
+    assert recordset["2"].loc["pain_where", "response"] == Record.NACODE
+
+
+def test_RecordSet_audit_calculations_finds_stale_values():
+    metadata = [
+        testdata.make_field("record_id", "f", "text"),
+        testdata.make_field("weight_kg", "f", "text"),
+        testdata.make_field("height_cm", "f", "text"),
+        testdata.make_field(
+            "bmi", "f", "calc",
+            select_choices_or_calculations="round([weight_kg] / ([height_cm] / 100)^2, 1)",
+        ),
+        testdata.make_field(
+            "phq_total", "f", "calc",
+            select_choices_or_calculations="sum([phq_1], [phq_2])",
+        ),
+        testdata.make_field("phq_1", "f", "radio"),
+        testdata.make_field("phq_2", "f", "radio"),
+    ]
+    records = [
+        {"record_id": "1", "weight_kg": "70", "height_cm": "175", "bmi": "22.9",
+         "phq_total": "3", "phq_1": "1", "phq_2": "2"},
+        {"record_id": "2", "weight_kg": "80", "height_cm": "175", "bmi": "22.9",
+         "phq_total": "1", "phq_1": "1", "phq_2": ""},
+        {"record_id": "3", "weight_kg": "", "height_cm": "160", "bmi": "",
+         "phq_total": "", "phq_1": "", "phq_2": ""},
+    ]
+    datadict = DataDictionary(metadata)
+    assert list(datadict.calculations.index) == ["bmi", "phq_total"]
+    for recordset in (RecordSet(records, "record_id"), LazyRecordSet(records, "record_id")):
+        audit = recordset.audit_calculations(datadict)
+        assert list(audit["record"]) == ["2"]
+        assert list(audit["field_name"]) == ["bmi"]
+        assert list(audit["stored"]) == [22.9]
+        assert list(audit["computed"]) == [26.1]
+
+
+def test_RecordSet_summary_matches_counting_each_record():
+    datadict, records = _setup_fake_project()
+    records[0]["form2_complete"] = "0"
+    records[1]["form2_complete"] = ""
+    recordset = RecordSet(records, primary_key="record_id")
+    recordset.fill_missing(datadict)
+    summary = recordset.summary(datadict)
+    for field in ["form1_q1", "form1_q2", "form3_q8", "form2_q3___2"]:
+        responses = [ r.loc[field, "response"] for r in recordset.values() ]
+        assert summary.fields.loc[field, "n_na"] == responses.count(Record.NACODE)
+        assert summary.fields.loc[field, "n_bad"] == responses.count(Record.BADCODE)
+        assert summary.fields.loc[field, "na_rate"] == responses.count(Record.NACODE) / 30
+    assert "record_id" not in summary.fields.index
+    assert summary.fields["form"].loc["form1_q1"] == "form1"
+    assert (summary.forms["n_na"] == summary.fields.groupby("form")["n_na"].sum()).all()
+    assert summary.records["n_na"].sum() == summary.fields["n_na"].sum()
+    assert summary.records.loc["1"].filter(like="_rate").sum() == pytest.approx(1.0)
+    assert summary.completion.loc["form2", ["incomplete", "complete", "blank"]].tolist() == [1, 28, 1]
+
+
+def test_summary_recognizes_codes_read_back_as_text():
+    datadict, records = _setup_fake_project()
+    lazy = LazyRecordSet(records, primary_key="record_id")
+    lazy.fill_missing(datadict)
+    as_text = lazy.as_wide_dataframe().astype(str) # e.g. after a round trip through CSV
+    from scred.dtypes import summarize_missing
+    assert summarize_missing(as_text, datadict).fields.equals(lazy.summary(datadict).fields)
+    unfilled = LazyRecordSet(records, primary_key="record_id").summary(datadict)
+    assert unfilled.fields["n_na"].sum() == 0 and unfilled.fields["n_blank"].sum() > 0
@@ -0,0 +1,52 @@
+# Testing scred/batching.py
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred.batching import AdaptiveBatcher
+
+# ---------------------------------------------------
+
+def test_initial_batch_size_shrinks_with_project_width():
+    narrow = AdaptiveBatcher(n_fields=50)
+    wide = AdaptiveBatcher(n_fields=1500)
+    assert narrow.size > wide.size
+
+def test_initial_batch_size_respects_limits():
+    assert AdaptiveBatcher(n_fields=1, max_size=500).size == 500
+    assert AdaptiveBatcher(n_fields=10**7, min_size=5).size == 5
+
+def test_batcher_grows_when_responses_are_fast():
+    batcher = AdaptiveBatcher(n_fields=100, initial_size=100, target_seconds=5)
+    batcher.observe(100, seconds=1.0, nbytes=1000)
+    assert batcher.size == 200
+
+def test_batcher_shrinks_when_responses_are_slow_or_large():
+    batcher = AdaptiveBatcher(n_fields=100, initial_size=100, target_seconds=5)
+    batcher.observe(100, seconds=8.0, nbytes=1000)
+    assert batcher.size < 100
+    batcher = AdaptiveBatcher(n_fields=100, initial_size=100, max_bytes=1000)
+    batcher.observe(100, seconds=0.1, nbytes=1600)
+    assert batcher.size < 100
+
+def test_batcher_halves_on_failure_until_minimum():
+    batcher = AdaptiveBatcher(n_fields=100, initial_size=40, min_size=10)
+    assert batcher.failed(40)
+    assert batcher.size == 20
+    assert batcher.failed(20)
+    assert batcher.size == 10
+    assert not batcher.failed(10)
+
+def test_fixed_batcher_never_changes():
+    batcher = AdaptiveBatcher.fixed(25)
+    batcher.observe(25, seconds=0.01, nbytes=10)
+    batcher.failed(25)
+    assert batcher.size == 25
@@ -0,0 +1,121 @@
+# Testing scred/cache.py
+
+import os
+import sys
+import time
+
+import pytest
+import requests
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred.cache import ResponseCache
+from . import testdata
+
+# ---------------------------------------------------
+
+URL = "https://redcap.example.org/api/"
+
+def _response(body: bytes):
+    r = requests.Response()
+    r.status_code = 200
+    r._content = body
+    r.headers["Content-Type"] = "application/json"
+    return r
+
+def _payload(content="record", **kwargs):
+    return {"token": "SECRET", "format": "json", "content": content, **kwargs}
+
+def test_key_ignores_order_and_hides_token():
+    a = ResponseCache.key(URL, {"token": "SECRET", "content": "record", "fields": "a,b"})
+    b = ResponseCache.key(URL, {"fields": "a,b", "content": "record", "token": "SECRET"})
+    assert a == b
+    assert a != ResponseCache.key(URL, {"token": "OTHER", "content": "record", "fields": "a,b"})
+    assert "SECRET" not in a
+
+def test_only_read_only_requests_are_cached():
+    cache = ResponseCache()
+    assert cache.ttl(_payload("metadata")) == 3600
+    assert cache.ttl(_payload("record", action="import", data="[]")) is None
+    assert cache.ttl(_payload("file", action="export")) is None
+    failed = _response(b"error")
+    failed.status_code = 500
+    assert not cache.put("k", _payload(), failed)
+
+def test_hits_return_copies_of_the_response():
+    cache = ResponseCache()
+    payload = _payload(fields="a")
+    key = cache.key(URL, payload)
+    assert cache.get(key) is None
+    assert cache.put(key, payload, _response(b'[{"a": "1"}]'))
+    first, second = cache.get(key), cache.get(key)
+    assert first.json() == [{"a": "1"}]
+    assert first is not second
+    assert cache.stats["hits"] == 2 and cache.stats["misses"] == 1
+
+def test_entries_expire_after_their_ttl():
+    cache = ResponseCache(ttls={"record": 0.05})
+    payload = _payload()
+    cache.put("k", payload, _response(b"[]"))
+    assert cache.get("k") is not None
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.stats["entries"] == 0
+
+def test_least_recently_used_evicted_by_bytes():
+    cache = ResponseCache(max_bytes=250)
+    for key in "abc":
+        cache.put(key, _payload(), _response(b"x" * 100))
+    assert cache.get("a") is None # evicted when "c" arrived
+    cache.put("a", _payload(), _response(b"x" * 100))
+    assert cache.get("b") is None # "c" was used more recently than "b"...
+    assert cache.get("c") is not None # ...so it stays
+    stats = cache.stats
+    assert stats["bytes"] <= 250
+    assert stats["evictions"] == 2
+
+def test_disk_tier_outlives_memory(tmp_path):
+    cache = ResponseCache(max_bytes=150, directory=str(tmp_path))
+    cache.put("a", _payload(), _response(b"a" * 100))
+    cache.put("b", _payload(), _response(b"b" * 100))
+    assert cache.get("a").content == b"a" * 100
+    assert cache.stats["disk_hits"] == 1
+    fresh = ResponseCache(directory=str(tmp_path)) # e.g. the next run of a script
+    assert fresh.get("b").content == b"b" * 100
+    assert not any( "SECRET" in p.read_text() for p in tmp_path.iterdir() )
+    fresh.clear()
+    assert list(tmp_path.iterdir()) == []
+
+def test_single_flight_shares_result_and_errors():
+    import threading
+    from scred.cache import SingleFlight
+    flight = SingleFlight()
+    release = threading.Event()
+    ran = []
+    def slow(value):
+        ran.append(value)
+        release.wait()
+        if value == "bad":
+            raise ValueError(value)
+        return [value]
+    results, errors = [], []
+    def call(value):
+        try:
+            results.append(flight.do(value, lambda: slow(value), share=list))
+        except ValueError as ex:
+            errors.append(ex)
+    threads = [ threading.Thread(target=call, args=(v,)) for v in ["ok"] * 4 + ["bad"] * 3 ]
+    for t in threads:
+        t.start()
+    while flight.stats["shared"] < 5:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert sorted(ran) == ["bad", "ok"]
+    assert results == [["ok"]] * 4
+    assert len(errors) == 3
@@ -0,0 +1,88 @@
+# Testing scred/cli.py
+
+import os
+import json
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import cli
+from scred.dtypes import Record
+from . import testdata
+
+# ---------------------------------------------------
+
+def _run(server, *args):
+    return cli.main(["--url", server.url, "--token", "faketoken", *args])
+
+@pytest.mark.parametrize("filename", ["out.json", "out.jsonl", "out.csv", "out.parquet"])
+@pytest.mark.parametrize("stream", [False, True])
+def test_records_export_round_trips_every_format(redcap_server, tmp_path, filename, stream):
+    if filename.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    output = str(tmp_path / filename)
+    args = ["records", "-o", output, "--batch-size", "7", "--workers", "3"]
+    _run(redcap_server, *args, *(["--stream"] if stream else []))
+    frame = cli.read_frame(output, cli.output_format(output)).astype(str)
+    expected = pd.DataFrame(redcap_server.records)
+    assert list(frame["record_id"]) == list(expected["record_id"])
+    assert frame[expected.columns].equals(expected)
+    assert redcap_server.calls["record"] == 1 + 8 # IDs, then 50 records in batches of 7
+
+def test_records_export_fields_with_fill_missing(redcap_server, tmp_path, capsys):
+    output = str(tmp_path / "out.csv")
+    _run(
+        redcap_server, "records", "-o", output, "--fields", "form2_q2",
+        "--fill-missing", "--progress",
+    )
+    frame = pd.read_csv(output, dtype=str, keep_default_na=False)
+    assert list(frame.columns) == ["record_id", "form2_gate", "form2_q1", "form2_q2"]
+    gate_closed = frame["form2_gate"] != "1"
+    assert (frame.loc[gate_closed, "form2_q2"] == str(Record.NACODE)).all()
+    assert "50 records in" in capsys.readouterr().err
+
+def test_records_incremental_merges_changes(redcap_server, tmp_path):
+    output = str(tmp_path / "out.json")
+    _run(redcap_server, "records", "-o", output, "--incremental")
+    assert os.path.exists(output + ".scred-state.json")
+    redcap_server.records[4]["form1_q2"] = "edited"
+    _run(redcap_server, "records", "-o", output, "--incremental")
+    assert "dateRangeBegin" in redcap_server.payloads[-1]
+    frame = cli.read_frame(output, "json")
+    assert len(frame) == 50
+    assert frame.set_index("record_id").loc["5", "form1_q2"] == "edited"
+
+def test_metadata_and_text_exports(redcap_server, tmp_path):
+    _run(redcap_server, "metadata", "-o", str(tmp_path / "dd.csv"))
+    datadict = pd.read_csv(tmp_path / "dd.csv", dtype=str, keep_default_na=False)
+    assert list(datadict["field_name"]) == [ f["field_name"] for f in redcap_server.metadata ]
+    _run(redcap_server, "text", "-o", str(tmp_path / "text.jsonl"))
+    text = cli.read_frame(str(tmp_path / "text.jsonl"), "jsonl")
+    assert list(text.columns) == ["Field", "Participant ID", "Value Reported", "Action Needed"]
+    assert set(text["Field"]) <= { f["field_name"] for f in redcap_server.metadata }
+    assert len(text) > 0
+
+def test_cli_rejects_bad_arguments(tmp_path, monkeypatch):
+    monkeypatch.delenv("REDCAP_URL", raising=False)
+    monkeypatch.delenv("REDCAP_TOKEN", raising=False)
+    with pytest.raises(SystemExit):
+        cli.main(["records", "-o", str(tmp_path / "out.csv")])
+    with pytest.raises(ValueError):
+        cli.output_format("out.xlsx")
+
+def test_text_export_new_only(redcap_server, tmp_path):
+    index = str(tmp_path / "reviewed.json")
+    _run(redcap_server, "text", "-o", str(tmp_path / "first.csv"), "--new-only", index)
+    _run(redcap_server, "text", "-o", str(tmp_path / "second.csv"), "--new-only", index)
+    first = pd.read_csv(tmp_path / "first.csv", dtype=str)
+    second = pd.read_csv(tmp_path / "second.csv", dtype=str)
+    assert len(first) > 0
+    assert len(second) == 0
+    assert "dateRangeBegin" in redcap_server.payloads[-1]
@@ -0,0 +1,113 @@
+# Testing scred/fingerprint.py
+
+import os
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import dtypes
+from scred.dtypes import DataDictionary, RecordSet, LazyRecordSet
+from scred.fingerprint import RecordHashes
+from . import testdata
+
+# ---------------------------------------------------
+
+@pytest.fixture
+def project():
+    metadata = testdata.get_fake_project_metadata()
+    records = testdata.get_fake_project_records(metadata, n_records=30)
+    return DataDictionary(metadata), records
+
+@pytest.fixture
+def filled_rows(monkeypatch):
+    """
+    Counts how many rows fill_missing_frame actually fills.
+    """
+    counted = []
+    original = dtypes.fill_missing_frame
+    def counting(frame, datadict):
+        counted.append(len(frame))
+        return original(frame, datadict)
+    monkeypatch.setattr(dtypes, "fill_missing_frame", counting)
+    return counted
+
+def _wide(records):
+    return pd.DataFrame(records).set_index("record_id", drop=False)
+
+def test_hashes_depend_on_values_and_datadict_not_column_order(project):
+    datadict, records = project
+    frame = _wide(records)
+    hashes = RecordHashes.hash_rows(frame, datadict)
+    assert len(set(hashes)) == len(records)
+    assert RecordHashes.hash_rows(frame[frame.columns[::-1]], datadict) == hashes
+    edited = datadict.copy()
+    edited.loc["form1_q2", "branching_logic"] = "[form1_gate] = '0'"
+    assert RecordHashes.hash_rows(frame, edited) != hashes
+
+def test_second_run_only_fills_changed_records(project, filled_rows, tmp_path):
+    datadict, records = project
+    path = str(tmp_path / "hashes.json")
+    expected = dtypes.fill_missing_frame(_wide(records), datadict)
+    filled_rows.clear()
+
+    first = RecordHashes(path).fill_missing(_wide(records), datadict)
+    assert first.equals(expected)
+    assert filled_rows == [30]
+
+    records[7]["form1_q2"] = "edited"
+    hashes = RecordHashes(path) # a later run, starting from the saved file
+    second = hashes.fill_missing(_wide(records), datadict)
+    assert filled_rows == [30, 1]
+    assert hashes.changed == ["8"]
+    assert hashes.stats == {"unchanged": 29, "changed": 1, "new": 0}
+    assert second.equals(dtypes.fill_missing_frame(_wide(records), datadict))
+
+def test_record_sets_fill_with_hashes(project, filled_rows):
+    datadict, records = project
+    hashes = RecordHashes()
+    eager = RecordSet(records, primary_key="record_id")
+    eager.fill_missing(datadict, hashes=hashes)
+    lazy = LazyRecordSet(records + [dict(records[0], record_id="31")], primary_key="record_id")
+    lazy.fill_missing(datadict, hashes=hashes)
+    assert hashes.changed == ["31"]
+    assert filled_rows == [30, 1]
+    plain = RecordSet(records, primary_key="record_id")
+    plain.fill_missing(datadict)
+    for key, record in plain.items():
+        assert list(lazy[key]["response"]) == list(record["response"])
+        assert list(eager[key]["response"]) == list(record["response"])
+
+def test_changed_event_refills_the_records_other_events(filled_rows):
+    datadict = DataDictionary([
+        testdata.make_field("record_id", "enrollment", "text"),
+        testdata.make_field("consent", "enrollment", "yesno"),
+        testdata.make_field(
+            "score", "visit", "text", branching_logic="[baseline_arm_1][consent] = '1'",
+        ),
+    ])
+    rows = [
+        {"record_id": "1", "redcap_event_name": "baseline_arm_1", "consent": "1", "score": ""},
+        {"record_id": "1", "redcap_event_name": "followup_arm_1", "consent": "", "score": ""},
+        {"record_id": "2", "redcap_event_name": "baseline_arm_1", "consent": "1", "score": ""},
+        {"record_id": "2", "redcap_event_name": "followup_arm_1", "consent": "", "score": ""},
+    ]
+    hashes = RecordHashes()
+    first = hashes.fill_missing(_wide(rows), datadict)
+    assert list(first["score"]) == [dtypes.Record.BADCODE] * 4
+
+    rows[0]["consent"] = "0"
+    second = hashes.fill_missing(_wide(rows), datadict)
+    assert hashes.changed == ["1"]
+    assert hashes.stats == {"unchanged": 1, "changed": 1, "new": 0}
+    assert filled_rows == [4, 2] # both of record 1's rows, none of record 2's
+    assert list(second["score"]) == [
+        dtypes.Record.NACODE, dtypes.Record.NACODE, dtypes.Record.BADCODE, dtypes.Record.BADCODE,
+    ]
+    assert second.equals(dtypes.fill_missing_frame(_wide(rows), datadict))
@@ -0,0 +1,54 @@
+# Testing that importing scred stays cheap (heavy dependencies load on first use)
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# ---------------------------------------------------
+
+def _importtime(statement):
+    """
+    Run `statement` in a fresh interpreter with `-X importtime`. Returns
+    {module: cumulative microseconds} for everything it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    imported = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [ part.strip() for part in line[len("import time:"):].split("|") ]
+        imported[name] = int(cumulative)
+    return imported
+
+@pytest.mark.parametrize("statement, not_imported", [
+    ("import scred", ["requests", "pandas", "numpy", "pyparsing"]),
+    ("from scred import RedcapProject", ["pandas", "numpy", "pyparsing"]),
+    ("from scred import RedcapRequester", ["pandas", "numpy", "pyparsing"]),
+    ("from scred import rclogic", ["pyparsing"]),
+])
+def test_import_does_not_load_heavy_dependencies(statement, not_imported):
+    imported = _importtime(statement)
+    assert "scred" in imported
+    assert [ name for name in not_imported if name in imported ] == []
+
+def test_heavy_dependencies_load_on_first_use():
+    imported = _importtime(
+        "import scred; scred.DataDictionary; from scred import rclogic; rclogic.parse('[a] = 1')"
+    )
+    assert {"pandas", "pyparsing"} <= set(imported)
+
+def test_lazy_names_are_the_real_objects():
+    import scred
+    from scred import dtypes, project
+    assert scred.RecordSet is dtypes.RecordSet
+    assert scred.RedcapProject is project.RedcapProject
+    assert set(scred.__all__) <= set(dir(scred))
+    with pytest.raises(AttributeError):
+        scred.NotAThing
@@ -0,0 +1,51 @@
+# Testing scred/multi.py
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import ProjectGroup
+from scred.dtypes import DataDictionary
+
+# ---------------------------------------------------
+
+def test_ProjectGroup_shares_session_per_host(redcap_server):
+    group = ProjectGroup(
+        {"a": "TOKENA", "b": "TOKENB", "c": ("https://other.example.org/api/", "TOKENC")},
+        url=redcap_server.url,
+        rate_limit=600,
+    )
+    a, b, c = (group[name].requester for name in "abc")
+    assert a.session is b.session
+    assert a.rate_limiter is b.rate_limiter
+    assert a.session is not c.session
+    assert a.rate_limiter is not c.rate_limiter
+
+def test_ProjectGroup_fetches_all_projects(redcap_server):
+    tokens = { f"project{n}": f"TOKEN{n}" for n in range(5) }
+    group = ProjectGroup(tokens, url=redcap_server.url, max_workers=3)
+    metadata = group.get_metadata()
+    records = group.get_records(fields=["record_id"])
+    assert metadata.ok and records.ok
+    assert set(metadata) == set(tokens)
+    assert all(isinstance(dd, DataDictionary) for dd in metadata.values())
+    assert all(len(recs) == 50 for recs in records.values())
+    tokens_seen = { p["token"] for p in redcap_server.payloads }
+    assert tokens_seen == set(tokens.values())
+
+def test_ProjectGroup_keeps_going_after_partial_failure(redcap_server):
+    group = ProjectGroup(
+        {"good": "TOKENA", "bad": ("http://127.0.0.1:9/api/", "TOKENB")},
+        url=redcap_server.url,
+    )
+    records = group.get_records(fields=["record_id"])
+    assert list(records) == ["good"]
+    assert list(records.errors) == ["bad"]
+    assert not records.ok
@@ -0,0 +1,103 @@
+# Testing scred/pipeline.py
+
+import json
+import os
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import RedcapProject, dtypes, sinks
+from scred.pipeline import Pipeline
+from . import testdata
+
+# ---------------------------------------------------
+
+def _expected(server):
+    datadict = dtypes.DataDictionary(server.metadata)
+    frame = pd.DataFrame(server.records)
+    frame.index = frame["record_id"].values
+    return dtypes.convert_types(dtypes.fill_missing_frame(frame, datadict), datadict)
+
+@pytest.mark.parametrize("filename", ["out.csv", "out.sqlite", "out.parquet"])
+def test_pipeline_matches_processing_everything_at_once(redcap_server, tmp_path, filename):
+    if filename.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / filename)
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    pipeline = Pipeline(rp, sink=path, chunk_size=12)
+    assert pipeline.run() == 50
+    assert [ n for n, _ in pipeline.chunks ] == [12, 12, 12, 12, 2]
+    written = sinks.read_frame(path, sinks.output_format(path))
+    expected = _expected(redcap_server).reset_index(drop=True)
+    if filename.endswith(".csv"):
+        written = written.astype(str)
+        expected = expected.astype(str).replace("nan", "")
+    pd.testing.assert_frame_equal(written, expected, check_dtype=False)
+
+def test_pipeline_counts_records_not_event_rows(redcap_server, tmp_path):
+    redcap_server.records = [
+        dict(row, redcap_event_name=event)
+        for row in redcap_server.records for event in ("baseline_arm_1", "followup_arm_1")
+    ]
+    path = str(tmp_path / "out.jsonl")
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    pipeline = Pipeline(rp, sink=path, chunk_size=12)
+    assert pipeline.run() == 50
+    assert len(sinks.read_frame(path, sinks.output_format(path))) == 100
+
+def test_pipeline_chunks_follow_memory_budget(redcap_server, tmp_path):
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    n_fields = len(redcap_server.metadata)
+    budget = 10 * n_fields * Pipeline.BYTES_PER_VALUE
+    pipeline = Pipeline(rp, sink=str(tmp_path / "out.csv"), memory_budget=budget, trace_memory=False)
+    pipeline.run()
+    assert [ n for n, _ in pipeline.chunks ] == [10] * 5
+
+def test_pipeline_reports_each_stage(redcap_server, tmp_path):
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    pipeline = Pipeline(rp, sink=str(tmp_path / "out.jsonl"), fields=["form2_q2"], chunk_size=25)
+    pipeline.run()
+    report = pipeline.report()
+    assert list(report.index) == ["export", "build", "fill_missing", "convert", "write"]
+    assert (report["chunks"] == 2).all()
+    assert (report["peak_mb"] > 0).all()
+    assert report["share"].sum() == pytest.approx(1.0)
+    written = sinks.read_frame(str(tmp_path / "out.jsonl"), "jsonl")
+    assert list(written.columns) == ["record_id", "form2_gate", "form2_q1", "form2_q2"]
+
+def test_convert_types_uses_data_dictionary():
+    metadata = [
+        testdata.make_field("record_id", "f", "text"),
+        testdata.make_field("age", "f", "text", text_validation_type_or_show_slider_number="integer"),
+        testdata.make_field("site", "f", "radio", select_choices_or_calculations="1, A | 2, B"),
+        testdata.make_field("arm", "f", "radio", select_choices_or_calculations="a, A | b, B"),
+        testdata.make_field("bmi", "f", "calc", select_choices_or_calculations="[w]/[h]"),
+        testdata.make_field("notes", "f", "notes"),
+    ]
+    frame = pd.DataFrame([
+        {"record_id": "1", "age": "30", "site": "2", "arm": "a", "bmi": "22.5", "notes": "", "f_complete": "2"},
+        {"record_id": "2", "age": dtypes.Record.NACODE, "site": "x", "arm": "b", "bmi": "", "notes": dtypes.Record.BADCODE, "f_complete": "0"},
+    ])
+    converted = dtypes.convert_types(frame, dtypes.DataDictionary(metadata))
+    numeric = [ c for c in converted.columns if converted[c].dtype == float ]
+    assert numeric == ["age", "site", "bmi", "f_complete"]
+    assert converted["age"].tolist() == [30.0, -555.0]
+    assert converted["site"].isna().tolist() == [False, True]
+    assert converted["notes"].tolist() == ["", "-444"]
+
+def test_json_writer_skips_empty_frames(tmp_path):
+    path = str(tmp_path / "out.json")
+    with sinks.open_sink(path) as sink:
+        sink.write(pd.DataFrame({"record_id": []}))
+        sink.write(pd.DataFrame({"record_id": ["1"]}))
+        sink.write(pd.DataFrame({"record_id": []}))
+        sink.write(pd.DataFrame({"record_id": ["2"]}))
+    with open(path) as fh:
+        assert json.load(fh) == [{"record_id": "1"}, {"record_id": "2"}]
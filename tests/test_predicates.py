@@ -0,0 +1,79 @@
+# Testing scred/predicates.py
+
+import os
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred.predicates import Field, Where, PushdownError
+
+# ---------------------------------------------------
+
+def _setup_records():
+    return pd.DataFrame({
+        "age": ["17", "18", "45", ""],
+        "site": ["1", "2", "3", "1"],
+        "visit_date": ["2019-12-31", "2020-01-01", "2020-06-30", "2021-01-01"],
+        "notes": ["O'Brien", "none", "n/a", ""],
+    })
+
+def test_comparisons_compile_to_filter_logic():
+    assert (Field("age") >= 18).to_filter_logic() == "[age] >= 18"
+    assert (Field("site") == "2").to_filter_logic() == "[site] = '2'"
+    assert (Field("notes") != "O'Brien").to_filter_logic() == "[notes] <> \"O'Brien\""
+    assert Field("age").isblank().to_filter_logic() == "[age] = ''"
+
+def test_combinations_compile_to_filter_logic():
+    predicate = (Field("age") > 17) & Field("site").isin([1, 2])
+    assert predicate.to_filter_logic() == "([age] > 17 and ([site] = 1 or [site] = 2))"
+    window = Field("visit_date").between("2020-01-01", "2020-12-31")
+    assert window.to_filter_logic() == (
+        "([visit_date] >= '2020-01-01' and [visit_date] <= '2020-12-31')"
+    )
+    assert (~(Field("age") >= 18)).to_filter_logic() == "not([age] >= 18)"
+    assert (~Field("site").isin(["1"])).to_filter_logic() == "[site] <> '1'"
+    assert (~((Field("age") > 1) | (Field("site") == 2))).to_filter_logic() == (
+        "(not([age] > 1) and [site] <> 2)"
+    )
+
+def test_floats_are_written_without_exponent():
+    assert (Field("dose") < 1e-05).to_filter_logic() == "[dose] < 0.00001"
+    assert (Field("dose") == 2.5).to_filter_logic() == "[dose] = 2.5"
+    assert (Field("dose") > 1e20).to_filter_logic() == "[dose] > 100000000000000000000"
+
+@pytest.mark.parametrize("predicate, expected", [
+    (Field("age") >= 18, [False, True, True, False]),
+    (~(Field("age") >= 18), [True, False, False, True]), # blank ages aren't adults either
+    (Field("site").isin([1, 3]), [True, False, True, True]),
+    (Field("visit_date").between("2020-01-01", "2020-12-31"), [False, True, True, False]),
+    (Field("age").isblank() | (Field("age") < 18), [True, False, False, True]),
+    (Field("notes").matches(r"^n"), [False, True, True, False]),
+    (~Field("notes").matches(r"^n"), [True, False, False, True]),
+    ((Field("site") == 1) & Where(lambda df: df["notes"] == "", ["notes"]), [False, False, False, True]),
+])
+def test_predicates_evaluate_locally(predicate, expected):
+    assert list(predicate.evaluate(_setup_records())) == expected
+
+def test_predicate_subclasses_must_name_their_fields():
+    from scred.predicates import Predicate
+    class Incomplete(Predicate):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_split_pushes_down_what_it_can():
+    regex = Field("notes").matches("pain")
+    pushed, local = ((Field("age") >= 18) & regex & (Field("site") == 1)).split()
+    assert pushed.to_filter_logic() == "([age] >= 18 and [site] = 1)"
+    assert local is regex
+    pushed, local = ((Field("age") >= 18) | regex).split()
+    assert pushed is None
+    with pytest.raises(PushdownError):
+        local.to_filter_logic()
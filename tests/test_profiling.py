@@ -0,0 +1,114 @@
+# Testing scred/profiling.py
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import profiling
+from scred.dtypes import DataDictionary, RecordSet
+from . import testdata
+
+# ---------------------------------------------------
+
+@pytest.fixture(autouse=True)
+def fresh_profiler():
+    profiling.reset()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+def _records(n_records=5):
+    metadata = testdata.get_fake_project_metadata()
+    return DataDictionary(metadata), testdata.get_fake_project_records(metadata, n_records)
+
+def test_nothing_is_recorded_unless_enabled():
+    datadict, rows = _records()
+    RecordSet(rows, "record_id")
+    assert profiling.PROFILER.stats == {}
+    assert profiling.report().empty
+
+def test_record_fill_stages_are_profiled():
+    datadict, rows = _records()
+    with profiling.profile():
+        records = RecordSet(rows, "record_id")
+        for record in records.values():
+            record.fill_missing(datadict)
+    stats = profiling.PROFILER.stats
+    assert stats["RecordSet.__init__"]["calls"] == 1
+    for path in ["Record.fill_missing", "Record.add_branching_logic", "Parser.parse_all_logic"]:
+        assert stats[path]["calls"] == 5
+    assert stats["DataDictionary.make_logic_pythonic"]["calls"] == 1 # converted copy is reused
+    # Time includes nested paths
+    assert stats["Record.fill_missing"]["seconds"] >= stats["Parser.parse_all_logic"]["seconds"]
+    assert stats["RecordSet.__init__"]["peak_bytes"] > 0
+    report = profiling.report()
+    assert list(report.columns) == ["calls", "seconds", "mean_ms", "peak_mb", "share"]
+    assert report.index[0] == "Record.fill_missing"
+    assert report["share"].sum() == pytest.approx(1)
+
+def test_outer_peak_includes_nested_calls():
+    profiler = profiling.Profiler()
+    profiler.enable()
+    try:
+        with profiler.span("outer"):
+            with profiler.span("inner"):
+                big = bytearray(5_000_000)
+                del big
+    finally:
+        profiler.disable()
+    stats = profiler.stats
+    assert stats["inner"]["peak_bytes"] >= 5_000_000
+    assert stats["outer"]["peak_bytes"] >= 5_000_000
+
+def test_peak_memory_survives_profiled_calls_inside():
+    profiler = profiling.Profiler()
+    profiler.enable()
+    try:
+        with profiling.PeakMemory() as chunk:
+            with profiling.PeakMemory() as stage:
+                big = bytearray(5_000_000)
+                del big
+                with profiler.span("after"): # resets tracemalloc's peak
+                    pass
+            with profiling.PeakMemory(): # a later stage resets it again
+                pass
+    finally:
+        profiler.disable()
+    assert stage.bytes >= 5_000_000
+    assert chunk.bytes >= 5_000_000
+    assert profiler.stats["after"]["peak_bytes"] < 5_000_000
+
+def test_http_posts_are_profiled_by_content(redcap_server):
+    from scred import RedcapProject
+    project = RedcapProject(token="faketoken", url=redcap_server.url)
+    with profiling.profile(trace_memory=False):
+        project.metadata
+        project.get_records()
+    stats = profiling.PROFILER.stats
+    assert stats["RedcapRequester.post[metadata]"]["calls"] == 1
+    assert stats["RedcapRequester.post[record]"]["calls"] == 1
+    assert stats["RedcapRequester.post[record]"]["peak_bytes"] == 0
+
+def test_export_and_compare_runs(tmp_path):
+    datadict, rows = _records()
+    with profiling.profile(trace_memory=False):
+        RecordSet(rows, "record_id")
+    profiling.export(str(tmp_path / "before.json"), label="before")
+    with profiling.profile(trace_memory=False):
+        RecordSet(rows, "record_id")
+        RecordSet(rows, "record_id")
+    comparison = profiling.compare(str(tmp_path / "before.json"), profiling.PROFILER.stats)
+    row = comparison.loc["RecordSet.__init__"]
+    assert row["calls_before"] == 1
+    assert row["calls_after"] == 2
+    assert "speedup" in comparison.columns
+    with pytest.raises(ValueError):
+        (tmp_path / "other.json").write_text('{"format": 99}')
+        profiling.load(str(tmp_path / "other.json"))
@@ -1,6 +1,7 @@
 # Testing class project.RedcapProject
 
 import os
+import json
 import sys
 
 import pytest
@@ -24,3 +25,283 @@ def test_RedcapProject_init_with_token_and_url():
         token=faketoken,
         url=fakeurl,
     )
+
+def test_RedcapProject_primary_key_is_first_metadata_field(redcap_server):
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    assert rp.primary_key == "record_id"
+
+def test_get_records_batched_matches_single_export(redcap_server):
+    from scred.batching import AdaptiveBatcher
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    batcher = AdaptiveBatcher.fixed(7)
+    batched = rp.get_records_batched(batcher=batcher)
+    assert batched == rp.get_records()
+    # One request for IDs, then ceil(50 / 7) batches
+    assert redcap_server.calls["record"] == 1 + 8 + 1
+
+def test_get_records_batched_backs_off_after_server_errors(redcap_server):
+    from scred.batching import AdaptiveBatcher
+    redcap_server.fail_above = 10
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    batcher = AdaptiveBatcher(n_fields=10, initial_size=40, min_size=5)
+    batched = rp.get_records_batched(batcher=batcher)
+    assert len(batched) == 50
+    failures = [ n for n, _, _, ok in batcher.history if not ok ]
+    assert failures[:2] == [40, 20]
+
+def test_get_records_batched_raises_client_errors_at_once(redcap_server):
+    import requests
+    from scred.batching import AdaptiveBatcher
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    rp.metadata
+    redcap_server.reject_token = True
+    batcher = AdaptiveBatcher(n_fields=10, initial_size=40, min_size=5)
+    with pytest.raises(requests.HTTPError) as err:
+        rp.get_records_batched(records=[ str(i) for i in range(1, 51) ], batcher=batcher)
+    assert err.value.response.status_code == 403
+    assert redcap_server.calls["record"] == 1
+    assert batcher.size == 40
+
+def test_import_records_sends_only_changed_values(redcap_server):
+    from scred.dtypes import RecordSet
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    records = RecordSet(rp.get_records(), primary_key="record_id")
+    assert records.changes() == {}
+    records["3"].loc["form1_gate", "response"] = "edited"
+    records["9"].loc["form2_gate", "response"] = ""
+    records["9"].loc["form3_gate", "response"] = "2"
+    results = rp.import_records(records, batch_size=1, max_workers=2)
+    assert sorted(r.records[0] for r in results) == ["3", "9"]
+    assert all(r.error is None and r.count == 1 for r in results)
+    sent = [ json.loads(p["data"]) for p in redcap_server.payloads if p.get("action") == "import" ]
+    sent = [ row for batch in sent for row in batch ]
+    assert sorted(sent, key=lambda r: r["record_id"]) == [
+        {"record_id": "3", "form1_gate": "edited"},
+        {"record_id": "9", "form2_gate": "", "form3_gate": "2"},
+    ]
+    stored = { r["record_id"]: r for r in redcap_server.records }
+    assert stored["9"]["form2_gate"] == ""
+    # Nothing left to send once imported
+    assert records.changes() == {}
+    assert rp.import_records(records) == []
+
+def test_import_records_ignores_fill_missing_codes(redcap_server):
+    from scred.dtypes import LazyRecordSet
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    records = LazyRecordSet(rp.get_records(), primary_key="record_id")
+    records.fill_missing(rp.metadata)
+    assert records.changes() == {}
+
+def test_get_records_with_logic_fields_exports_only_what_is_needed(redcap_server):
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    rows = rp.get_records(fields=["form2_q2"], logic_fields=True)
+    assert redcap_server.payloads[-1]["fields"] == "record_id,form2_gate,form2_q1,form2_q2"
+    assert set(rows[0]) == {"record_id", "form2_gate", "form2_q1", "form2_q2"}
+
+def test_get_records_where_pushes_filter_logic_to_server(redcap_server):
+    from scred.predicates import Field
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    predicate = (Field("form1_gate") == 1) & Field("record_id").matches(r"^1")
+    rows = rp.get_records(fields=["form1_gate"], where=predicate)
+    payload = redcap_server.payloads[-1]
+    assert payload["filterLogic"] == "[form1_gate] = 1"
+    assert payload["fields"] == "form1_gate,record_id"
+    expected = [
+        r["record_id"] for r in redcap_server.records
+        if r["form1_gate"] == "1" and r["record_id"].startswith("1")
+    ]
+    assert [ r["record_id"] for r in rows ] == expected
+
+@pytest.fixture
+def file_server():
+    from tests.fakeserver import FakeRedcapServer
+    metadata = [
+        testdata.make_field("record_id", "enrollment", "text"),
+        testdata.make_field("consent_pdf", "enrollment", "file"),
+        testdata.make_field("scan", "enrollment", "file"),
+    ]
+    records = [
+        {"record_id": str(r), "consent_pdf": "[document]", "scan": "[document]" if r % 2 else ""}
+        for r in range(1, 6)
+    ]
+    files = { (str(r), "consent_pdf"): (f"consent {r}.pdf", bytes([r]) * 100_000) for r in range(1, 6) }
+    files.update({ (str(r), "scan"): ("scan.png", b"png" * r) for r in (1, 3, 5) })
+    server = FakeRedcapServer(metadata=metadata, records=records, files=files).start()
+    yield server
+    server.stop()
+
+def test_export_files_downloads_every_file_field(file_server, tmp_path):
+    rp = RedcapProject(token="faketoken", url=file_server.url)
+    results = rp.export_files(tmp_path, max_workers=3, chunk_size=4096)
+    assert len(results) == 8
+    assert { r.status for r in results } == {"downloaded"}
+    for (record, field), (name, data) in file_server.files.items():
+        assert (tmp_path / record / f"{field}_{name}").read_bytes() == data
+    assert not list(tmp_path.glob("**/*.part"))
+
+def test_export_files_resumes_without_downloading_again(file_server, tmp_path):
+    rp = RedcapProject(token="faketoken", url=file_server.url)
+    rp.export_files(tmp_path)
+    (tmp_path / "2" / "consent_pdf_consent 2.pdf").write_bytes(b"truncated")
+    (tmp_path / "4" / "consent_pdf_consent 4.pdf").unlink()
+    file_server.calls.clear()
+    results = rp.export_files(tmp_path)
+    redone = sorted( r.record for r in results if r.status == "downloaded" )
+    assert redone == ["2", "4"]
+    assert file_server.calls["file"] == 2
+    assert (tmp_path / "2" / "consent_pdf_consent 2.pdf").read_bytes() == bytes([2]) * 100_000
+
+def test_export_files_reports_failures(file_server, tmp_path):
+    del file_server.files[("3", "scan")]
+    rp = RedcapProject(token="faketoken", url=file_server.url)
+    results = rp.export_files(tmp_path, fields=["scan"])
+    failed = [ r for r in results if r.status == "failed" ]
+    assert [ (r.record, r.field) for r in failed ] == [("3", "scan")]
+    assert sum(r.status == "downloaded" for r in results) == 2
+
+def test_export_files_keeps_repeat_instances_apart(tmp_path):
+    from tests.fakeserver import FakeRedcapServer
+    metadata = [
+        testdata.make_field("record_id", "enrollment", "text"),
+        testdata.make_field("scan", "imaging", "file"),
+    ]
+    records = [
+        {"record_id": "1", "redcap_repeat_instrument": "imaging", "redcap_repeat_instance": n,
+         "scan": "[document]"}
+        for n in (1, 2)
+    ]
+    files = { ("1", "scan", str(n)): ("scan.png", b"png" * n) for n in (1, 2) }
+    server = FakeRedcapServer(metadata=metadata, records=records, files=files).start()
+    try:
+        rp = RedcapProject(token="faketoken", url=server.url)
+        results = rp.export_files(tmp_path)
+        assert [ (r.repeat_instance, r.status) for r in results ] == [("1", "downloaded"), ("2", "downloaded")]
+        for n in (1, 2):
+            assert (tmp_path / "1" / f"imaging_{n}" / "scan_scan.png").read_bytes() == b"png" * n
+        assert [ r.status for r in rp.export_files(tmp_path) ] == ["skipped", "skipped"]
+    finally:
+        server.stop()
+
+def test_concurrent_metadata_and_version_fetched_once(redcap_server):
+    import threading
+    redcap_server.latency = 0.2
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    start = threading.Barrier(10)
+    results = []
+    def use_project():
+        start.wait()
+        results.append((rp.metadata, rp.version))
+    threads = [ threading.Thread(target=use_project) for _ in range(10) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert redcap_server.calls["metadata"] == 1
+    assert redcap_server.calls["version"] == 1
+    assert all( m is results[0][0] for m, v in results )
+
+def test_get_report_streams_rows_into_record_set(redcap_server):
+    from scred.dtypes import LazyRecordSet, RecordSet
+    rows = [ {k: r[k] for k in ("record_id", "form1_gate", "form1_q2")} for r in redcap_server.records ]
+    rows[3]["form1_q2"] = 'says "hi",\nthen leaves'
+    redcap_server.reports["42"] = rows
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    chunks = list(rp.iter_report(42, chunk_rows=15))
+    assert [ len(c) for c in chunks ] == [15, 15, 15, 5]
+    assert [ row for c in chunks for row in c ] == rows
+    lazy = rp.get_report(42)
+    assert isinstance(lazy, LazyRecordSet)
+    assert lazy.as_wide_dataframe().loc["4", "form1_q2"] == rows[3]["form1_q2"]
+    eager = rp.get_report(42, lazy=False)
+    assert isinstance(eager, RecordSet) and list(eager) == [ r["record_id"] for r in rows ]
+    assert redcap_server.payloads[-1]["format"] == "csv"
+    assert "metadata" not in redcap_server.calls
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_get_report_keeps_every_event_row(redcap_server, lazy):
+    rows = [
+        {"record_id": "1", "redcap_event_name": "baseline_arm_1", "score": "3"},
+        {"record_id": "1", "redcap_event_name": "followup_arm_1", "score": "5"},
+    ]
+    redcap_server.reports["7"] = rows
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    report = rp.get_report(7, lazy=lazy)
+    assert len(report) == 2
+    assert list(report.as_wide_dataframe()["score"]) == ["3", "5"]
+    redcap_server.reports["8"] = [ {k: v for k, v in r.items() if k != "redcap_event_name"} for r in rows ]
+    with pytest.warns(UserWarning, match="More than one row for 1"):
+        rp.get_report(8, lazy=lazy)
+
+@pytest.fixture
+def dag_server(redcap_server):
+    redcap_server.dags = [
+        {"data_access_group_name": "Site A", "unique_group_name": "site_a", "data_access_group_id": "1"},
+        {"data_access_group_name": "Site B", "unique_group_name": "site_b", "data_access_group_id": "2"},
+    ]
+    redcap_server.user_dags = {"alice": "site_a", "bob": "site_b", "carol": "site_a"}
+    redcap_server.record_dags = {
+        str(r): "site_a" if r <= 20 else "site_b" for r in range(1, 46)
+    }
+    return redcap_server
+
+def test_get_dags_lists_groups_and_members(dag_server):
+    rp = RedcapProject(token="faketoken", url=dag_server.url)
+    dags = rp.get_dags()
+    assert list(dags) == ["site_a", "site_b"]
+    assert dags["site_a"].name == "Site A"
+    assert dags["site_a"].members == ["alice", "carol"]
+    assert dags["site_b"].members == ["bob"]
+
+def test_get_records_by_dag_merges_shards(dag_server):
+    rp = RedcapProject(token="faketoken", url=dag_server.url)
+    records = rp.get_records_by_dag(fields=["record_id", "form1_gate"])
+    assert len(records) == 50
+    assert [ len(ids) for ids in records.groups.values() ] == [20, 25, 5]
+    assert records.groups["site_b"][0] == "21"
+    assert records["21"].loc["redcap_data_access_group", "response"] == "site_b"
+    group_of = { key: group for group, ids in records.groups.items() for key in ids }
+    for payload in dag_server.payloads:
+        if payload.get("records"): # each request stays within one group
+            assert len({ group_of[key] for key in payload["records"].split(",") }) == 1
+
+def test_get_records_by_dag_only_wanted_groups(dag_server):
+    rp = RedcapProject(token="faketoken", url=dag_server.url)
+    records = rp.get_records_by_dag(dags=["site_a"])
+    assert sorted(records, key=int) == [ str(r) for r in range(1, 21) ]
+    assert list(records.groups) == ["site_a"]
+
+def test_get_export_fieldnames(redcap_server):
+    rp = RedcapProject(token="faketoken", url=redcap_server.url)
+    names = rp.get_export_fieldnames(["form1_q3"])
+    assert [ n["export_field_name"] for n in names ] == [ f"form1_q3___{c}" for c in "123" ]
+    assert redcap_server.payloads[-1]["field"] == "form1_q3"
+
+def test_warm_up_fetches_everything_once_in_background(redcap_server):
+    from scred import rclogic
+    redcap_server.latency = 0.2
+    rp = RedcapProject(token="faketoken", url=redcap_server.url, warm_up=True)
+    # The properties wait for the prefetch instead of sending their own requests
+    assert rp.version == "8.5.28"
+    assert len(rp.metadata) == 31
+    assert rp.export_fieldnames
+    assert "form1_gate" in rp.pythonic_metadata.loc["form1_q1", "branching_logic"]
+    for future in rp.warm_up():
+        future.result()
+    assert redcap_server.calls["metadata"] == 1
+    assert redcap_server.calls["version"] == 1
+    assert redcap_server.calls["exportFieldNames"] == 1
+    assert rp.pythonic_metadata.blogic_fmt == "python"
+    assert rp.metadata.blogic_fmt == "redcap"
+    assert rp.metadata.loc["form1_q1", "branching_logic"] in rclogic._compiled
+    assert rp.pythonic_metadata.loc["form1_q1", "branching_logic"] in rclogic._compiled
+    # The fill paths get the same converted copy rather than converting again
+    assert rp.metadata.pythonic() is rp.pythonic_metadata
+
+def test_warm_up_requests_overlap(redcap_server):
+    import time
+    redcap_server.latency = 0.3
+    began = time.perf_counter()
+    rp = RedcapProject(token="faketoken", url=redcap_server.url, warm_up=True)
+    for future in rp.warm_up():
+        future.result()
+    assert time.perf_counter() - began < 0.8 # not three requests one after another
@@ -0,0 +1,53 @@
+# Testing scred/ratelimit.py
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred.ratelimit import TokenBucket, shared_bucket
+
+# ---------------------------------------------------
+
+def test_bucket_allows_burst_without_waiting():
+    bucket = TokenBucket(rate=60, burst=3)
+    waits = [ bucket.acquire() for _ in range(3) ]
+    assert waits == [0.0, 0.0, 0.0]
+
+def test_bucket_blocks_once_burst_is_used():
+    bucket = TokenBucket(rate=600, burst=1) # one token per 0.1s
+    bucket.acquire()
+    began = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - began >= 0.08
+    assert bucket.stats["waits"] == 1
+
+def test_bucket_limits_rate_across_threads():
+    bucket = TokenBucket(rate=1200, burst=1) # one token per 0.05s
+    began = time.monotonic()
+    threads = [ threading.Thread(target=bucket.acquire) for _ in range(6) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.monotonic() - began >= 0.2
+    assert bucket.stats["requests"] == 6
+
+def test_bucket_slows_down_when_throttled_and_recovers():
+    bucket = TokenBucket(rate=600)
+    bucket.throttled(retry_after=0)
+    assert bucket.stats["rate_per_minute"] == pytest.approx(300)
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.stats["rate_per_minute"] == pytest.approx(600)
+
+def test_shared_bucket_returns_same_instance_for_key():
+    assert shared_bucket(("test", 1), 60) is shared_bucket(("test", 1), 120)
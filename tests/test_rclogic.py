@@ -0,0 +1,184 @@
+# Testing scred/rclogic.py
+
+import os
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred import rclogic
+
+# ---------------------------------------------------
+
+def _setup_records():
+    # Four participants; values are text, as REDCap exports them
+    return pd.DataFrame({
+        "age": ["17", "18", "45", ""],
+        "consent___1": ["1", "1", "0", "1"],
+        "meds____9": ["0", "1", "0", "0"],
+        "dob": ["2000-01-01", "1990-06-15", "", "1980-02-29"],
+        "visit_date": ["2020-01-01", "2020-01-01", "2020-01-01", "2020-01-01"],
+        "pain_other": ["Back pain", "none", "PAIN", ""],
+        "phq_1": ["1", "2", "", "3"],
+        "phq_2": ["1", "", "", "0"],
+        "bmi": ["25.7", "24.2", "", "30"],
+        "sex": ["1", "2", "1", "2"],
+        "height_cm": ["181", "170", "150", ""],
+        "country": ["2", "1", "2", "3"],
+    }, index=["P1", "P2", "P3", "P4"])
+
+# Real-world style logic strings with the rows (P1-P4) expected to satisfy them
+LOGIC_CASES = [
+    ("[age] >= 18 and [consent(1)] = '1'", [False, True, False, False]),
+    ("age >= 18 and consent___1 == 1", [False, True, False, False]),
+    ("[meds(-9)] = '1'", [False, True, False, False]),
+    ("[country] = '2' or [country] = '3'", [True, False, True, True]),
+    ("[country] <> '2'", [False, True, False, True]),
+    ("[age] <> ''", [True, True, True, False]),
+    ("[age] = ''", [False, False, False, True]),
+    ("[age] > 17 AND [age] < 50", [False, True, True, False]),
+    ("datediff([dob], [visit_date], 'y') >= 18", [True, True, False, True]),
+    ("datediff([dob], [visit_date], \"d\", \"ymd\", true) > 0", [True, True, False, True]),
+    ("datediff([visit_date], [dob], 'y', true) > 0", [False, False, False, False]),
+    ("sum([phq_1], [phq_2]) >= 2", [True, True, False, True]),
+    ("([phq_1] + [phq_2]) * 2 = 4", [True, False, False, False]),
+    ("if([sex] = '1', [height_cm] > 180, [height_cm] > 165)", [True, True, False, False]),
+    ("isblankormissingcode([age])", [False, False, False, True]),
+    ("contains([pain_other], 'pain')", [True, False, True, False]),
+    ("not_contain([pain_other], 'pain')", [False, True, False, True]),
+    ("starts_with([pain_other], 'back')", [True, False, False, False]),
+    ("rounddown([bmi], 0) = 25", [True, False, False, False]),
+    ("roundup([bmi]) = 25", [False, True, False, False]),
+    ("round([bmi], 1) >= 25", [True, False, False, True]),
+    ("mean([phq_1], [phq_2]) = 1.5", [False, False, False, True]),
+    ("max([phq_1], [phq_2]) >= 2", [False, True, False, True]),
+    ("length([pain_other]) > 3", [True, True, True, False]),
+    ("left([pain_other], 4) = 'back'", [False, False, False, False]),
+    ("mid([pain_other], 6, 4) = 'pain'", [True, False, False, False]),
+    ("year([dob]) < 1995", [False, True, False, True]),
+    ("isnumber([bmi]) and not(isinteger([bmi]))", [True, True, False, False]),
+    ("[phq_1]^2 = 4", [False, True, False, False]),
+    ("-[phq_1] < -1", [False, True, False, True]),
+]
+
+@pytest.mark.parametrize("logic, expected", LOGIC_CASES)
+def test_logic_evaluates_over_all_records(logic, expected):
+    records = _setup_records()
+    result = rclogic.compile_logic(logic).test(records)
+    assert list(result.index) == list(records.index)
+    assert list(result) == expected
+
+def test_blank_logic_is_always_met():
+    records = _setup_records()
+    for logic in ["", None, float("nan")]:
+        assert rclogic.compile_logic(logic).test(records).all()
+
+def test_calculation_returns_values():
+    records = _setup_records()
+    bmi = rclogic.compile_logic("round([bmi] * 2, 0)").evaluate(records)
+    assert list(bmi.fillna(-1)) == [51, 48, -1, 60]
+
+def test_expression_lists_fields_it_references():
+    expression = rclogic.compile_logic("[age] >= 18 and sum([phq_1], [consent(1)]) > 0")
+    assert expression.fields == {"age", "phq_1", "consent___1"}
+
+def test_unparseable_logic_raises_LogicError():
+    with pytest.raises(rclogic.LogicError):
+        rclogic.compile_logic("[age] >= and 18")
+    with pytest.raises(rclogic.LogicError):
+        rclogic.compile_logic("notafunction([age])")
+
+def test_missing_field_warns_and_is_blank():
+    records = _setup_records()
+    with pytest.warns(UserWarning):
+        result = rclogic.compile_logic("[not_a_field] = ''").test(records)
+    assert result.all()
+
+def test_shared_subexpressions_are_evaluated_once():
+    records = _setup_records()
+    ctx = rclogic.Context(records)
+    first = rclogic.compile_logic("[age] >= 18 and [consent(1)] = '1'")
+    second = rclogic.compile_logic("[consent(1)] = '1' and [age]>=18")
+    third = rclogic.compile_logic("[age] >= 18")
+    for expression in (first, second, third):
+        expression.test(ctx)
+    # 7 + 7 + 3 nodes requested. The second only adds its own "and" node, reusing
+    # both conditions, and the third is already cached.
+    assert ctx.stats == {"requested": 17, "evaluated": 8}
+    assert ctx.saved == 9
+
+def test_evaluate_logic_shares_work_across_data_dictionary():
+    from scred.backfillna import evaluate_logic
+    from scred.dtypes import DataDictionary, logic_by_column
+    from . import testdata
+    metadata = testdata.get_fake_project_metadata(n_forms=10, fields_per_form=15)
+    records = testdata.get_fake_project_records(metadata, n_records=20)
+    frame = pd.DataFrame(records)
+    logic = logic_by_column(frame.columns, DataDictionary(metadata))
+    ctx = rclogic.Context(frame)
+    met = evaluate_logic(frame, logic, context=ctx)
+    assert met.shape == frame.shape
+    # Each form's questions share the gate condition, so most work is reused
+    assert ctx.saved > ctx.stats["evaluated"]
+
+def _setup_longitudinal():
+    # Three participants over two events; P3 never reached follow-up, P2 has no baseline
+    return pd.DataFrame({
+        "redcap_event_name": ["baseline_arm_1", "followup_arm_1", "baseline_arm_1",
+                              "followup_arm_1", "followup_arm_1"],
+        "consent": ["1", "", "0", "", ""],
+        "mood___2": ["1", "0", "0", "1", "0"],
+        "score": ["", "7", "", "", "3"],
+    }, index=["P1", "P1", "P3", "P2", "P4"])
+
+@pytest.mark.parametrize("logic, expected", [
+    ("[baseline_arm_1][consent] = '1'", [True, True, False, False, False]),
+    ("baseline_arm_1.consent == 1", [True, True, False, False, False]),
+    ("[baseline_arm_1][consent] = ''", [False, False, False, True, True]),
+    ("[followup_arm_1][mood(2)] = '1'", [False, False, False, True, False]),
+    ("[consent] = '1'", [True, False, False, False, False]), # same-row field
+    ("[baseline_arm_1][consent] = '1' and [score] > 5", [False, True, False, False, False]),
+])
+def test_event_qualified_fields_join_each_records_event_row(logic, expected):
+    result = rclogic.compile_logic(logic).test(_setup_longitudinal())
+    assert list(result) == expected
+
+def test_event_qualified_fields_by_record_key_column():
+    frame = _setup_longitudinal()
+    frame = frame.reset_index().rename(columns={"index": "record_id"})
+    ctx = rclogic.Context(frame, record_key="record_id")
+    result = rclogic.compile_logic("[baseline_arm_1][consent] = '1'").test(ctx)
+    assert list(result) == [True, True, False, False, False]
+
+def test_event_qualified_field_outside_longitudinal_data_is_the_field():
+    result = rclogic.compile_logic("[baseline_arm_1][age] >= 18").test(_setup_records())
+    assert list(result) == [False, True, True, False]
+    assert rclogic.compile_logic("[baseline_arm_1][age] >= 18").fields == {"age"}
+
+def test_fill_missing_frame_sees_other_events():
+    from scred.dtypes import DataDictionary, Record, fill_missing_frame
+    from . import testdata
+    datadict = DataDictionary([
+        testdata.make_field("record_id", "enrollment", "text"),
+        testdata.make_field("consent", "enrollment", "yesno"),
+        testdata.make_field(
+            "score", "visit", "text", branching_logic="[baseline_arm_1][consent] = '1'",
+        ),
+    ])
+    frame = _setup_longitudinal()[["redcap_event_name", "consent", "score"]]
+    filled = fill_missing_frame(frame, datadict)
+    assert list(filled["score"]) == [Record.BADCODE, "7", Record.NACODE, Record.NACODE, "3"]
+
+@pytest.mark.parametrize("value, places, expected", [
+    ("0.5", 0, 1.0), ("2.5", 0, 3.0), ("-2.5", 0, -3.0), ("1.25", 1, 1.3), ("2.4", 0, 2.0),
+])
+def test_round_goes_half_away_from_zero(value, places, expected):
+    frame = pd.DataFrame({"x": [value]})
+    result = rclogic.compile_logic(f"round([x], {places})").evaluate(frame)
+    assert result.iloc[0] == pytest.approx(expected)
@@ -5,6 +5,7 @@ import sys
 from pathlib import Path
 
 import pytest
+import pandas as pd
 
 sys.path.insert(
     0, os.path.abspath(
@@ -20,3 +21,122 @@ from .testdata import MockProject
 def test_create_textractor_with_mock_project():
     mock_project = MockProject()
     t = txr.Textractor(mock_project, "subjid")
+
+def test_textractor_requests_only_desired_fields(redcap_server):
+    from scred import RedcapProject
+    project = RedcapProject(token="faketoken", url=redcap_server.url)
+    t = txr.Textractor(project, "record_id")
+    t.bounded = ["record_id"]
+    entries = t.pull_desired()
+    fields = redcap_server.payloads[-1]["fields"].split(",")
+    assert fields == ["record_id"] + t.desired
+    assert all(field in t.desired for field, _, _ in entries)
+
+def test_text_index_tracks_new_and_changed_entries(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = txr.TextIndex(path)
+    first = [("notes", "1", "hello"), ("notes", "2", "hi")]
+    assert index.update(first) == first
+    assert index.update(first) == []
+    assert index.update([("notes", "1", "hello!"), ("notes", "2", "hi")]) == [("notes", "1", "hello!")]
+    index.save()
+    reloaded = txr.TextIndex(path)
+    assert len(reloaded) == 2
+    assert ("notes", "1", "hello!") in reloaded
+    assert "hello" not in open(path).read() # only hashes are kept
+
+def test_text_index_drops_blanked_entries():
+    index = txr.TextIndex()
+    index.update([("notes", "1", "hello")])
+    index.update([], checked=[("notes", "1")])
+    assert index.update([("notes", "1", "hello")]) == [("notes", "1", "hello")]
+
+def test_text_index_keeps_each_event_and_instance_apart():
+    index = txr.TextIndex()
+    entries = [
+        ("notes", "1", "a", "baseline_arm_1", ""), ("notes", "1", "b", "followup_arm_1", ""),
+        ("notes", "1", "c", "followup_arm_1", "2"),
+    ]
+    assert index.update(entries) == entries
+    assert index.update(entries) == []
+    assert len(index) == 3
+    index.update(entries[:2], checked=[("notes", "1", "followup_arm_1", "2")])
+    assert index.update(entries) == entries[2:]
+
+def test_entries_of_longitudinal_exports_carry_their_event():
+    t = txr.Textractor(MockProject(), "record_id")
+    data = [
+        {"record_id": "1", "redcap_event_name": "followup_arm_1", "redcap_repeat_instrument": "",
+         "redcap_repeat_instance": "", "notes": "b"},
+        {"record_id": "1", "redcap_event_name": "baseline_arm_1", "redcap_repeat_instrument": "",
+         "redcap_repeat_instance": "", "notes": "a"},
+    ]
+    assert t._entries(data) == [
+        ("notes", "1", "a", "baseline_arm_1", ""), ("notes", "1", "b", "followup_arm_1", ""),
+    ]
+    sheet = t._review_sheet(t._entries(data))
+    assert list(sheet["Event"]) == ["baseline_arm_1", "followup_arm_1"]
+
+def test_entries_of_exports_with_events_but_no_repeats():
+    from types import SimpleNamespace
+    from scred.dtypes import DataDictionary
+    from . import testdata
+    metadata = DataDictionary([
+        testdata.make_field("record_id", "form1", "text"), testdata.make_field("txt", "form1", "text"),
+    ])
+    t = txr.Textractor(SimpleNamespace(metadata=metadata), "record_id")
+    t.bounded = ["record_id"]
+    data = [ {"record_id": "1", "redcap_event_name": "baseline_arm_1", "txt": "x"} ]
+    assert t._entries(data) == [("txt", "1", "x", "baseline_arm_1", "")]
+    assert t._checked(data) == [("txt", "1", "baseline_arm_1", "")]
+    index = txr.TextIndex()
+    assert index.update(t._entries(data)) == t._entries(data)
+    assert index.update(t._entries(data)) == []
+
+def test_pull_new_only_returns_new_or_changed_text(redcap_server, tmp_path):
+    from scred import RedcapProject
+    project = RedcapProject(token="faketoken", url=redcap_server.url)
+    path = str(tmp_path / "index.json")
+    t = txr.Textractor(project, "record_id", index=txr.TextIndex(path))
+    t.bounded = ["record_id"]
+    first = t.pull_new()
+    assert "dateRangeBegin" not in redcap_server.payloads[-1]
+    assert first and first == t.pull_desired()
+    t.commit()
+
+    field, record, value = first[0]
+    for row in redcap_server.records:
+        if row["record_id"] == record:
+            row[field] = value + " (edited)"
+    t = txr.Textractor(project, "record_id", index=txr.TextIndex(path))
+    t.bounded = ["record_id"]
+    assert t.pull_new(since=False) == [(field, record, value + " (edited)")]
+    t.commit()
+    assert t.pull_new(batcher=True, since=False) == []
+
+    previous = t.index.last_pull
+    t.pull_new()
+    assert redcap_server.payloads[-1]["dateRangeBegin"] == previous
+
+def test_pull_new_to_csv_only_commits_once_written(redcap_server, tmp_path, monkeypatch):
+    from scred import RedcapProject
+    project = RedcapProject(token="faketoken", url=redcap_server.url)
+    path = str(tmp_path / "index.json")
+    t = txr.Textractor(project, "record_id", index=txr.TextIndex(path))
+    t.bounded = ["record_id"]
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(pd.DataFrame, "to_csv", fail)
+    with pytest.raises(OSError):
+        t.pull_new_to_csv(str(tmp_path / "to_review.csv"))
+    assert not os.path.exists(path)
+    assert len(t.index) == 0
+    monkeypatch.undo()
+    t.pull_new_to_csv(str(tmp_path / "to_review.csv"))
+    assert len(pd.read_csv(tmp_path / "to_review.csv")) == len(t.pull_desired())
+    assert len(txr.TextIndex(path)) == len(t.pull_desired())
+
+def test_pull_new_needs_an_index():
+    t = txr.Textractor(MockProject(), "subjid")
+    with pytest.raises(ValueError):
+        t.pull_new()
@@ -0,0 +1,130 @@
+# Testing scred/validation.py
+
+import os
+import sys
+
+import pytest
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')
+    )
+)
+
+from scred.dtypes import DataDictionary, Record, RecordSet
+from scred.validation import Validator, validate
+from . import testdata
+
+# ---------------------------------------------------
+
+@pytest.fixture
+def datadict():
+    return DataDictionary([
+        testdata.make_field("record_id", "form1", "text"),
+        testdata.make_field(
+            "age", "form1", "text", text_validation_type_or_show_slider_number="integer",
+            text_validation_min="18", text_validation_max="100",
+        ),
+        testdata.make_field(
+            "weight", "form1", "text", text_validation_type_or_show_slider_number="number_1dp",
+        ),
+        testdata.make_field(
+            "visit", "form1", "text", text_validation_type_or_show_slider_number="date_mdy",
+            text_validation_min="2020-01-01",
+        ),
+        testdata.make_field(
+            "seen", "form1", "text", text_validation_type_or_show_slider_number="datetime_ymd",
+        ),
+        testdata.make_field(
+            "email", "form1", "text", text_validation_type_or_show_slider_number="email",
+        ),
+        testdata.make_field(
+            "phone", "form1", "text", text_validation_type_or_show_slider_number="phone",
+        ),
+        testdata.make_field("notes", "form1", "notes"),
+    ])
+
+def make_frame(rows):
+    frame = pd.DataFrame(rows)
+    frame.index = frame["record_id"].values
+    return frame
+
+def test_valid_values_and_blanks_pass(datadict):
+    frame = make_frame([
+        {"record_id": "1", "age": "40", "weight": "70.5", "visit": "2021-03-04",
+         "seen": "2021-03-04 10:30", "email": "a@b.org", "phone": "(617) 555-1234", "notes": "x"},
+        {"record_id": "2", "age": "", "weight": str(Record.NACODE), "visit": "",
+         "seen": "", "email": "", "phone": str(Record.BADCODE), "notes": ""},
+    ])
+    violations = validate(frame, datadict)
+    assert violations.empty
+    assert list(violations.columns) == ["record", "field", "value", "validation", "problem"]
+
+def test_violations_are_reported_per_value(datadict):
+    frame = make_frame([
+        {"record_id": "1", "age": "4o", "weight": "heavy", "visit": "2021-02-30",
+         "seen": "2021-03-04", "email": "nobody", "phone": "123", "notes": "anything"},
+        {"record_id": "2", "age": "12", "weight": "70", "visit": "2019-12-31",
+         "seen": "2021-03-04 10:30", "email": "a@b.org", "phone": "617.555.1234", "notes": ""},
+        {"record_id": "3", "age": "101", "weight": "-1.5", "visit": "2020-01-01",
+         "seen": "", "email": "", "phone": "", "notes": ""},
+    ])
+    violations = validate(frame, datadict)
+    found = { (v.record, v.field): v.problem for v in violations.itertuples() }
+    assert found == {
+        ("1", "age"): "format",
+        ("1", "weight"): "format",
+        ("1", "visit"): "format",
+        ("1", "seen"): "format",
+        ("1", "email"): "format",
+        ("1", "phone"): "format",
+        ("2", "age"): "below minimum",
+        ("2", "weight"): "format", # number_1dp needs one decimal place
+        ("2", "visit"): "below minimum",
+        ("3", "age"): "above maximum",
+    }
+    row = violations[violations["field"] == "visit"].iloc[0]
+    assert row["validation"] == "date_mdy"
+    assert row["value"] == "2021-02-30"
+
+@pytest.mark.parametrize("validation, value, valid", [
+    ("number_2dp", "3.10", True),
+    ("number_2dp", "-3.10", True),
+    ("number_2dp", "3.1", False),
+    ("number_2dp", "3.100", False),
+    ("number_2dp", "3", False),
+    ("number_1dp_comma_decimal", "3,1", True),
+    ("number_1dp_comma_decimal", "3.1", False),
+    ("number", "3.1", True),
+    ("number_comma_decimal", "3,14", True),
+])
+def test_number_decimal_places_are_exact(validation, value, valid):
+    datadict = DataDictionary([
+        testdata.make_field("record_id", "form1", "text"),
+        testdata.make_field("x", "form1", "text", text_validation_type_or_show_slider_number=validation),
+    ])
+    violations = validate(make_frame([{"record_id": "1", "x": value}]), datadict)
+    assert violations.empty == valid
+
+def test_repeated_values_are_all_reported(datadict):
+    frame = make_frame([ {"record_id": str(i), "age": "old" if i % 2 else "30"} for i in range(1000) ])
+    violations = Validator(datadict).validate(frame)
+    assert len(violations) == 500
+    assert set(violations["value"]) == {"old"}
+
+def test_unsupported_validation_is_skipped():
+    datadict = DataDictionary([
+        testdata.make_field("record_id", "form1", "text"),
+        testdata.make_field("mrn", "form1", "text", text_validation_type_or_show_slider_number="mrn_10d"),
+    ])
+    validator = Validator(datadict)
+    assert "mrn" not in validator.rules
+    assert validator.unsupported == {"mrn_10d"}
+    assert validator.validate(make_frame([{"record_id": "1", "mrn": "?"}])).empty
+
+def test_recordset_validate(datadict):
+    frame = make_frame([ {"record_id": "1", "age": "17"}, {"record_id": "2", "age": "18"} ])
+    records = RecordSet(frame.to_dict(orient="records"), "record_id")
+    violations = records.validate(datadict)
+    assert list(violations["record"]) == ["1"]
@@ -20,3 +20,94 @@ from . import testdata
 
 def test_create_requester(mock_url, mock_token):
     r = webapi.RedcapRequester(mock_url, mock_token)
+
+def test_requesters_with_same_token_share_rate_limiter():
+    r1 = webapi.RedcapRequester("https://redcap.example.org/api/", "TOKEN1", rate_limit=60)
+    r2 = webapi.RedcapRequester("https://redcap.example.org/api/", "TOKEN1", rate_limit=60)
+    r3 = webapi.RedcapRequester("https://redcap.example.org/api/", "TOKEN2", rate_limit=60)
+    assert r1.rate_limiter is r2.rate_limiter
+    assert r1.rate_limiter is not r3.rate_limiter
+
+def test_requesters_on_same_host_share_rate_limiter():
+    kwargs = dict(rate_limit=60, rate_limit_scope="host")
+    r1 = webapi.RedcapRequester("https://redcap.example.net/api/", "TOKEN1", **kwargs)
+    r2 = webapi.RedcapRequester("https://redcap.example.net/api/", "TOKEN2", **kwargs)
+    assert r1.rate_limiter is r2.rate_limiter
+
+def test_requester_waits_and_retries_when_throttled(redcap_server):
+    from scred.ratelimit import TokenBucket
+    limiter = TokenBucket(rate=600, burst=5)
+    r = webapi.RedcapRequester(redcap_server.url, "faketoken", rate_limiter=limiter)
+    redcap_server.throttle = 2
+    assert r.get_version() == "8.5.28"
+    assert redcap_server.calls["version"] == 3
+    stats = limiter.stats
+    assert stats["throttled"] == 2
+    assert stats["waits"] >= 1
+    assert stats["rate_per_minute"] < 600
+
+def test_throttled_streamed_responses_are_closed_before_retrying(redcap_server, monkeypatch):
+    from scred.ratelimit import TokenBucket
+    closed = []
+    original = webapi.requests.Response.close
+    def close(response):
+        closed.append(response.status_code)
+        original(response)
+    monkeypatch.setattr(webapi.requests.Response, "close", close)
+    limiter = TokenBucket(rate=6000, burst=5)
+    r = webapi.RedcapRequester(redcap_server.url, "faketoken", rate_limiter=limiter)
+    redcap_server.throttle = 2
+    with r.post(stream=True, content="version") as response:
+        assert response.status_code == 200
+        assert closed == [429, 429]
+
+def test_requester_raises_when_throttled_too_often(redcap_server):
+    from scred.ratelimit import TokenBucket
+    limiter = TokenBucket(rate=6000, burst=5)
+    r = webapi.RedcapRequester(
+        redcap_server.url, "faketoken", rate_limiter=limiter, max_throttle_retries=1,
+    )
+    redcap_server.throttle = 5
+    with pytest.raises(webapi.requests.HTTPError):
+        r.get_version()
+
+def test_requester_cache_answers_repeated_reads(redcap_server):
+    r = webapi.RedcapRequester(redcap_server.url, "TOKEN", cache=True)
+    for _ in range(3):
+        assert r.get_metadata() == redcap_server.metadata
+        r.post(content="record", fields="record_id")
+    assert redcap_server.calls["metadata"] == 1
+    assert redcap_server.calls["record"] == 1
+    r.post(content="record", fields="form1_gate")
+    assert redcap_server.calls["record"] == 2
+    stats = r.cache.stats
+    assert (stats["hits"], stats["misses"]) == (4, 3)
+
+def test_requester_cache_never_caches_writes(redcap_server):
+    r = webapi.RedcapRequester(redcap_server.url, "TOKEN", cache=True)
+    data = json.dumps([{"record_id": "1", "form1_q2": "new"}])
+    for _ in range(2):
+        r.post(content="record", action="import", data=data, returnContent="count")
+    assert redcap_server.calls["record"] == 2
+    assert r.cache.stats["entries"] == 0
+
+def test_requester_cache_forgets_records_after_import(redcap_server):
+    r = webapi.RedcapRequester(redcap_server.url, "TOKEN", cache=True)
+    before = r.post(content="record", records="1").json()
+    r.post(content="record", action="import", returnContent="count",
+           data=json.dumps([{"record_id": "1", "form1_q2": "new"}]))
+    after = r.post(content="record", records="1").json()
+    assert before[0]["form1_q2"] != "new"
+    assert after[0]["form1_q2"] == "new"
+
+def test_concurrent_identical_requests_share_one_call(redcap_server):
+    from concurrent.futures import ThreadPoolExecutor
+    redcap_server.latency = 0.3
+    r = webapi.RedcapRequester(redcap_server.url, "TOKEN")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        same = list(pool.map(lambda _: r.post(content="record", records="1").json(), range(8)))
+        different = list(pool.map(lambda i: r.post(content="record", records=str(i)).json(), range(1, 5)))
+    assert all( rows == same[0] for rows in same )
+    assert [ rows[0]["record_id"] for rows in different ] == ["1", "2", "3", "4"]
+    assert redcap_server.calls["record"] == 1 + 4
+    assert r.in_flight.stats == {"calls": 5, "shared": 7}
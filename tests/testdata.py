@@ -2,6 +2,7 @@
 # the test data we create returns everything in the correct format.
 
 import json
+import random
 
 import pytest
 
@@ -48,6 +49,87 @@ def get_stored_neurogap_exportFieldNames_response():
         raw = json.load(fp)
     return raw
 
+# ---------------------------------------------------
+# Synthetic projects shaped like real ones: a record ID, then forms that open with a
+# yes/no "gate" question whose answer controls the rest of the form.
+
+METADATA_COLUMNS = [
+    "field_name", "form_name", "section_header", "field_type", "field_label",
+    "select_choices_or_calculations", "field_note",
+    "text_validation_type_or_show_slider_number", "text_validation_min",
+    "text_validation_max", "identifier", "branching_logic", "required_field",
+    "custom_alignment", "question_number", "matrix_group_name", "matrix_ranking",
+    "field_annotation",
+]
+
+def make_field(field_name, form_name, field_type, **kwargs):
+    field = dict.fromkeys(METADATA_COLUMNS, "")
+    field.update(field_name=field_name, form_name=form_name, field_type=field_type)
+    field.update(kwargs)
+    return field
+
+def get_fake_project_metadata(n_forms=3, fields_per_form=10):
+    metadata = [make_field("record_id", "enrollment", "text")]
+    for f in range(1, n_forms + 1):
+        form = f"form{f}"
+        gate = f"{form}_gate"
+        metadata.append(make_field(gate, form, "yesno"))
+        for n in range(1, fields_per_form):
+            name = f"{form}_q{n}"
+            if n % 3 == 0:
+                metadata.append(make_field(
+                    name, form, "checkbox",
+                    select_choices_or_calculations="1, A | 2, B | 3, C",
+                    branching_logic=f"[{gate}] = '1'",
+                ))
+            elif n % 3 == 1:
+                metadata.append(make_field(
+                    name, form, "radio",
+                    select_choices_or_calculations="0, No | 1, Yes",
+                    branching_logic=f"[{gate}] = '1'",
+                ))
+            else:
+                metadata.append(make_field(
+                    name, form, "text",
+                    branching_logic=f"[{gate}] = '1' and [{form}_q{n - 1}] = '1'",
+                ))
+    return metadata
+
+def get_fake_project_records(metadata, n_records=20, seed=0):
+    """
+    Records consistent with the branching logic in `metadata`, with an occasional
+    blank where an answer was expected.
+    """
+    rng = random.Random(seed)
+    forms = list(dict.fromkeys(f["form_name"] for f in metadata))
+    records = []
+    for r in range(1, n_records + 1):
+        record = {}
+        for field in metadata:
+            name, ftype = field["field_name"], field["field_type"]
+            gate = f"{field['form_name']}_gate"
+            shown = not field["branching_logic"] or record.get(gate) == "1"
+            if shown and ftype == "text" and name != "record_id":
+                previous = name.rsplit("_q", 1)[0] + f"_q{int(name.rsplit('_q', 1)[1]) - 1}"
+                shown = record.get(previous) == "1"
+            answered = shown and rng.random() > 0.05
+            if name == "record_id":
+                record[name] = str(r)
+            elif ftype == "checkbox":
+                for choice in ("1", "2", "3"):
+                    checked = answered and rng.random() > 0.5
+                    record[f"{name}___{choice}"] = "1" if checked else "0"
+            elif ftype == "yesno":
+                record[name] = rng.choice(["0", "1"])
+            elif ftype == "radio":
+                record[name] = rng.choice(["0", "1"]) if answered else ""
+            else:
+                record[name] = f"text {r}" if answered else ""
+        for form in forms:
+            record[f"{form}_complete"] = "2"
+        records.append(record)
+    return records
+
 # ---------------------------------------------------
 
 class TestDataResponses: